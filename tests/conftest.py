@@ -0,0 +1,17 @@
+import pytest
+
+from xrdimageutil import cache
+
+@pytest.fixture(autouse=True)
+def rsm_cache(tmp_path_factory, monkeypatch):
+    """Points the RSM cache at a temporary directory for every test.
+
+    The environment variable is set too, so that worker processes spawned
+    by a test use the same directory.
+    """
+
+    directory = tmp_path_factory.mktemp("rsm-cache")
+    monkeypatch.setenv("XRDIMAGEUTIL_CACHE_DIR", str(directory))
+    monkeypatch.setattr(cache, "rsm_cache", cache.RSMCache(directory=directory))
+
+    return cache.rsm_cache
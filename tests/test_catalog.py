@@ -1,5 +1,7 @@
+import numpy as np
 import os
 
+from xrdimageutil.roi import RectROI
 from xrdimageutil.structures import Catalog
 
 class TestCatalog:
@@ -30,6 +32,21 @@ class TestCatalog:
         results = catalog.search(sample="erte3")
         assert len(results) == 19
 
+    def test_search_with_scan_id_range_expects_inclusive_matches(self):
+        catalog = Catalog(local_name=self.catalog_name)
+        results = catalog.search(scan_id=(60, 65))
+        assert sorted(catalog.scan_index[uid]["scan_id"] for uid in results) == list(range(60, 66))
+
+    def test_search_with_motors_and_point_count_expects_all_criteria_matched(self):
+        catalog = Catalog(local_name=self.catalog_name)
+        results = catalog.search(motors="fourc_omega", point_count=(50, None))
+        expected = [
+            uid for uid, entry in catalog.scan_index.items()
+            if "fourc_omega" in (entry["motors"] or []) and entry["point_count"] is not None and entry["point_count"] >= 50
+        ]
+        assert sorted(results) == sorted(expected)
+        assert catalog.search(motors=["fourc_omega", "invalid-motor"]) == []
+
     # Scans
     def test_get_scan_with_id_and_uid_expects_equal(self):
         scan_id = 71
@@ -40,4 +57,104 @@ class TestCatalog:
         scan_with_uid = catalog.get_scan(scan_uid)
 
         assert scan_with_id == scan_with_uid
+
+    def test_get_scan_with_lazy_catalog_expects_scan_created_on_demand(self):
+        scan_uid = "765b60a4-106b-4975-907e-50d3612d24b3"
+
+        catalog = Catalog(local_name=self.catalog_name, lazy=True)
+        assert len(catalog.scan_uid_dict) == 0
+
+        scan = catalog.get_scan(scan_uid)
+        assert scan.scan_id == 71
+        assert list(catalog.scan_uid_dict.keys()) == [scan_uid]
+
+    def test_get_scan_with_negative_id_expects_most_recent_scan(self):
+        catalog = Catalog(local_name=self.catalog_name)
+        scan = catalog.get_scan(-1)
+        assert scan.scan_id == 71
+
+    # Gridding
+    def test_grid_scans_with_one_scan_expects_equal_to_scan_gridding(self):
+        shape = (20, 20, 20)
+        catalog = Catalog(local_name=self.catalog_name)
+        scan = catalog.get_scan(70)
+        scan.grid_data(shape=shape)
+        merged_data = catalog.grid_scans([scan], shape=shape)
+
+        assert np.array_equal(merged_data["data"], scan.gridded_data["data"])
+        for dim in ["H", "K", "L"]:
+            assert np.array_equal(merged_data["coords"][dim], scan.gridded_data["coords"][dim])
+
+    def test_grid_scans_with_workers_expects_equal_to_serial_gridding(self):
+        shape = (20, 20, 20)
+        catalog = Catalog(local_name=self.catalog_name)
+        scans = catalog.get_scans([69, 70])
+        merged_data = catalog.grid_scans(scans, shape=shape)
+        parallel_merged_data = catalog.grid_scans(scans, shape=shape, workers=2)
+
+        assert np.array_equal(merged_data["data"], parallel_merged_data["data"])
+
+    def test_process_scans_with_failing_scan_expects_isolated_error(self, tmp_path):
+        catalog = Catalog(local_name=self.catalog_name)
+        roi = RectROI(dims=["H", "K", "L"])
+        roi.set_bounds({"H": (None, None), "K": (None, None), "L": (None, None)})
+        roi.set_calculation(output="average", dims=["H", "K"])
+        progress = []
+
+        # Scan 53 has no primary stream
+        results = catalog.process_scans(
+            shape=(20, 20, 20), ids=[53, 70], rois=[roi], output_dir=str(tmp_path),
+            progress=lambda done, total, result: progress.append((done, total))
+        )
+        scan_53, scan_70 = catalog.get_scans([53, 70])
+
+        assert list(results.keys()) == [scan_53.uid, scan_70.uid]
+        assert progress == [(1, 2), (2, 2)]
+        assert results[scan_53.uid]["error"] is not None
+        assert results[scan_70.uid]["error"] is None
+        assert os.path.exists(results[scan_70.uid]["path"])
+
+        scan_70.grid_data(shape=(20, 20, 20), chunk_size=10)
+        roi.apply_to_scan(scan_70, "gridded")
+        assert np.array_equal(results[scan_70.uid]["roi_outputs"][0]["data"], roi.get_output()["data"])
+
+    def test_process_scans_serially_expects_caller_catalog_reused(self, monkeypatch):
+        catalog = Catalog(local_name=self.catalog_name)
+        scan_70 = catalog.get_scan(70)
+
+        # Catalogs index every run when they are built, so none are built per scan
+        def _fail(*args, **kwargs):
+            raise AssertionError("A catalog was built while processing scans.")
+        monkeypatch.setattr(Catalog, "__init__", _fail)
+
+        results = catalog.process_scans(shape=(20, 20, 20), ids=[70])
+        assert results[scan_70.uid]["error"] is None
+        assert scan_70.gridded_data["data"] is None
+
+    def test_process_scans_with_workers_expects_equal_to_serial_processing(self, tmp_path):
+        catalog = Catalog(local_name=self.catalog_name)
+        roi = RectROI(dims=["H", "K", "L"])
+        roi.set_bounds({"H": (None, None), "K": (None, None), "L": (None, None)})
+        roi.set_calculation(output="average", dims=["H", "K"])
+        progress = []
+
+        # Scan 53 has no primary stream
+        results = catalog.process_scans(shape=(20, 20, 20), ids=[53, 70, 71], rois=[roi])
+        parallel_results = catalog.process_scans(
+            shape=(20, 20, 20), ids=[53, 70, 71], rois=[roi], output_dir=str(tmp_path), workers=2,
+            progress=lambda done, total, result: progress.append((done, total))
+        )
+        scan_53, scan_70, scan_71 = catalog.get_scans([53, 70, 71])
+
+        assert list(parallel_results.keys()) == [scan_53.uid, scan_70.uid, scan_71.uid]
+        assert progress == [(1, 3), (2, 3), (3, 3)]
+        assert parallel_results[scan_53.uid]["error"] is not None
+        for scan in [scan_70, scan_71]:
+            assert parallel_results[scan.uid]["error"] is None
+            assert parallel_results[scan.uid]["scan_id"] == results[scan.uid]["scan_id"]
+            assert os.path.exists(parallel_results[scan.uid]["path"])
+            assert np.array_equal(
+                parallel_results[scan.uid]["roi_outputs"][0]["data"], 
+                results[scan.uid]["roi_outputs"][0]["data"]
+            )
 print('test')
\ No newline at end of file
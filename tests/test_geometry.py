@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+import pytest
+import xrayutilities as xu
+import yaml
+
+from xrdimageutil import geometry, utils
+from xrdimageutil.structures import Catalog
+
+class TestGeometry:
+
+    relative_path = "data/singh"
+    absolute_path = os.path.abspath(path=relative_path)
+    catalog_name = "test-catalog"
+
+    def test_load_profiles_with_valid_yaml_expects_registered_profile(self, tmp_path):
+        profile_fields = geometry.get_profile("6-ID-B").to_dict()
+        profile_path = tmp_path / "profiles.yml"
+        with open(profile_path, "w") as f:
+            yaml.safe_dump({"test-profile": profile_fields}, f)
+
+        assert geometry.load_profiles(profile_path) == ["test-profile"]
+        assert geometry.get_profile("test-profile").to_dict() == profile_fields
+
+    def test_profile_with_missing_field_expects_value_error(self):
+        profile_fields = geometry.get_profile("6-ID-B").to_dict()
+        del profile_fields["detector_distance"]
+
+        with pytest.raises(ValueError):
+            geometry.GeometryProfile("test-profile", **profile_fields)
+
+    def test_profile_with_sample_directions_expects_value_error(self):
+        profile_fields = geometry.get_profile("6-ID-B").to_dict()
+        profile_fields["sample_normal_direction"] = [0, 0, 1]
+
+        with pytest.raises(ValueError):
+            geometry.GeometryProfile("test-profile", **profile_fields)
+
+    def test_rsm_with_equal_profile_expects_equal_rsm(self):
+        scan_id = 70
+        profile_fields = geometry.get_profile("6-ID-B").to_dict()
+        scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        profile_scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        profile_scan.geometry_profile = geometry.GeometryProfile("test-profile", **profile_fields)
+        assert np.array_equal(scan.rsm, profile_scan.rsm)
+
+    def test_rsm_expects_close_to_xrayutilities_area_conversion(self):
+        scan_id = 70
+        points = np.s_[0:3]
+        scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        rsm_params = utils._get_rsm_params(scan)
+        rsm = utils._compute_rsm(rsm_params, points=points)
+
+        q_conversion = xu.experiment.QConversion(
+            sampleAxis=rsm_params["sample_circle_directions"],
+            detectorAxis=rsm_params["detector_circle_directions"],
+            r_i=rsm_params["primary_beam_direction"]
+        )
+        # Sample directions do not affect Ang2Q when a UB matrix is given
+        hxrd = xu.HXRD(idir=[0, 1, 0], ndir=[0, 0, 1], qconv=q_conversion)
+        hxrd.Ang2Q.init_area(
+            *rsm_params["pixel_directions"],
+            cch1=rsm_params["center_channel_pixels"][0], cch2=rsm_params["center_channel_pixels"][1],
+            Nch1=rsm_params["pixel_count"][0], Nch2=rsm_params["pixel_count"][1],
+            pwidth1=rsm_params["pixel_size"][0], pwidth2=rsm_params["pixel_size"][1],
+            distance=rsm_params["detector_distance"], roi=rsm_params["roi"]
+        )
+        circle_values = [circle[points] for circle in rsm_params["circle_values"]]
+        qx, qy, qz = hxrd.Ang2Q.area(
+            *circle_values, 
+            en=rsm_params["energy_values"][points], 
+            UB=rsm_params["ub_matrix"]
+        )
+
+        assert np.allclose(rsm, np.stack([qx, qy, qz], axis=-1), rtol=0, atol=1e-12)
+
+    def test_hkl_centers_expects_profile_config_device_fields(self):
+        scan_id = 70
+        scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        primary = scan.read_primary(scalars_only=True)
+        config_device = utils._get_geometry_profile(scan).config_device
+
+        for axis, centers in zip("hkl", utils._get_hkl_centers(scan)):
+            assert np.array_equal(centers, primary[f"{config_device}_{axis}"].values)
+
+    def test_rsm_params_with_frameless_image_shape_expects_equal_pixel_count(self, monkeypatch):
+        scan_id = 70
+        scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        rsm_params = utils._get_rsm_params(scan)
+
+        # Some detectors report a (rows, columns) shape without a frame dimension
+        data_keys = utils._get_primary_data_keys(scan)
+        image_field = utils._get_geometry_profile(scan).image_field
+        frameless_data_keys = dict(data_keys)
+        frameless_data_keys[image_field] = dict(data_keys[image_field], shape=data_keys[image_field]["shape"][1:])
+        monkeypatch.setattr(utils, "_get_primary_data_keys", lambda scan: frameless_data_keys)
+
+        assert utils._get_rsm_params(scan)["pixel_count"] == rsm_params["pixel_count"] == [487, 195]
@@ -0,0 +1,171 @@
+import os
+
+import numpy as np
+import pytest
+import xrayutilities as xu
+
+from xrdimageutil.gridder import Gridder, SparseVolume
+from xrdimageutil.roi import LineROI, RectROI
+from xrdimageutil.structures import Catalog
+
+class TestGridder:
+
+    relative_path = "data/singh"
+    absolute_path = os.path.abspath(path=relative_path)
+    catalog_name = "test-catalog"
+
+    def test_grid_data_expects_equal_to_xu_gridder(self):
+        shape = (20, 20, 20)
+        scan = Catalog(local_name=self.catalog_name).get_scan(70)
+        scan.grid_data(shape=shape)
+        bounds = scan.rsm_bounds
+
+        xu_gridder = xu.Gridder3D(*shape)
+        xu_gridder.KeepData(True)
+        xu_gridder.dataRange(*bounds["H"], *bounds["K"], *bounds["L"])
+        xu_gridder(
+            scan.rsm[..., 0], scan.rsm[..., 1], scan.rsm[..., 2], 
+            np.asarray(scan.raw_data["data"], dtype=np.float64)
+        )
+
+        assert np.array_equal(xu_gridder.data, scan.gridded_data["data"])
+        assert np.array_equal(xu_gridder.xaxis, scan.gridded_data["coords"]["H"])
+        assert scan.gridded_data["count"].sum() == scan.raw_data["data"].size
+
+    def test_merge_with_split_values_expects_equal_to_single_gridder(self):
+        rng = np.random.default_rng(0)
+        h, k, l, values = rng.uniform(-1, 1, size=(4, 1000))
+        bounds = {"H": (-1, 1), "K": (-1, 1), "L": (-1, 1)}
+
+        gridder = Gridder((10, 10, 10), bounds)
+        gridder.add(h, k, l, values)
+        first_half, second_half = Gridder((10, 10, 10), bounds), Gridder((10, 10, 10), bounds)
+        first_half.add(h[:500], k[:500], l[:500], values[:500])
+        second_half.add(h[500:], k[500:], l[500:], values[500:])
+        first_half.merge(second_half)
+
+        assert np.array_equal(gridder.count, first_half.count)
+        assert np.allclose(gridder.get_data(), first_half.get_data(), rtol=1e-12, atol=0)
+
+    def test_merge_with_unequal_bounds_expects_value_error(self):
+        gridder = Gridder((10, 10, 10), {"H": (-1, 1), "K": (-1, 1), "L": (-1, 1)})
+        other = Gridder((10, 10, 10), {"H": (-1, 1), "K": (-1, 1), "L": (0, 1)})
+
+        with pytest.raises(ValueError):
+            gridder.merge(other)
+
+    def test_grid_data_with_monitor_expects_normalized_sum(self):
+        shape = (20, 20, 20)
+        scan = Catalog(local_name=self.catalog_name).get_scan(70)
+        scan.grid_data(shape=shape)
+        monitored_scan = Catalog(local_name=self.catalog_name).get_scan(70)
+        monitored_scan.grid_data(shape=shape, monitor="Seconds")
+
+        monitor_values = np.asarray(monitored_scan.read_primary(fields=["Seconds"])["Seconds"].values, dtype=np.float64)
+        frame_totals = np.asarray(scan.raw_data["data"], dtype=np.float64).sum(axis=(1, 2))
+
+        assert np.array_equal(scan.gridded_data["count"], monitored_scan.gridded_data["count"])
+        assert np.isclose(monitored_scan.gridded_data["sum"].sum(), (frame_totals / monitor_values).sum(), rtol=1e-9)
+
+    def test_grid_data_with_float32_dtype_expects_compact_counts_and_volume(self):
+        shape = (20, 20, 20)
+        scan = Catalog(local_name=self.catalog_name).get_scan(70)
+        scan.grid_data(shape=shape, chunk_size=8)
+        compact_scan = Catalog(local_name=self.catalog_name).get_scan(70)
+        compact_scan.dtype = "float32"
+        compact_scan.grid_data(shape=shape, chunk_size=8)
+
+        assert compact_scan.gridded_data["data"].dtype == np.float32
+        assert compact_scan.gridded_data["data"].nbytes == scan.gridded_data["data"].nbytes // 2
+        assert compact_scan._gridder.sum.dtype == np.float64
+        assert compact_scan._gridder.count.dtype == np.int32
+        assert compact_scan._gridder.count.nbytes == scan._gridder.count.nbytes // 2
+        assert compact_scan._gridder.count.sum() == scan._gridder.count.sum()
+
+    def test_grid_data_with_sparse_expects_equal_to_dense_gridding(self):
+        shape = (20, 20, 20)
+        scan = Catalog(local_name=self.catalog_name).get_scan(70)
+        scan.grid_data(shape=shape)
+        sparse_scan = Catalog(local_name=self.catalog_name).get_scan(70)
+        sparse_scan.grid_data(shape=shape, chunk_size=8, sparse=True)
+
+        assert type(sparse_scan.gridded_data["data"]) == SparseVolume
+        assert sparse_scan.gridded_data["data"].nnz == np.count_nonzero(scan.gridded_data["count"])
+        assert np.array_equal(scan.gridded_data["data"], np.asarray(sparse_scan.gridded_data["data"]))
+        assert np.array_equal(scan.gridded_data["count"], np.asarray(sparse_scan.gridded_data["count"]))
+
+    def test_roi_with_sparse_volume_expects_equal_to_dense_volume(self):
+        rng = np.random.default_rng(0)
+        data = rng.random((20, 20, 20))
+        data[data < 0.9] = 0
+        flat_idxs = np.flatnonzero(data)
+        sparse_data = SparseVolume(data.shape, flat_idxs, data.reshape(-1)[flat_idxs])
+        coords = dict([(dim, np.linspace(0, 1, 20)) for dim in ["H", "K", "L"]])
+
+        rect_roi = RectROI(dims=["H", "K", "L"])
+        rect_roi.set_bounds({"H": (0.2, 0.6), "K": (None, 0.5), "L": (0.1, None)})
+        rect_roi.set_calculation(output="average", dims=["H"])
+        rect_roi.apply(data, coords)
+        dense_output = rect_roi.get_output()["data"]
+        rect_roi.apply(sparse_data, coords)
+        assert np.array_equal(dense_output, rect_roi.get_output()["data"])
+
+        line_roi = LineROI(dims=["H", "K", "L"])
+        line_roi.set_endpoints({"H": 0.1, "K": 0.2, "L": 0.3}, {"H": 0.9, "K": 0.7, "L": 0.5})
+        line_roi.set_calculation(output="values", dims=["L"])
+        line_roi.apply(data, coords)
+        dense_output = line_roi.get_output()["data"]
+        line_roi.apply(sparse_data, coords)
+        assert np.array_equal(dense_output, line_roi.get_output()["data"])
+
+    def test_sparse_volume_indexing_expects_equal_to_dense_indexing(self):
+        rng = np.random.default_rng(0)
+        data = rng.random((7, 8, 9))
+        data[data < 0.8] = 0
+        flat_idxs = np.flatnonzero(data)
+        sparse_data = SparseVolume(data.shape, flat_idxs, data.reshape(-1)[flat_idxs])
+        idxs = np.array([0, 3, -1])
+
+        for key in [(1, 2, 3), (slice(1, 5), slice(None, None, 2)), (Ellipsis, 4), (idxs, idxs, idxs), (slice(None), idxs, idxs), (idxs, slice(2, 6), idxs)]:
+            assert np.array_equal(data[key], sparse_data[key])
+        assert np.array_equal(np.transpose(data, (2, 0, 1)), np.asarray(np.transpose(sparse_data, (2, 0, 1))))
+        assert np.amax(data) == np.amax(sparse_data)
+
+        # Densifying is always a copy
+        assert sparse_data.__array__(np.float32, copy=True).dtype == np.float32
+        with pytest.raises(ValueError):
+            sparse_data.__array__(copy=False)
+
+    def test_downsample_expects_block_mean(self):
+        rng = np.random.default_rng(0)
+        h, k, l, values = rng.uniform(-1, 1, size=(4, 10000))
+        bounds = {"H": (-1, 1), "K": (-1, 1), "L": (-1, 1)}
+        gridder = Gridder((11, 12, 13), bounds)
+        gridder.add(h, k, l, values)
+        sparse_gridder = Gridder((11, 12, 13), bounds, sparse=True)
+        sparse_gridder.add(h, k, l, values)
+
+        coarse_gridder = gridder.downsample()
+        block = np.s_[2:4, 4:6, 6:8]
+        assert coarse_gridder.shape == (6, 6, 7)
+        assert np.isclose(coarse_gridder.get_data()[1, 2, 3], gridder.sum[block].sum() / gridder.count[block].sum())
+        assert np.isclose(coarse_gridder.get_coords()["H"][1], gridder.get_coords()["H"][2:4].mean())
+        assert np.array_equal(coarse_gridder.count, np.asarray(sparse_gridder.downsample().count))
+        assert np.allclose(coarse_gridder.get_data(), np.asarray(sparse_gridder.downsample().get_data()))
+
+    def test_grid_data_with_pyramid_levels_expects_downsampled_levels(self):
+        shape = (20, 20, 20)
+        scan = Catalog(local_name=self.catalog_name).get_scan(70)
+        scan.grid_data(shape=shape, pyramid_levels=2)
+        pyramid = scan.gridded_data["pyramid"]
+
+        assert len(pyramid) == 3
+        assert pyramid[0]["data"] is scan.gridded_data["data"]
+        assert pyramid[1]["data"].shape == (10, 10, 10)
+        assert pyramid[2]["data"].shape == (5, 5, 5)
+        count = scan.gridded_data["count"].reshape(10, 2, 10, 2, 10, 2).sum(axis=(1, 3, 5))
+        total = scan.gridded_data["sum"].reshape(10, 2, 10, 2, 10, 2).sum(axis=(1, 3, 5))
+        assert np.allclose(pyramid[1]["data"][count > 0], total[count > 0] / count[count > 0])
+
+        with pytest.raises(ValueError):
+            scan.grid_data(shape=shape, pyramid_levels=5)
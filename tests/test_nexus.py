@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pytest
+
+from xrdimageutil import nexus
+from xrdimageutil.roi import RectROI
+from xrdimageutil.structures import Catalog
+
+class TestNexus:
+
+    relative_path = "data/singh"
+    absolute_path = os.path.abspath(path=relative_path)
+    catalog_name = "test-catalog"
+
+    def test_write_scan_with_rsm_and_raw_data_expects_equal_when_read(self, tmp_path):
+        scan = Catalog(local_name=self.catalog_name).get_scan(70)
+        scan.grid_data(shape=(20, 20, 20))
+        path = tmp_path / "scan_70.nxs"
+        nexus.write_scan(scan, path, rsm=True, raw_data=True)
+
+        with nexus.read_scan(path) as scan_file:
+            assert scan_file.uid == scan.uid
+            assert scan_file.scan_id == scan.scan_id
+            assert np.array_equal(scan_file.gridded_data["data"][()], scan.gridded_data["data"])
+            for dim in ["H", "K", "L"]:
+                assert np.array_equal(scan_file.gridded_data["coords"][dim], scan.gridded_data["coords"][dim])
+            assert np.array_equal(scan_file.rsm[()], scan.rsm)
+            assert scan_file.rsm_bounds == scan.rsm_bounds
+            assert np.array_equal(scan_file.raw_data["data"][()], np.asarray(scan.raw_data["data"]))
+
+    def test_write_scan_with_sparse_gridded_data_expects_equal_when_read(self, tmp_path):
+        scan = Catalog(local_name=self.catalog_name).get_scan(70)
+        scan.grid_data(shape=(20, 20, 20), sparse=True)
+        path = tmp_path / "scan_70.nxs"
+        nexus.write_scan(scan, path, compression=False)
+
+        with nexus.read_scan(path) as scan_file:
+            assert np.array_equal(scan_file.gridded_data["data"][()], np.asarray(scan.gridded_data["data"]))
+            assert scan_file.rsm is None and scan_file.raw_data is None
+
+    def test_apply_to_scan_with_scan_file_expects_equal_to_scan(self, tmp_path):
+        scan = Catalog(local_name=self.catalog_name).get_scan(70)
+        scan.grid_data(shape=(20, 20, 20))
+        path = tmp_path / "scan_70.nxs"
+        nexus.write_scan(scan, path)
+
+        roi = RectROI(dims=["H", "K", "L"])
+        roi.set_bounds({"H": (None, None), "K": (None, None), "L": (None, None)})
+        roi.set_calculation(output="average", dims=["H"])
+        roi.apply_to_scan(scan, "gridded")
+        output = roi.get_output()["data"]
+        with nexus.read_scan(path) as scan_file:
+            roi.apply_to_scan(scan_file, "gridded")
+        
+        assert np.array_equal(output, roi.get_output()["data"])
+
+    def test_write_scan_without_gridded_data_expects_value_error(self, tmp_path):
+        scan = Catalog(local_name=self.catalog_name).get_scan(70)
+
+        with pytest.raises(ValueError):
+            nexus.write_scan(scan, tmp_path / "scan_70.nxs")
@@ -0,0 +1,100 @@
+import numpy as np
+
+from xrdimageutil.gridder import SparseVolume
+from xrdimageutil.roi import PlaneROI
+
+class TestPlaneROI:
+
+    coords = {"H": np.linspace(0, 1, 30), "K": np.linspace(0, 2, 35), "L": np.linspace(-1, 1, 40)}
+    point = {"H": 0.4, "K": 1.1, "L": 0.2}
+    normal = {"H": 1, "K": -1, "L": 2}
+
+    def test_apply_expects_values_at_truncated_plane_pixels(self):
+        data = np.random.default_rng(0).random((30, 35, 40))
+        plane_roi = PlaneROI(dims=["H", "K", "L"])
+        plane_roi.set_plane(self.point, self.normal)
+        plane_roi.set_calculation(output="values")
+        plane_roi.apply(data, self.coords)
+
+        plane_pixels = plane_roi._get_plane_positions(data, self.coords)[0].astype(np.int64)
+        expected = np.zeros(plane_pixels.shape[:2])
+        for i in range(plane_pixels.shape[0]):
+            for j in range(plane_pixels.shape[1]):
+                pixel = plane_pixels[i, j]
+                if np.all((pixel >= 0) & (pixel < data.shape)):
+                    expected[i, j] = data[tuple(pixel)]
+
+        assert np.array_equal(plane_roi.get_output()["data"], np.fliplr(expected))
+
+    def test_apply_with_linear_interpolation_expects_exact_linear_field(self):
+        data = np.fromfunction(lambda i, j, k: 2 * i + 3 * j - k, (30, 35, 40))
+        plane_roi = PlaneROI(dims=["H", "K", "L"])
+        plane_roi.set_plane(self.point, self.normal)
+        plane_roi.set_calculation(output="values", interpolation="linear")
+        plane_roi.apply(data, self.coords)
+        output = plane_roi.get_output()["data"]
+
+        positions = np.fliplr(plane_roi._get_plane_positions(data, self.coords)[0])
+        inside = np.all((positions >= 0) & (positions <= np.array(data.shape) - 1), axis=-1)
+        expected = 2 * positions[..., 0] + 3 * positions[..., 1] - positions[..., 2]
+        assert np.allclose(output[inside], expected[inside])
+
+        flat_idxs = np.flatnonzero(data)
+        plane_roi.apply(SparseVolume(data.shape, flat_idxs, data.reshape(-1)[flat_idxs]), self.coords)
+        assert np.allclose(plane_roi.get_output()["data"], output)
+
+    def test_apply_with_slices_and_axis_aligned_normal_expects_data_slice(self):
+        data = np.random.default_rng(0).random((30, 35, 40))
+        plane_roi = PlaneROI(dims=["H", "K", "L"])
+        plane_roi.set_plane({"H": 0.5, "K": 1.0, "L": self.coords["L"][17]}, {"H": 0, "K": 0, "L": 1})
+        plane_roi.set_calculation(output="slices", shape=(30, 35))
+        plane_roi.apply(data, self.coords)
+        output = plane_roi.get_output()
+
+        assert np.allclose(output["data"][0], data[:, :, 17])
+        assert np.allclose(output["coords"]["u"] + 0.5, self.coords["H"])
+        assert output["basis"]["u"] == {"H": 1.0, "K": 0.0, "L": 0.0}
+
+    def test_apply_with_oblique_slices_expects_linear_field_at_in_plane_positions(self):
+        data = np.fromfunction(lambda i, j, k: 2 * i + 3 * j - k, (30, 35, 40))
+        offsets = [-0.2, 0, 0.3]
+        plane_roi = PlaneROI(dims=["H", "K", "L"])
+        plane_roi.set_plane(self.point, self.normal)
+        plane_roi.set_calculation(output="slices", interpolation="linear", shape=(20, 25), offsets=offsets)
+        plane_roi.apply(data, self.coords)
+        output = plane_roi.get_output()
+        assert output["data"].shape == (3, 20, 25)
+
+        normal, u, v = [np.array(list(output["basis"][name].values())) for name in ["normal", "u", "v"]]
+        assert np.allclose(np.dot([normal, u, v], np.transpose([normal, u, v])), np.eye(3))
+
+        point = np.array(list(self.point.values()))
+        positions = (
+            point 
+            + np.reshape(offsets, (-1, 1, 1, 1)) * normal 
+            + output["coords"]["u"][np.newaxis, :, np.newaxis, np.newaxis] * u 
+            + output["coords"]["v"][np.newaxis, np.newaxis, :, np.newaxis] * v
+        )
+        origins = np.array([self.coords[dim][0] for dim in self.coords])
+        steps = np.array([self.coords[dim][1] - self.coords[dim][0] for dim in self.coords])
+        pixel_positions = (positions - origins) / steps
+        inside = np.all((pixel_positions >= 0) & (pixel_positions <= np.array(data.shape) - 1), axis=-1)
+        expected = 2 * pixel_positions[..., 0] + 3 * pixel_positions[..., 1] - pixel_positions[..., 2]
+        assert np.any(inside) and np.allclose(output["data"][inside], expected[inside])
+
+        flat_idxs = np.flatnonzero(data)
+        plane_roi.apply(SparseVolume(data.shape, flat_idxs, data.reshape(-1)[flat_idxs]), self.coords)
+        assert np.allclose(plane_roi.get_output()["data"], output["data"])
+
+    def test_apply_after_switching_from_slices_to_values_expects_no_basis(self):
+        data = np.random.default_rng(0).random((30, 35, 40))
+        plane_roi = PlaneROI(dims=["H", "K", "L"])
+        plane_roi.set_plane(self.point, self.normal)
+        plane_roi.set_calculation(output="slices")
+        plane_roi.apply(data, self.coords)
+        assert "basis" in plane_roi.get_output()
+
+        plane_roi.set_calculation(output="values")
+        plane_roi.apply(data, self.coords)
+        assert set(plane_roi.get_output().keys()) == {"data", "coords"}
+        assert plane_roi.get_output()["data"].ndim == 2
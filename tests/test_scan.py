@@ -1,6 +1,10 @@
 import os
 
-from xrdimageutil.structures import Catalog, Scan
+import numpy as np
+
+from xrdimageutil import cache, utils
+from xrdimageutil.roi import LineROI
+from xrdimageutil.structures import Catalog
 
 class TestScan:
 
@@ -24,4 +28,273 @@ class TestScan:
             assert False
         except KeyError:
             assert True
+
+    # Reciprocal space mapping
+    def test_rsm_with_valid_id_expects_rsm_for_every_pixel(self):
+        scan_id = 70
+        catalog = Catalog(local_name=self.catalog_name)
+        scan = catalog.get_scan(scan_id)
+        assert scan.rsm.shape == (scan.point_count(), 487, 195, 3)
+
+        # Batched conversion matches converting one point at a time
+        rsm_params = utils._get_rsm_params(scan)
+        point_rsms = [utils._compute_rsm(rsm_params, points=np.s_[i:i + 1]) for i in range(scan.point_count())]
+        assert np.array_equal(scan.rsm, np.concatenate(point_rsms))
+
+    # Primary stream
+    def test_read_primary_with_scalars_only_expects_no_image_field(self):
+        scan_id = 70
+        catalog = Catalog(local_name=self.catalog_name)
+        scan = catalog.get_scan(scan_id)
+        assert "pilatus100k_image" not in scan.read_primary(scalars_only=True).keys()
+
+    def test_rsm_with_cached_map_expects_equal_memory_map(self):
+        scan_id = 70
+        rsm = Catalog(local_name=self.catalog_name).get_scan(scan_id).rsm
+        cached_rsm = Catalog(local_name=self.catalog_name).get_scan(scan_id).rsm
+        assert type(cached_rsm) is np.memmap
+        assert np.array_equal(rsm, cached_rsm)
+
+    def test_rsm_bounds_with_cached_map_expects_rsm_min_and_max(self):
+        scan_id = 70
+        scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        cached_scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        for i, dim in enumerate(["H", "K", "L"]):
+            expected_bounds = (np.amin(scan.rsm[:,:,:,i]), np.amax(scan.rsm[:,:,:,i]))
+            assert scan.rsm_bounds[dim] == expected_bounds
+            assert cached_scan.rsm_bounds[dim] == expected_bounds
+
+    def test_rsm_with_float32_dtype_expects_rounded_float64_rsm(self):
+        scan_id = 70
+        scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        compact_scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        compact_scan.dtype = "float32"
+        assert compact_scan.rsm.dtype == np.float32
+        assert np.array_equal(compact_scan.rsm, scan.rsm.astype(np.float32))
+
+    def test_grid_data_with_cold_cache_expects_cached_rsm_and_bounds(self):
+        scan_id = 70
+        scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        rsm, rsm_bounds = scan.rsm, scan.rsm_bounds
+        cache.rsm_cache.clear()
+
+        for chunk_size in [None, 8]:
+            cold_scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+            cold_scan.grid_data(shape=(20, 20, 20), chunk_size=chunk_size)
+
+            geometry_hash = utils._get_geometry_hash(utils._get_rsm_params(cold_scan))
+            assert np.array_equal(cache.rsm_cache.get(scan.uid, geometry_hash), rsm)
+            assert cache.rsm_cache.get_bounds(scan.uid, geometry_hash) == rsm_bounds
+            cache.rsm_cache.clear()
+
+    def test_rsm_cache_with_shared_directory_expects_default_permissions_and_misses(self, tmp_path):
+        rsm_cache = cache.RSMCache(directory=tmp_path, max_size=2 * 8 * 10 * 3)
+        rsm = np.zeros((10, 3))
+        rsm_cache.put("a", "hash", rsm)
+        umask = cache._get_umask()
+        assert os.stat(rsm_cache._get_path("a", "hash")).st_mode & 0o777 == 0o666 & ~umask
+
+        # Entries removed by another process are misses, and are skipped when evicting
+        os.remove(rsm_cache._get_path("a", "hash"))
+        assert rsm_cache.get("a", "hash") is None
+        rsm_cache.put("b", "hash", rsm)
+        rsm_cache.put("c", "hash", rsm)
+        rsm_cache.put("d", "hash", rsm)
+        assert rsm_cache.get("b", "hash") is None and np.array_equal(rsm_cache.get("d", "hash"), rsm)
+
+    # Raw data
+    def test_raw_data_with_lazy_raw_data_expects_equal_frames(self):
+        scan_id = 70
+        scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        lazy_scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        lazy_scan.lazy_raw_data = True
+
+        assert type(lazy_scan.raw_data["data"]) is not np.ndarray
+        assert lazy_scan.raw_data["data"].shape == scan.raw_data["data"].shape
+        assert np.array_equal(np.asarray(lazy_scan.raw_data["data"][5]), scan.raw_data["data"][5])
+        assert np.array_equal(np.asarray(lazy_scan.raw_data["data"]), scan.raw_data["data"])
+
+    def test_handler_read_points_with_small_pool_expects_equal_frames(self):
+        scan = Catalog(local_name=self.catalog_name).get_scan(70)
+        resource = next(doc for name, doc in scan.bluesky_run.canonical(fill="no") if name == "resource")
+        fpath = os.path.join(self.absolute_path, "external_files", resource["root"], resource["resource_path"])
+
+        handler = utils.PilatusHDF5Handler(fpath, **resource["resource_kwargs"])
+        handler.pool_size = 4
+        frames = handler.read_points(range(scan.point_count()))
+        point_frames = [np.asarray(handler(point_number=i)) for i in range(scan.point_count())]
+        handler.close()
+
+        assert np.array_equal(np.swapaxes(frames[:, 0], 1, 2), scan.raw_data["data"])
+        assert np.array_equal(np.stack(point_frames), frames)
+
+    def test_handler_call_expects_lazy_point_chunked_like_dataset(self):
+        scan = Catalog(local_name=self.catalog_name).get_scan(70)
+        resource = next(doc for name, doc in scan.bluesky_run.canonical(fill="no") if name == "resource")
+        fpath = os.path.join(self.absolute_path, "external_files", resource["root"], resource["resource_path"])
+
+        handler = utils.PilatusHDF5Handler(fpath, **resource["resource_kwargs"])
+        point = handler(point_number=3)
+        dataset = handler._get_file(next(handler._fnames_for_point(3)))[handler._key]
+
+        assert type(point) is not np.ndarray
+        assert point.chunksize == (1,) + (dataset.chunks or dataset.shape)
+        assert np.array_equal(np.asarray(point[0]), dataset[()])
+        handler.close()
+
+    def test_handler_sliced_reads_expects_only_requested_points_read(self):
+        scan = Catalog(local_name=self.catalog_name).get_scan(70)
+        resource = next(doc for name, doc in scan.bluesky_run.canonical(fill="no") if name == "resource")
+        fpath = os.path.join(self.absolute_path, "external_files", resource["root"], resource["resource_path"])
+
+        handler = utils.PilatusHDF5Handler(fpath, **resource["resource_kwargs"])
+        opened_fnames = []
+        get_file = handler._get_file
+        handler._get_file = lambda fname: opened_fnames.append(fname) or get_file(fname)
+
+        for point_number in [3, 17, 4]:
+            np.asarray(handler(point_number=point_number)[0, 10:12, 20])
+
+        assert set(opened_fnames) == set(
+            fname for point_number in [3, 17, 4] for fname in handler._fnames_for_point(point_number)
+        )
+        assert len(handler._prefetched) == 0
+        handler.close()
+
+    def test_handler_prefetch_near_last_point_expects_no_points_past_point_count(self):
+        scan = Catalog(local_name=self.catalog_name).get_scan(70)
+        resource = next(doc for name, doc in scan.bluesky_run.canonical(fill="no") if name == "resource")
+        fpath = os.path.join(self.absolute_path, "external_files", resource["root"], resource["resource_path"])
+
+        handler = utils.PilatusHDF5Handler(fpath, **resource["resource_kwargs"])
+        handler.prefetch_count = 8
+        point_count = scan.point_count()
+        np.asarray(handler(point_number=point_count - 4))
+        np.asarray(handler(point_number=point_count - 1))
+
+        assert list(handler._prefetched.keys()) == list(range(point_count - 3, point_count))
+        assert all(handler._get_prefetched(i) is not None for i in handler._prefetched.keys())
+        handler.close()
+
+    def test_raw_data_with_frame_cache_expects_equal_frames_and_lru_eviction(self):
+        scan = Catalog(local_name=self.catalog_name).get_scan(70)
+        lazy_scan = Catalog(local_name=self.catalog_name).get_scan(70)
+        lazy_scan.lazy_raw_data = True
+        data, frames = scan.raw_data["data"], lazy_scan.raw_data["data"]
+        frame_cache = cache.FrameCache(max_size=4 * data[0].nbytes)
+        frames.key, frames._cache = "test", frame_cache
+
+        idxs = np.array([3, 3, -1])
+        for key in [5, np.s_[2:6], (idxs, slice(10, 20), 4), (idxs, idxs, idxs), (slice(None, None, 9), idxs, idxs)]:
+            assert np.array_equal(frames[key], data[key])
+        assert frame_cache.size() <= frame_cache.max_size
+
+        frame_cache.clear()
+        frames[0], frames[1], frames[0], frames[2:6], frames[1]
+        assert frame_cache.get_stats()["hits"] == 1 and frame_cache.get_stats()["misses"] == 7
+        assert frame_cache.get_stats()["frame_count"] == 4
+
+        line_roi = LineROI(dims=list(scan.raw_data["coords"].keys()))
+        line_roi.set_endpoints({"t": 1, "x": 50, "y": 20}, {"t": 40, "x": 300, "y": 150})
+        line_roi.set_calculation(output="values", dims=["t"])
+        line_roi.apply_to_scan(scan, "raw")
+        output = line_roi.get_output()["data"]
+        line_roi.apply_to_scan(lazy_scan, "raw")
+        assert np.array_equal(output, line_roi.get_output()["data"])
+
+    # Gridding
+    def test_grid_data_with_chunk_size_expects_equal_to_full_gridding(self):
+        scan_id = 70
+        shape = (20, 20, 20)
+        scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        scan.grid_data(shape=shape)
+        streamed_scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        streamed_scan.grid_data(shape=shape, chunk_size=8)
+
+        assert np.array_equal(scan.gridded_data["data"], streamed_scan.gridded_data["data"])
+        for dim in ["H", "K", "L"]:
+            assert np.array_equal(scan.gridded_data["coords"][dim], streamed_scan.gridded_data["coords"][dim])
+
+    def test_grid_data_with_chunk_size_and_cold_cache_expects_one_conversion_per_point(self, monkeypatch):
+        scan_id = 70
+        shape = (20, 20, 20)
+        scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        scan.grid_data(shape=shape, chunk_size=8)
+        cache.rsm_cache.clear()
+
+        converted_points = []
+        compute_rsm = utils._compute_rsm
+        def _compute_rsm(rsm_params, points=None, return_bounds=False):
+            converted_points.extend(range(*points.indices(len(rsm_params["energy_values"]))))
+            return compute_rsm(rsm_params, points=points, return_bounds=return_bounds)
+        monkeypatch.setattr(utils, "_compute_rsm", _compute_rsm)
+
+        streamed_scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        streamed_scan.grid_data(shape=shape, chunk_size=8)
+
+        assert sorted(converted_points) == list(range(scan.point_count()))
+        assert np.array_equal(scan.gridded_data["data"], streamed_scan.gridded_data["data"])
+
+    def test_grid_data_with_workers_expects_equal_to_serial_gridding(self):
+        scan_id = 70
+        shape = (20, 20, 20)
+        scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        scan.grid_data(shape=shape)
+        parallel_scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        parallel_scan.grid_data(shape=shape, workers=2)
+
+        assert np.array_equal(scan.gridded_data["data"], parallel_scan.gridded_data["data"])
+
+    def test_grid_data_with_workers_and_monitor_expects_identical_to_serial_gridding(self):
+        scan_id = 70
+        shape = (20, 20, 20)
+
+        # Monitor-normalized values are not integers, so sums depend on the order they are added in
+        for chunk_size, sparse in [(None, False), (7, False), (7, True)]:
+            scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+            scan.grid_data(shape=shape, chunk_size=chunk_size, monitor="Seconds", sparse=sparse)
+            parallel_scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+            parallel_scan.grid_data(shape=shape, chunk_size=chunk_size, workers=3, monitor="Seconds", sparse=sparse)
+
+            for key in ["data", "sum", "count"]:
+                assert np.array_equal(np.asarray(scan.gridded_data[key]), np.asarray(parallel_scan.gridded_data[key]))
+
+    def test_grid_scan_shard_expects_no_catalog_built(self, monkeypatch):
+        scan = Catalog(local_name=self.catalog_name).get_scan(70)
+        shard = utils._get_shard(scan, np.s_[0:10])
+        bounds = scan.rsm_bounds
+
+        # Catalogs index every run when they are built, so shards open their run directly
+        def _fail(*args, **kwargs):
+            raise AssertionError("A catalog was built while gridding a shard.")
+        monkeypatch.setattr(Catalog, "__init__", _fail)
+
+        utils._grid_scan_shard(shard, (20, 20, 20), bounds)
+
+    def test_refresh_with_new_points_expects_equal_to_full_gridding(self):
+        scan_id = 70
+        shape = (20, 20, 20)
+        scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        scan.grid_data(shape=shape)
+
+        # Simulates a running scan that has only recorded its first 20 points
+        live_scan = Catalog(local_name=self.catalog_name).get_scan(scan_id)
+        live_scan.point_count = lambda: 20
+        assert live_scan.rsm.shape[0] == 20
+        live_scan.grid_data(shape=shape, bounds=scan.rsm_bounds, chunk_size=8)
+        assert live_scan.gridded_point_count == 20
+
+        # New points are gridded in chunks of the original chunk size
+        chunk_point_counts = []
+        add = live_scan._gridder.add
+        live_scan._gridder.add = lambda h, k, l, values: chunk_point_counts.append(len(values)) or add(h, k, l, values)
+
+        live_scan.point_count = lambda: 50
+        assert live_scan.refresh() == 30
+        assert chunk_point_counts == [8, 8, 8, 6]
+        assert live_scan.gridded_point_count == 50
+        assert np.array_equal(scan.rsm, live_scan.rsm)
+        assert scan.rsm_bounds == live_scan.rsm_bounds
+        assert np.array_equal(scan.gridded_data["data"], live_scan.gridded_data["data"])
+        assert np.array_equal(scan.gridded_data["count"], live_scan.gridded_data["count"])
 print('test')         
\ No newline at end of file
@@ -0,0 +1,628 @@
+"""
+Caching
++++++++
+
+.. autosummary::
+
+   ~RSMCache
+   ~FrameCache
+   ~CachedFrames
+
+"""
+
+from collections import OrderedDict
+import json
+import os
+import tempfile
+import numpy as np
+
+
+class RSMCache:
+    """
+    A size-bounded, on-disk cache for reciprocal space maps.
+
+    .. index:: RSMCache
+
+    Maps are stored as ``.npy`` files named by run UID and a hash of the
+    geometry used to compute them. Cached maps are loaded back as read-only
+    memory maps. When the cache grows past its maximum size, the least
+    recently used maps are evicted first. The HKL bounds of each map are
+    stored beside it, so that they can be read without scanning the map.
+
+    The cache directory defaults to the ``XRDIMAGEUTIL_CACHE_DIR`` environment
+    variable, falling back on ``~/.cache/xrdimageutil/rsm``.
+
+    ATTRIBUTES
+
+    directory
+        *str* :
+        Directory that holds cached maps.
+
+    max_size
+        *int* :
+        Maximum total size of cached maps in bytes.
+
+    enabled
+        *bool* :
+        Whether maps are read from and written to the cache.
+    """
+
+    directory = None
+    max_size = None
+    enabled = None
+
+    def __init__(self, directory: str=None, max_size: int=20 * 1024**3, enabled: bool=True) -> None:
+
+        if directory is None:
+            directory = os.environ.get(
+                "XRDIMAGEUTIL_CACHE_DIR",
+                os.path.join(os.path.expanduser("~"), ".cache", "xrdimageutil", "rsm")
+            )
+
+        self.directory = str(directory)
+        self.max_size = int(max_size)
+        self.enabled = enabled
+
+    def get(self, uid: str, geometry_hash: str) -> np.ndarray:
+        """
+        Returns a cached map as a read-only memory map, or None if not cached.
+
+        PARAMETERS
+
+        uid
+            *str* :
+            UID of the run the map belongs to.
+
+        geometry_hash
+            *str* :
+            Hash of the geometry the map was computed with.
+        """
+
+        if not self.enabled:
+            return None
+
+        # Unreadable entries, e.g. evicted or written by another user, are misses
+        path = self._get_path(uid, geometry_hash)
+        try:
+            rsm = np.load(path, mmap_mode="r")
+
+            # Marks the entry as recently used
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+
+        return rsm
+
+    def get_bounds(self, uid: str, geometry_hash: str) -> dict:
+        """
+        Returns the HKL bounds stored with a cached map, or None if not cached.
+
+        PARAMETERS
+
+        uid
+            *str* :
+            UID of the run the map belongs to.
+
+        geometry_hash
+            *str* :
+            Hash of the geometry the map was computed with.
+        """
+
+        if not self.enabled:
+            return None
+
+        try:
+            with open(self._get_bounds_path(uid, geometry_hash)) as f:
+                bounds = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        return {dim: tuple(bounds[dim]) for dim in ["H", "K", "L"]}
+
+    def put(self, uid: str, geometry_hash: str, rsm: np.ndarray, bounds: dict=None) -> None:
+        """
+        Adds a map to the cache and evicts old entries if needed.
+
+        Maps larger than the cache itself are not stored.
+
+        PARAMETERS
+
+        uid
+            *str* :
+            UID of the run the map belongs to.
+
+        geometry_hash
+            *str* :
+            Hash of the geometry the map was computed with.
+
+        rsm
+            *numpy.ndarray* :
+            Reciprocal space map to store.
+
+        bounds
+            *dict* :
+            HKL bounds of the map to store alongside it.
+        """
+
+        if rsm is None:
+            return
+
+        rsm_map = self.create(rsm.shape, rsm.dtype)
+        if rsm_map is None:
+            return
+
+        try:
+            rsm_map[...] = rsm
+        except BaseException:
+            self.discard(rsm_map)
+            raise
+        self.commit(uid, geometry_hash, rsm_map, bounds=bounds)
+
+    def create(self, shape: tuple, dtype) -> np.memmap:
+        """
+        Returns a writable memory map for a new map, or None if it cannot be cached.
+
+        Maps are filled in chunk by chunk, so they never need to be held in
+        memory, and are only readable from the cache once they are passed to
+        ``commit``. Maps that are not committed are removed with ``discard``.
+        Maps larger than the cache itself are not stored.
+
+        PARAMETERS
+
+        shape
+            *tuple* :
+            Shape of the map.
+
+        dtype
+            *numpy.dtype* :
+            Data type of the map.
+        """
+
+        dtype = np.dtype(dtype)
+        if not self.enabled or int(np.prod(shape)) * dtype.itemsize > self.max_size:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Writes to a temporary file first so that partial writes are never read
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            return np.lib.format.open_memmap(temp_path, mode="w+", dtype=dtype, shape=tuple(shape))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def commit(self, uid: str, geometry_hash: str, rsm: np.memmap, bounds: dict=None) -> None:
+        """
+        Adds a map from ``create`` to the cache and evicts old entries if needed.
+
+        PARAMETERS
+
+        uid
+            *str* :
+            UID of the run the map belongs to.
+
+        geometry_hash
+            *str* :
+            Hash of the geometry the map was computed with.
+
+        rsm
+            *numpy.memmap* :
+            Filled in map returned by ``create``.
+
+        bounds
+            *dict* :
+            HKL bounds of the map to store alongside it.
+        """
+
+        temp_path = rsm.filename
+        try:
+            rsm.flush()
+
+            # Temporary files are private, so entries get the default permissions for shared caches
+            os.chmod(temp_path, 0o666 & ~_get_umask())
+            os.replace(temp_path, self._get_path(uid, geometry_hash))
+        except BaseException:
+            self.discard(rsm)
+            raise
+
+        if bounds is not None:
+            bounds = {dim: [float(bounds[dim][0]), float(bounds[dim][1])] for dim in ["H", "K", "L"]}
+            with open(self._get_bounds_path(uid, geometry_hash), "w") as f:
+                json.dump(bounds, f)
+
+        self._evict()
+
+    def discard(self, rsm: np.memmap) -> None:
+        """Removes a map from ``create`` that will not be committed."""
+
+        try:
+            os.remove(rsm.filename)
+        except FileNotFoundError:
+            pass
+
+    def size(self) -> int:
+        """Returns the total size of cached maps in bytes."""
+
+        return sum(size for path, mtime, size in self._get_entries())
+
+    def clear(self) -> None:
+        """Removes every cached map."""
+
+        for path in self._get_paths():
+            try:
+                self._remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _get_path(self, uid: str, geometry_hash: str) -> str:
+        """Returns the file path for a cache entry."""
+
+        return os.path.join(self.directory, f"{uid}-{geometry_hash}.npy")
+
+    def _get_bounds_path(self, uid: str, geometry_hash: str) -> str:
+        """Returns the file path for a cache entry's bounds."""
+
+        return os.path.join(self.directory, f"{uid}-{geometry_hash}.json")
+
+    def _remove(self, path: str) -> None:
+        """Removes a cache entry and its bounds."""
+
+        os.remove(path)
+        try:
+            os.remove(path[:-len(".npy")] + ".json")
+        except FileNotFoundError:
+            pass
+
+    def _get_paths(self) -> list:
+        """Returns file paths for every cache entry."""
+
+        if not os.path.isdir(self.directory):
+            return []
+
+        return [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory) if name.endswith(".npy")
+        ]
+
+    def _get_entries(self) -> list:
+        """Returns the path, modification time and size of every cache entry.
+        
+        Entries removed by another process while they are listed are skipped.
+        """
+
+        entries = []
+        for path in self._get_paths():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_mtime, stat.st_size))
+
+        return entries
+
+    def _evict(self) -> None:
+        """Removes least recently used entries until the cache fits its maximum size."""
+
+        entries = sorted(self._get_entries(), key=lambda entry: entry[1])
+        total_size = sum(size for path, mtime, size in entries)
+
+        for path, mtime, size in entries:
+            if total_size <= self.max_size:
+                break
+
+            # Entries may already have been evicted by another process
+            try:
+                self._remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+
+def _get_umask() -> int:
+    """Returns the process's file mode creation mask."""
+
+    umask = os.umask(0)
+    os.umask(umask)
+
+    return umask
+
+
+rsm_cache = RSMCache()
+
+
+class FrameCache:
+    """
+    A size-bounded, in-memory cache of decoded area detector frames.
+
+    .. index:: FrameCache
+
+    Frames are stored by a key, such as a run UID, and their point index.
+    When the cache grows past its maximum size, the least recently used 
+    frames are evicted first. Cached frames are read-only. Hits and misses
+    are counted, so that the maximum size can be tuned to how frames are
+    accessed.
+
+    ATTRIBUTES
+
+    max_size
+        *int* :
+        Maximum total size of cached frames in bytes.
+
+    hits
+        *int* :
+        Number of requested frames that were served from the cache.
+
+    misses
+        *int* :
+        Number of requested frames that were not cached.
+    """
+
+    max_size = None
+    hits = None
+    misses = None
+
+    _frames = None
+    _size = None
+
+    def __init__(self, max_size: int=1024**3) -> None:
+
+        self.max_size = int(max_size)
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+        self._size = 0
+
+    def get(self, key, index: int) -> np.ndarray:
+        """
+        Returns a cached frame, or None if not cached.
+
+        PARAMETERS
+
+        key
+            *str* :
+            Key of the frame stack the frame belongs to.
+
+        index
+            *int* :
+            Index of the frame in its stack.
+        """
+
+        frame = self._frames.get((key, index))
+        if frame is None:
+            self.misses += 1
+            return None
+        
+        self._frames.move_to_end((key, index))
+        self.hits += 1
+
+        return frame
+
+    def put(self, key, index: int, frame: np.ndarray) -> np.ndarray:
+        """
+        Adds a frame to the cache and returns its read-only, cached copy.
+
+        Frames larger than the maximum size are returned without being cached.
+
+        PARAMETERS
+
+        key
+            *str* :
+            Key of the frame stack the frame belongs to.
+
+        index
+            *int* :
+            Index of the frame in its stack.
+
+        frame
+            *numpy.ndarray* :
+            Decoded frame.
+        """
+
+        frame = np.array(frame)
+        frame.flags.writeable = False
+
+        if (key, index) in self._frames:
+            self._size -= self._frames.pop((key, index)).nbytes
+
+        if frame.nbytes <= self.max_size:
+            self._frames[(key, index)] = frame
+            self._size += frame.nbytes
+            self._evict()
+
+        return frame
+
+    def size(self) -> int:
+        """Returns the total size of cached frames in bytes."""
+
+        return self._size
+
+    def get_stats(self) -> dict:
+        """Returns hit and miss counts, the hit rate, and the number and total size of cached frames."""
+
+        request_count = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / request_count if request_count > 0 else 0.0,
+            "frame_count": len(self._frames),
+            "size": self._size
+        }
+
+    def clear(self) -> None:
+        """Removes every cached frame and resets hit and miss counts."""
+
+        self._frames.clear()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _evict(self) -> None:
+        """Removes least recently used frames until the cache fits its maximum size."""
+
+        while self._size > self.max_size:
+            self._size -= self._frames.popitem(last=False)[1].nbytes
+
+
+class CachedFrames:
+    """
+    A stack of area detector frames that are loaded through a frame cache.
+
+    .. index:: CachedFrames
+
+    Frames are indexed along the first dimension. Indexing only loads the
+    selected frames, serving them from the cache where possible and loading
+    the rest from the underlying lazy array in a single request. The other
+    dimensions are then indexed with NumPy's rules. Reductions over every 
+    value, such as ``max``, stream through the underlying array without 
+    filling the cache.
+
+    ATTRIBUTES
+
+    source
+        *dask.array.Array* :
+        Lazy frames, indexed by point along the first dimension.
+
+    key
+        *str* :
+        Key that frames are cached under, such as a run UID.
+
+    cache
+        *xrdimageutil.cache.FrameCache* :
+        Cache that frames are loaded through. Defaults to 
+        ``xrdimageutil.cache.frame_cache``.
+    """
+
+    source = None
+    key = None
+
+    _cache = None
+
+    # Number of frames read at a time by reductions
+    _block_size = 64
+
+    def __init__(self, source, key, cache: FrameCache=None) -> None:
+
+        self.source = source
+        self.key = key
+        self._cache = cache
+
+    @property
+    def cache(self) -> FrameCache:
+        return self._cache if self._cache is not None else frame_cache
+
+    @property
+    def shape(self) -> tuple:
+        return tuple(self.source.shape)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(self.source.dtype)
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        data = self[:]
+        if dtype is not None:
+            data = data.astype(dtype, copy=False)
+
+        return data
+
+    def __getitem__(self, key) -> np.ndarray:
+
+        if not isinstance(key, tuple):
+            key = (key,)
+        frame_key = key[0] if len(key) > 0 else Ellipsis
+
+        if frame_key is Ellipsis or frame_key is None:
+            return self._get_frames(np.arange(len(self)))[key]
+        if isinstance(frame_key, slice):
+            return self._get_frames(np.arange(len(self))[frame_key])[(slice(None),) + key[1:]]
+
+        # Out of range and negative indices follow NumPy's rules
+        frame_idxs = np.arange(len(self))[frame_key]
+        if np.ndim(frame_idxs) == 0:
+            return self._get_frame(int(frame_idxs))[key[1:]]
+        
+        # Repeated frames are loaded once, and indexed into by position
+        unique_frame_idxs, positions = np.unique(frame_idxs, return_inverse=True)
+        frames = self._get_frames(unique_frame_idxs)
+
+        return frames[(positions.reshape(frame_idxs.shape),) + key[1:]]
+
+    def max(self, axis=None, **kwargs):
+        """Returns the maximum value, reading frames in blocks when no axis is given."""
+
+        if axis is not None:
+            return np.amax(np.asarray(self), axis=axis, **kwargs)
+        
+        return max(np.amax(block) for block in self._get_blocks())
+
+    def min(self, axis=None, **kwargs):
+        """Returns the minimum value, reading frames in blocks when no axis is given."""
+
+        if axis is not None:
+            return np.amin(np.asarray(self), axis=axis, **kwargs)
+
+        return min(np.amin(block) for block in self._get_blocks())
+
+    def transpose(self, axes: tuple=None) -> object:
+        """Returns the frames with reordered dimensions. Reordering frames into other dimensions loads every frame."""
+
+        if axes is None:
+            axes = tuple(reversed(range(self.ndim)))
+        if tuple(axes) == tuple(range(self.ndim)):
+            return self
+        
+        return np.transpose(np.asarray(self), axes)
+
+    def _get_frame(self, index: int) -> np.ndarray:
+        """Returns a single read-only frame, loading it if it is not cached."""
+
+        frame = self.cache.get(self.key, index)
+        if frame is None:
+            frame = self.cache.put(self.key, index, np.asarray(self.source[index]))
+
+        return frame
+
+    def _get_frames(self, frame_idxs: np.ndarray) -> np.ndarray:
+        """Returns a stack of frames, loading every uncached frame in one request."""
+
+        frames = [self.cache.get(self.key, int(i)) for i in frame_idxs]
+        missing_idxs = [int(i) for i, frame in zip(frame_idxs, frames) if frame is None]
+
+        if len(missing_idxs) > 0:
+            loaded_frames = np.asarray(self.source[np.array(missing_idxs)])
+            loaded_frames = dict([
+                (i, self.cache.put(self.key, i, frame)) 
+                for i, frame in zip(missing_idxs, loaded_frames)
+            ])
+            frames = [
+                frame if frame is not None else loaded_frames[int(i)]
+                for i, frame in zip(frame_idxs, frames)
+            ]
+
+        if len(frames) == 0:
+            return np.empty((0,) + self.shape[1:], dtype=self.dtype)
+        
+        return np.stack(frames)
+
+    def _get_blocks(self):
+        """Yields blocks of frames from the underlying array, without caching them."""
+
+        for start in range(0, len(self), self._block_size):
+            yield np.asarray(self.source[start:min(start + self._block_size, len(self))])
+
+
+frame_cache = FrameCache()
@@ -0,0 +1,257 @@
+"""
+Geometry Profiles
++++++++++++++++++
+
+.. autosummary::
+
+   ~GeometryProfile
+   ~register_profile
+   ~get_profile
+   ~load_profiles
+
+"""
+
+import yaml
+
+
+class GeometryProfile:
+    """
+    Diffractometer and area detector geometry used to map a run into reciprocal space.
+
+    .. index:: GeometryProfile
+
+    Profiles are registered by name, either in Python or from a YAML file,
+    and a run can select one through its start document. Every scan that
+    shares a profile also shares its precomputed detector geometry.
+
+    Sample orientation comes entirely from the run's UB matrix, so profiles
+    have no in-plane reference or surface normal directions. Profiles that
+    set them are rejected rather than silently ignoring them.
+
+    ATTRIBUTES
+
+    name
+        *str* :
+        Name the profile is registered under.
+
+    sample_circles
+        *list* :
+        Primary stream fields for the sample circle angles, outermost first.
+
+    detector_circles
+        *list* :
+        Primary stream fields for the detector circle angles, outermost first.
+
+    sample_circle_directions
+        *list* :
+        Rotation axis and sense of each sample circle (e.g. "z-").
+
+    detector_circle_directions
+        *list* :
+        Rotation axis and sense of each detector circle.
+
+    primary_beam_direction
+        *list* :
+        Direction of the primary beam in the laboratory frame.
+
+    config_device
+        *str* :
+        Name of the diffractometer device in the primary stream configuration.
+
+    energy_field
+        *str* :
+        Configuration field that holds the beam energy.
+
+    energy_scale
+        *float* :
+        Factor that converts ``energy_field`` values to eV.
+
+    ub_field
+        *str* :
+        Configuration field that holds the UB matrix.
+
+    image_field
+        *str* :
+        Primary stream field that holds area detector images.
+
+    pixel_directions
+        *list* :
+        Laboratory directions of the detector's first and second pixel axes
+        at zero detector angles.
+
+    center_channel_pixels
+        *list* :
+        Pixel hit by the primary beam at zero detector angles.
+
+    detector_size
+        *list* :
+        Detector width along each pixel axis in mm.
+
+    detector_distance
+        *float* :
+        Sample to detector distance in mm.
+    """
+
+    name = None
+    sample_circles = None
+    detector_circles = None
+    sample_circle_directions = None
+    detector_circle_directions = None
+    primary_beam_direction = None
+    config_device = None
+    energy_field = None
+    energy_scale = None
+    ub_field = None
+    image_field = None
+    pixel_directions = None
+    center_channel_pixels = None
+    detector_size = None
+    detector_distance = None
+
+    _fields = [
+        "sample_circles", "detector_circles",
+        "sample_circle_directions", "detector_circle_directions",
+        "primary_beam_direction",
+        "config_device", "energy_field", "energy_scale", "ub_field", "image_field",
+        "pixel_directions", "center_channel_pixels", "detector_size", "detector_distance"
+    ]
+
+    # Fields that never changed the computed RSM
+    _removed_fields = ["inplane_reference_direction", "sample_normal_direction"]
+
+    def __init__(self, name: str, **fields) -> None:
+
+        missing_fields = [field for field in self._fields if field not in fields.keys()]
+        if len(missing_fields) > 0:
+            raise ValueError(f"Geometry profile '{name}' is missing fields: {missing_fields}.")
+
+        removed_fields = [field for field in fields.keys() if field in self._removed_fields]
+        if len(removed_fields) > 0:
+            raise ValueError(
+                f"Geometry profile '{name}' sets {removed_fields}, which have no effect "
+                "since sample orientation comes from the UB matrix. Remove them from the profile."
+            )
+
+        unknown_fields = [field for field in fields.keys() if field not in self._fields]
+        if len(unknown_fields) > 0:
+            raise ValueError(f"Geometry profile '{name}' has unknown fields: {unknown_fields}.")
+
+        if len(fields["sample_circles"]) != len(fields["sample_circle_directions"]):
+            raise ValueError("Expects one direction for every sample circle.")
+        if len(fields["detector_circles"]) != len(fields["detector_circle_directions"]):
+            raise ValueError("Expects one direction for every detector circle.")
+
+        self.name = str(name)
+        for field, value in fields.items():
+            setattr(self, field, value)
+
+    @classmethod
+    def from_dict(cls, name: str, fields: dict) -> object:
+        """
+        Returns a profile from a dictionary of fields, e.g. from YAML or a run's start document.
+        """
+
+        return cls(name, **fields)
+
+    def to_dict(self) -> dict:
+        """Returns the profile's fields as a dictionary."""
+
+        return dict([(field, getattr(self, field)) for field in self._fields])
+
+
+_profiles = {}
+
+
+def register_profile(profile: GeometryProfile) -> None:
+    """
+    Registers a geometry profile under its name, replacing any profile with the same name.
+    """
+
+    if not isinstance(profile, GeometryProfile):
+        raise TypeError("Profile must be an instance of xrdimageutil.geometry.GeometryProfile.")
+
+    _profiles[profile.name] = profile
+
+
+def get_profile(name: str) -> GeometryProfile:
+    """
+    Returns the registered geometry profile with the given name.
+    """
+
+    if name not in _profiles.keys():
+        raise KeyError(f"Geometry profile '{name}' not found.")
+
+    return _profiles[name]
+
+
+def load_profiles(path: str) -> list:
+    """
+    Registers every geometry profile in a YAML file.
+
+    The file maps profile names to their fields, e.g.
+
+    .. code-block:: yaml
+
+        6-ID-B:
+          sample_circles: [fourc_omega, fourc_chi, fourc_phi]
+          detector_circles: [fourc_tth]
+          ...
+
+    RETURNS
+
+    *list* :
+        Names of the registered profiles.
+    """
+
+    with open(path) as f:
+        profile_dicts = yaml.safe_load(f)
+
+    if type(profile_dicts) != dict:
+        raise ValueError("Expects a YAML mapping of profile names to profile fields.")
+
+    profiles = [GeometryProfile.from_dict(name, fields) for name, fields in profile_dicts.items()]
+    for profile in profiles:
+        register_profile(profile)
+
+    return [profile.name for profile in profiles]
+
+
+def _get_profile_for_run(start: dict, default: str=None) -> GeometryProfile:
+    """
+    Returns the geometry profile selected by a run's start document.
+
+    A ``geometry`` dictionary in the start document is used as the profile's
+    fields. Otherwise, a ``geometry_profile`` name selects a registered profile,
+    falling back on the given default.
+    """
+
+    if type(start.get("geometry")) == dict:
+        return GeometryProfile.from_dict(f"{start.get('uid')}-geometry", start["geometry"])
+
+    name = start.get("geometry_profile", default)
+    if name is None:
+        name = DEFAULT_PROFILE_NAME
+
+    return get_profile(name)
+
+
+DEFAULT_PROFILE_NAME = "6-ID-B"
+
+# Beamline 6-ID-B four-circle diffractometer with a Pilatus 100K detector
+register_profile(GeometryProfile(
+    "6-ID-B",
+    sample_circles=["fourc_omega", "fourc_chi", "fourc_phi"],
+    detector_circles=["fourc_tth"],
+    sample_circle_directions=["z-", "y+", "z-"],
+    detector_circle_directions=["z-"],
+    primary_beam_direction=[0, 1, 0],
+    config_device="fourc",
+    energy_field="fourc_energy",
+    energy_scale=1000,
+    ub_field="fourc_UB",
+    image_field="pilatus100k_image",
+    pixel_directions=["z-", "x-"],
+    center_channel_pixels=[252, 107],
+    detector_size=[83.764, 33.54],
+    detector_distance=900.644
+))
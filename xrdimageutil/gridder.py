@@ -0,0 +1,475 @@
+"""
+Gridding
+++++++++
+
+.. autosummary::
+
+   ~Gridder
+   ~SparseVolume
+
+"""
+
+import numpy as np
+
+
+class Gridder:
+    """
+    A histogram of point values on a regular 3D HKL grid.
+
+    .. index:: Gridder
+
+    Keeps the sum of values and the number of hits in every bin as separate
+    volumes, so that gridders with the same shape and bounds can be merged
+    and renormalized without gridding again. Bins are centered on evenly
+    spaced HKL coordinates that include both bounds, and values outside of
+    the bounds are ignored.
+
+    Sparse gridders only store the bins that have been hit, as
+    ``SparseVolume`` objects, so their memory use is proportional to the
+    number of occupied bins rather than to the shape of the grid.
+
+    ATTRIBUTES
+
+    shape
+        *tuple* :
+        Number of bins along H, K and L.
+
+    bounds
+        *dict* :
+        HKL bounds of the grid, keyed by "H", "K" and "L".
+
+    sum
+        *numpy.ndarray* :
+        Sum of the values in every bin.
+
+    count
+        *numpy.ndarray* :
+        Number of values in every bin, as 64-bit integers unless a smaller
+        count dtype is given.
+
+    sparse
+        *bool* :
+        Whether sums and counts are stored as ``SparseVolume`` objects.
+    """
+
+    shape = None
+    bounds = None
+    sum = None
+    count = None
+    sparse = False
+
+    def __init__(self, shape: tuple, bounds: dict, sparse: bool=False, count_dtype=np.int64) -> None:
+
+        self.shape = tuple(int(n) for n in shape)
+        self.bounds = dict([(dim, (float(bounds[dim][0]), float(bounds[dim][1]))) for dim in ["H", "K", "L"]])
+        self.sparse = bool(sparse)
+        count_dtype = np.dtype(count_dtype)
+        if self.sparse:
+            self.sum = SparseVolume(self.shape, np.empty(0, dtype=np.int64), np.empty(0))
+            self.count = SparseVolume(self.shape, np.empty(0, dtype=np.int64), np.empty(0, dtype=count_dtype))
+        else:
+            self.sum = np.zeros(self.shape)
+            self.count = np.zeros(self.shape, dtype=count_dtype)
+
+    def add(self, h: np.ndarray, k: np.ndarray, l: np.ndarray, values: np.ndarray) -> None:
+        """
+        Adds values at the given HKL positions to the grid.
+
+        PARAMETERS
+
+        h, k, l
+            *numpy.ndarray* :
+            HKL positions of the values.
+
+        values
+            *numpy.ndarray* :
+            Values to add, with the same size as each position array.
+        """
+
+        self._add_bins(*self._get_bins(h, k, l, values))
+
+    def merge(self, other: object) -> None:
+        """
+        Adds the sums and counts of another gridder with the same shape and bounds.
+
+        PARAMETERS
+
+        other
+            *xrdimageutil.gridder.Gridder* :
+            Gridder to merge.
+        """
+
+        if other.shape != self.shape or other.bounds != self.bounds:
+            raise ValueError("Only gridders with equal shapes and bounds can be merged.")
+
+        if not self.sparse and not other.sparse:
+            self.sum += other.sum
+            self.count += other.count
+            return
+
+        # Only the occupied bins of the other gridder are added
+        if other.sparse:
+            flat_idxs, sums, counts = other.sum.indices, other.sum.values, other.count.values
+        else:
+            flat_idxs = np.flatnonzero(other.count)
+            sums, counts = other.sum.reshape(-1)[flat_idxs], other.count.reshape(-1)[flat_idxs]
+
+        self._add_bin_sums(flat_idxs, sums, counts)
+
+    def _get_bins(self, h: np.ndarray, k: np.ndarray, l: np.ndarray, values: np.ndarray) -> tuple:
+        """Returns the flat bin index of every value inside the bounds, and those values."""
+
+        positions = [np.ravel(h), np.ravel(k), np.ravel(l)]
+        values = np.ravel(values)
+
+        if any(position.size != values.size for position in positions):
+            raise ValueError("Expects positions and values of the same size.")
+
+        # Values outside of the bounds and NaN values are skipped
+        valid = ~np.isnan(values)
+        for position, dim in zip(positions, ["H", "K", "L"]):
+            valid &= (position >= self.bounds[dim][0]) & (position <= self.bounds[dim][1])
+
+        # Positions are rounded to the nearest bin center
+        bin_idxs = []
+        for position, dim, n in zip(positions, ["H", "K", "L"], self.shape):
+            step = _get_step(self.bounds[dim], n)
+            bin_idxs.append(np.rint((position[valid] - self.bounds[dim][0]) / step).astype(np.intp))
+        flat_idxs = np.ravel_multi_index(bin_idxs, self.shape)
+
+        return flat_idxs, values[valid]
+
+    def _add_bins(self, flat_idxs: np.ndarray, values: np.ndarray) -> None:
+        """Adds values at flat bin indices."""
+
+        if flat_idxs.size == 0:
+            return
+
+        if self.sparse:
+            self._add_entries(flat_idxs, values)
+            return
+
+        # Counts only the span of bins that is hit, rather than the full volume
+        offset = flat_idxs.min()
+        span = flat_idxs.max() - offset + 1
+        flat_idxs = flat_idxs - offset
+        self.sum.reshape(-1)[offset:offset + span] += np.bincount(flat_idxs, weights=values, minlength=span)
+        self.count.reshape(-1)[offset:offset + span] += np.bincount(flat_idxs, minlength=span)
+
+    def _add_bin_sums(self, flat_idxs: np.ndarray, sums: np.ndarray, counts: np.ndarray) -> None:
+        """Adds sums and counts at unique flat bin indices.
+        
+        Adding the per-bin sums of a batch of values gives the same result,
+        bit for bit, as adding the values themselves with ``_add_bins``.
+        """
+
+        if self.sparse:
+            self._add_entries(flat_idxs, sums, counts)
+        else:
+            self.sum.reshape(-1)[flat_idxs] += sums
+            self.count.reshape(-1)[flat_idxs] += counts
+
+    def get_data(self) -> object:
+        """Returns the mean value in every bin, or 0 for bins without values."""
+
+        if self.sparse:
+            return SparseVolume(self.shape, self.sum.indices, self.sum.values / self.count.values)
+
+        data = self.sum.copy()
+        hit = self.count != 0
+        data[hit] /= self.count[hit]
+
+        return data
+
+    def get_coords(self) -> dict:
+        """Returns the HKL coordinates of the bin centers."""
+
+        return dict([
+            (dim, self.bounds[dim][0] + _get_step(self.bounds[dim], n) * np.arange(n))
+            for dim, n in zip(["H", "K", "L"], self.shape)
+        ])
+
+    def downsample(self) -> object:
+        """
+        Returns a gridder with half as many bins along every dimension.
+
+        Every coarse bin holds the sums and counts of a 2x2x2 block of bins,
+        so its value is the mean of every value in the block rather than a
+        mean of means. Coarse bins are centered between the centers of the
+        bins they hold, and the last coarse bin along a dimension with an 
+        odd number of bins holds a single bin.
+
+        RETURNS
+
+        *xrdimageutil.gridder.Gridder* :
+            Downsampled gridder, with the same storage as this one.
+        """
+
+        shape = tuple((n + 1) // 2 for n in self.shape)
+        if min(shape) < 2:
+            raise ValueError("Gridders need at least 3 bins along every dimension to be downsampled.")
+
+        bounds = {}
+        for dim, n, fine_n in zip(["H", "K", "L"], shape, self.shape):
+            step = _get_step(self.bounds[dim], fine_n)
+            lower = self.bounds[dim][0] + step / 2
+            bounds[dim] = (lower, lower + 2 * step * (n - 1))
+
+        gridder = Gridder(shape, bounds, sparse=self.sparse, count_dtype=self.count.dtype)
+        if self.sparse:
+            bin_idxs = np.unravel_index(self.sum.indices, self.shape)
+            flat_idxs = np.ravel_multi_index([idxs // 2 for idxs in bin_idxs], shape)
+            gridder._add_entries(flat_idxs, self.sum.values, self.count.values)
+        else:
+            # Odd dimensions are padded with an empty bin, and each block is summed
+            padding = [(0, n % 2) for n in self.shape]
+            block_shape = (shape[0], 2, shape[1], 2, shape[2], 2)
+            gridder.sum = np.pad(self.sum, padding).reshape(block_shape).sum(axis=(1, 3, 5))
+            gridder.count = np.pad(self.count, padding).reshape(block_shape).sum(axis=(1, 3, 5), dtype=self.count.dtype)
+
+        return gridder
+
+    def get_pyramid(self, levels: int) -> list:
+        """
+        Returns this gridder and successively downsampled gridders.
+
+        PARAMETERS
+
+        levels
+            *int* :
+            Number of downsampled levels.
+
+        RETURNS
+
+        *list* :
+            Gridders ordered from full resolution to coarsest, where level i
+            has 2**i times fewer bins along every dimension.
+        """
+
+        pyramid = [self]
+        for _ in range(levels):
+            pyramid.append(pyramid[-1].downsample())
+
+        return pyramid
+
+    def _add_entries(self, flat_idxs: np.ndarray, sums: np.ndarray, counts: np.ndarray=None) -> None:
+        """Adds values, or sums and counts, at flat bin indices to a sparse gridder."""
+
+        # Values are summed per bin before they are added to the stored sums,
+        # in the same order as for dense gridders
+        new_idxs, inverse = np.unique(flat_idxs, return_inverse=True)
+        new_sums = np.bincount(inverse, weights=sums)
+        if counts is None:
+            new_counts = np.bincount(inverse)
+        else:
+            new_counts = np.bincount(inverse, weights=counts).astype(np.int64)
+
+        idxs = np.union1d(self.sum.indices, new_idxs)
+        sums = np.zeros(idxs.size)
+        counts = np.zeros(idxs.size, dtype=self.count.dtype)
+
+        stored_positions = np.searchsorted(idxs, self.sum.indices)
+        sums[stored_positions] = self.sum.values
+        counts[stored_positions] = self.count.values
+
+        new_positions = np.searchsorted(idxs, new_idxs)
+        sums[new_positions] += new_sums
+        counts[new_positions] += new_counts
+
+        self.sum = SparseVolume(self.shape, idxs, sums)
+        self.count = SparseVolume(self.shape, idxs, counts)
+
+
+class SparseVolume:
+    """
+    A 3D volume that only stores its nonzero elements.
+
+    .. index:: SparseVolume
+
+    Elements are stored in coordinate (COO) form, as sorted flat indices and
+    their values, and every other element is 0. Volumes can be indexed like
+    NumPy arrays, which returns dense arrays for only the selected elements,
+    so regions, lines and slices of a large volume can be read without
+    converting the whole volume with ``numpy.asarray``.
+
+    ATTRIBUTES
+
+    shape
+        *tuple* :
+        Shape of the volume.
+
+    indices
+        *numpy.ndarray* :
+        Sorted flat (C order) indices of the stored elements.
+
+    values
+        *numpy.ndarray* :
+        Values of the stored elements.
+    """
+
+    shape = None
+    indices = None
+    values = None
+
+    def __init__(self, shape: tuple, indices: np.ndarray, values: np.ndarray) -> None:
+
+        self.shape = tuple(int(n) for n in shape)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.values = np.asarray(values)
+
+        if self.indices.shape != self.values.shape or self.indices.ndim != 1:
+            raise ValueError("Expects one-dimensional indices and values of the same size.")
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.values.dtype
+
+    @property
+    def nnz(self) -> int:
+        """Number of stored elements."""
+        return self.indices.size
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+
+        # Densifying always allocates a new array
+        if copy is False:
+            raise ValueError("A SparseVolume cannot be converted to an array without a copy.")
+
+        data = self.todense()
+        if dtype is not None:
+            data = data.astype(dtype, copy=False)
+
+        return data
+
+    def __getitem__(self, key) -> np.ndarray:
+
+        grids = self._get_index_grids(key)
+        flat_idxs = sum(grid * stride for grid, stride in zip(grids, _get_strides(self.shape)))
+        flat_idxs = np.asarray(flat_idxs, dtype=np.int64)
+
+        data = np.zeros(flat_idxs.shape, dtype=self.dtype)
+        if self.nnz > 0:
+            positions = np.minimum(np.searchsorted(self.indices, flat_idxs), self.nnz - 1)
+            found = self.indices[positions] == flat_idxs
+            data[found] = self.values[positions[found]]
+
+        if data.ndim == 0:
+            return data[()]
+        return data
+
+    def todense(self) -> np.ndarray:
+        """Returns the volume as a dense array."""
+
+        data = np.zeros(self.size, dtype=self.dtype)
+        data[self.indices] = self.values
+
+        return data.reshape(self.shape)
+
+    def astype(self, dtype, copy: bool=True) -> object:
+        """Returns the volume with values cast to a given type."""
+
+        return SparseVolume(self.shape, self.indices, self.values.astype(dtype, copy=copy))
+
+    def transpose(self, axes: tuple=None) -> object:
+        """Returns the volume with permuted dimensions, as with ``numpy.transpose``."""
+
+        if axes is None:
+            axes = tuple(reversed(range(self.ndim)))
+
+        idxs = np.unravel_index(self.indices, self.shape)
+        shape = tuple(self.shape[axis] for axis in axes)
+        flat_idxs = np.ravel_multi_index([idxs[axis] for axis in axes], shape)
+        order = np.argsort(flat_idxs, kind="stable")
+
+        return SparseVolume(shape, flat_idxs[order], self.values[order])
+
+    def max(self, axis=None, out=None, **kwargs):
+        """Returns the maximum value, as with ``numpy.amax``."""
+
+        if axis is not None or out is not None or self.nnz == 0:
+            return np.amax(self.todense(), axis=axis, out=out, **kwargs)
+
+        value = self.values.max()
+        return max(value, self.dtype.type(0)) if self.nnz < self.size else value
+
+    def min(self, axis=None, out=None, **kwargs):
+        """Returns the minimum value, as with ``numpy.amin``."""
+
+        if axis is not None or out is not None or self.nnz == 0:
+            return np.amin(self.todense(), axis=axis, out=out, **kwargs)
+
+        value = self.values.min()
+        return min(value, self.dtype.type(0)) if self.nnz < self.size else value
+
+    def _get_index_grids(self, key) -> list:
+        """Returns broadcastable element indices for every dimension, following NumPy indexing rules."""
+
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = [k is Ellipsis for k in key].index(True)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i + 1:]
+        if len(key) > self.ndim:
+            raise IndexError("Too many indices for volume.")
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        # Integers and integer arrays are broadcast together, and slices are expanded into ranges
+        array_dims = [dim for dim, k in enumerate(key) if not isinstance(k, slice)]
+        arrays = {}
+        for dim in array_dims:
+            idxs = np.asarray(key[dim])
+            if not np.issubdtype(idxs.dtype, np.integer):
+                raise IndexError("Only integers, slices and integer arrays are valid indices.")
+            if np.any((idxs < -self.shape[dim]) | (idxs >= self.shape[dim])):
+                raise IndexError(f"Index out of bounds for dimension {dim} with size {self.shape[dim]}.")
+            arrays[dim] = idxs % self.shape[dim]
+        array_shape = np.broadcast_shapes(*[idxs.shape for idxs in arrays.values()]) if arrays else ()
+        ranges = dict([(dim, np.arange(self.shape[dim])[k]) for dim, k in enumerate(key) if isinstance(k, slice)])
+
+        # Broadcast dimensions replace adjacent array indices, and otherwise come first
+        slice_dims = list(ranges.keys())
+        if len(array_dims) > 0 and array_dims == list(range(array_dims[0], array_dims[-1] + 1)):
+            dims_before = [dim for dim in slice_dims if dim < array_dims[0]]
+        else:
+            dims_before = []
+        dims_after = [dim for dim in slice_dims if dim not in dims_before]
+        output_ndim = len(slice_dims) + len(array_shape)
+
+        grids = []
+        for dim in range(self.ndim):
+            if dim in arrays:
+                grid_shape = [1] * len(dims_before) + list(array_shape) + [1] * len(dims_after)
+                grids.append(np.broadcast_to(arrays[dim], array_shape).reshape(grid_shape))
+            else:
+                if dim in dims_before:
+                    position = dims_before.index(dim)
+                else:
+                    position = len(dims_before) + len(array_shape) + dims_after.index(dim)
+                grid_shape = [1] * output_ndim
+                grid_shape[position] = ranges[dim].size
+                grids.append(ranges[dim].reshape(grid_shape))
+
+        return grids
+
+
+def _get_step(bounds: tuple, n: int) -> float:
+    """Returns the spacing between bin centers along one dimension."""
+
+    return (bounds[1] - bounds[0]) / (n - 1)
+
+
+def _get_strides(shape: tuple) -> list:
+    """Returns the flat index strides of every dimension of a C order volume."""
+
+    return [int(np.prod(shape[dim + 1:])) for dim in range(len(shape))]
@@ -5,17 +5,18 @@ See LICENSE file.
 import numpy as np
 import pyqtgraph as pg
 
-def view_image_data(data: np.ndarray, coords: dict=None) -> None:
-    """Displays 3D numpy data in an interactive GUI window."""
+def view_image_data(data: np.ndarray, coords: dict=None, pyramid: list=None) -> None:
+    """Displays 3D numpy data, or a sparse gridded volume, in an interactive GUI window."""
     
+    from xrdimageutil.gridder import SparseVolume
     from xrdimageutil.gui.image_data_widget import ImageDataWidget
     
     # Data validation
-    if type(data) != np.ndarray:
-        raise TypeError("'data' must be of the type np.ndarray.")
+    if type(data) != np.ndarray and type(data) != SparseVolume:
+        raise TypeError("'data' must be of the type np.ndarray or xrdimageutil.gridder.SparseVolume.")
     
     if data.ndim != 3:
-        raise ValueError("'data' must be an np.ndarray with ndim=3.")
+        raise ValueError("'data' must have ndim=3.")
 
     # Coords validation
     if coords is None:
@@ -37,7 +38,7 @@ def view_image_data(data: np.ndarray, coords: dict=None) -> None:
             
 
     app = pg.mkQApp()
-    gui_window = ImageDataWidget(data, coords)
+    gui_window = ImageDataWidget(data, coords, pyramid=pyramid)
     gui_window.raise_()
     gui_window.show()
     gui_window.raise_()
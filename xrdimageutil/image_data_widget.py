@@ -9,6 +9,7 @@ import pyqtgraph as pg
 from pyqtgraph.dockarea import Dock, DockArea
 
 from xrdimageutil import utils
+from xrdimageutil.cache import CachedFrames
 from xrdimageutil.roi import LineROI, PlaneROI, RectROI
 
 
@@ -36,10 +37,15 @@ class ScanImageDataGUI(QtWidgets.QWidget):
         self.layout = QtWidgets.QGridLayout()
         self.setLayout(self.layout)
 
+        # Lazy raw data stays lazy, so frames are only loaded as they are displayed
         self.raw_data_widget = ImageDataWidget(data=scan.raw_data["data"], coords=scan.raw_data["coords"])
         if scan.gridded_data["data"] is not None and scan.gridded_data["data"].ndim > 1:
             self.tab_widget.addTab(self.raw_data_widget, "Raw")
-            self.gridded_data_widget = ImageDataWidget(data=scan.gridded_data["data"], coords=scan.gridded_data["coords"])
+            self.gridded_data_widget = ImageDataWidget(
+                data=scan.gridded_data["data"], 
+                coords=scan.gridded_data["coords"], 
+                pyramid=scan.gridded_data.get("pyramid")
+            )
             self.tab_widget.addTab(self.gridded_data_widget, "Gridded")
             self.layout.addWidget(self.tab_widget)
         else:
@@ -49,8 +55,12 @@ class ScanImageDataGUI(QtWidgets.QWidget):
 class ImageDataWidget(DockArea):
     """A generalized 3D image data interface."""
 
-    data = None # 3D numpy.ndarray of image data
+    data = None # 3D numpy.ndarray, xrdimageutil.gridder.SparseVolume, or xrdimageutil.cache.CachedFrames of image data
     coords = None # Ordered dictionary with 3 keys that denotes each dimension's labels and coordinates
+    pyramid = None # List of data/coords dictionaries from full resolution to coarsest, or None
+
+    dragging = False # Whether an ROI is being dragged
+    preview_size = 2**21 # Maximum number of voxels that ROIs are applied to while dragging
 
     image_tool = None # Modified pg.ImageView
     image_tool_dock = None
@@ -64,11 +74,12 @@ class ImageDataWidget(DockArea):
     graphical_line_rois = None # List of two GraphicalLineROI's associated with widget
     graphical_line_roi_docks = None
 
-    def __init__(self, data: np.ndarray, coords: dict) -> None:
+    def __init__(self, data: np.ndarray, coords: dict, pyramid: list=None) -> None:
         super(ImageDataWidget, self).__init__()  
 
         self.data = data
         self.coords = coords
+        self.pyramid = pyramid
 
         self.setMinimumSize(900, 700)
         self.move(50, 50)
@@ -98,6 +109,23 @@ class ImageDataWidget(DockArea):
         #self.addDock(self.graphical_plane_roi_dock, "below", self.graphical_line_roi_dock)
         self.moveDock(self.image_tool_controller_dock, "left", self.graphical_rect_roi_dock)
         self.moveDock(self.image_tool_controller_dock, "bottom", self.image_tool_dock)
+
+    def _get_roi_data(self) -> tuple:
+        """Returns the data and coordinates that ROIs are applied to.
+        
+        While an ROI is dragged, the finest pyramid level with at most
+        ``preview_size`` voxels is used, so that ROI outputs keep up with
+        the drag. Full resolution data is used otherwise.
+        """
+
+        if not self.dragging or self.pyramid is None:
+            return (self.data, self.coords)
+
+        for level in self.pyramid:
+            if level["data"].size <= self.preview_size:
+                return (level["data"], level["coords"])
+
+        return (self.pyramid[-1]["data"], self.pyramid[-1]["coords"])
         
 
 class ImageTool(pg.ImageView):
@@ -173,6 +201,11 @@ class ImageTool(pg.ImageView):
         # Fixes cmap reset bug
         self._set_colormap()
 
+    def quickMinMax(self, data) -> list:
+        """Estimates the min/max values of data, sampling cached frame stacks instead of reading every frame."""
+
+        return super().quickMinMax(_get_preview_frames(data))
+
     def _set_colormap(self) -> None:
         name = self.controller.colormap_cbx.currentText()
         scale = self.controller.colormap_scale_cbx.currentText()
@@ -247,10 +280,11 @@ class ImageToolController(QtWidgets.QWidget):
         self.colormap_max_lbl = QtWidgets.QLabel("CMap Max:")
         self.colormap_max_lbl.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
         self.colormap_max_sbx = QtWidgets.QDoubleSpinBox()
+        data_max = np.amax(_get_preview_frames(self.t_data))
         self.colormap_max_sbx.setMinimum(1)
-        self.colormap_max_sbx.setMaximum(np.amax(self.t_data) * 2)
-        self.colormap_max_sbx.setSingleStep(np.amax(self.t_data) / 100)
-        self.colormap_max_sbx.setValue(np.amax(self.t_data) / 2)
+        self.colormap_max_sbx.setMaximum(data_max * 2)
+        self.colormap_max_sbx.setSingleStep(data_max / 100)
+        self.colormap_max_sbx.setValue(data_max / 2)
         self.colormap_gamma_lbl = QtWidgets.QLabel("CMap Gamma:")
         self.colormap_gamma_lbl.hide()
         self.colormap_gamma_lbl.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
@@ -373,6 +407,19 @@ class GraphicalRectROI(pg.RectROI):
 
         self.controller.signal_visibility_changed.connect(self._set_visibility)
         self.controller.signal_color_changed.connect(self._set_color)
+        self.sigRegionChangeStarted.connect(self._start_drag)
+        self.sigRegionChangeFinished.connect(self._finish_drag)
+
+    def _start_drag(self) -> None:
+        """Applies the ROI to a coarse pyramid level until the drag is finished."""
+
+        self.image_data_widget.dragging = True
+
+    def _finish_drag(self) -> None:
+        """Reapplies the ROI to full resolution data."""
+
+        self.image_data_widget.dragging = False
+        self.controller._get_output()
 
     def _set_color(self) -> None:
         
@@ -673,7 +720,8 @@ class GraphicalRectROIController(QtWidgets.QWidget):
         
         self.rect_roi.set_bounds(self.bounds)
         self.rect_roi.set_calculation(output=output_type, dims=dims)
-        self.rect_roi.apply(data=self.image_data_widget.data, coords=self.image_data_widget.coords)
+        data, coords = self.image_data_widget._get_roi_data()
+        self.rect_roi.apply(data=data, coords=coords)
         output = self.rect_roi.get_output()
         self.output_image_tool._plot(output["data"], output["coords"])
 
@@ -735,6 +783,19 @@ class GraphicalLineROI(pg.LineSegmentROI):
 
         self.controller.signal_visibility_changed.connect(self._set_visibility)
         self.controller.signal_color_changed.connect(self._set_color)
+        self.sigRegionChangeStarted.connect(self._start_drag)
+        self.sigRegionChangeFinished.connect(self._finish_drag)
+
+    def _start_drag(self) -> None:
+        """Applies the ROI to a coarse pyramid level until the drag is finished."""
+
+        self.image_data_widget.dragging = True
+
+    def _finish_drag(self) -> None:
+        """Reapplies the ROI to full resolution data."""
+
+        self.image_data_widget.dragging = False
+        self.controller._get_output()
 
     def _set_color(self) -> None:
         
@@ -1052,7 +1113,8 @@ class GraphicalLineROIController(QtWidgets.QWidget):
         
         self.line_roi.set_endpoints(self.endpoints["A"], self.endpoints["B"])
         self.line_roi.set_calculation(output=output_type, dims=dims, smoothing_radius=smoothing_radius, smoothing_shape=smoothing_shape)
-        self.line_roi.apply(data=self.image_data_widget.data, coords=self.image_data_widget.coords)
+        data, coords = self.image_data_widget._get_roi_data()
+        self.line_roi.apply(data=data, coords=coords)
         output = self.line_roi.get_output()
 
         self.output_image_tool._plot(output["data"], output["coords"])
@@ -1677,3 +1739,12 @@ class ROIImageTool(pg.ImageView):
         self.setColorMap(colormap=self.colormap)
         self.colorbar.setColorMap(self.colormap)
         self.colorbar.setLevels((0, max))
+
+
+def _get_preview_frames(data, frame_count: int=16):
+    """Returns evenly spaced frames of a cached frame stack, so that value ranges are estimated without reading every frame."""
+
+    if isinstance(data, CachedFrames) and len(data) > frame_count:
+        return data[np.linspace(0, len(data) - 1, frame_count).astype(int)]
+    
+    return data
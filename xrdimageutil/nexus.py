@@ -0,0 +1,332 @@
+"""
+NeXus Files
++++++++++++
+
+.. autosummary::
+
+   ~write_scan
+   ~read_scan
+   ~ScanFile
+
+"""
+
+import h5py
+import hdf5plugin
+import numpy as np
+
+from xrdimageutil import utils
+from xrdimageutil.gridder import SparseVolume
+
+
+_CHUNK_BYTES = 2**20
+
+
+class ScanFile:
+    """
+    A Scan read back from a NeXus file written by ``write_scan``.
+
+    .. index:: ScanFile
+
+    Exposes the same metadata and data attributes as a Scan, so that ROIs
+    can be applied to it with ``apply_to_scan``. Volumes are h5py datasets
+    that are read from the file, and decompressed, only when they are
+    sliced. The file stays open until ``close`` is called, or until the end
+    of a ``with`` block.
+
+    ATTRIBUTES
+
+    path
+        *str* :
+        Path of the NeXus file.
+
+    uid, scan_id, sample, proposal_id, user, motors
+        Metadata of the Scan the file was written from.
+
+    dtype
+        *str* :
+        Floating point precision of the Scan the file was written from.
+
+    rsm
+        *h5py.Dataset* :
+        Reciprocal space map for every point, or None if it was not written.
+
+    rsm_bounds
+        *dict* :
+        HKL bounds of ``rsm``, or None if it was not written.
+
+    raw_data
+        *dict* :
+        2D area detector data and pixel coordinates for every point, or None
+        if they were not written.
+
+    gridded_data
+        *dict* :
+        3D reciprocal space-mapped volume and its HKL coordinates.
+    """
+
+    path = None
+
+    uid = None
+    scan_id = None
+    sample = None
+    proposal_id = None
+    user = None
+    motors = None
+    dtype = "float64"
+
+    rsm = None
+    rsm_bounds = None
+    raw_data = None
+    gridded_data = None
+
+    _file = None
+
+    def __init__(self, path: str) -> None:
+
+        self.path = str(path)
+        self._file = h5py.File(self.path, "r")
+        entry = self._file["entry"]
+
+        for name in ["uid", "scan_id", "sample", "proposal_id", "user", "dtype"]:
+            if name in entry.attrs.keys():
+                setattr(self, name, _get_attr_value(entry.attrs[name]))
+        if "motors" in entry.attrs.keys():
+            self.motors = [str(motor) for motor in entry.attrs["motors"]]
+
+        if "gridded_data" in entry.keys():
+            self.gridded_data = _read_nxdata(entry["gridded_data"])
+        else:
+            self.gridded_data = {"data": None, "coords": None}
+
+        if "raw_data" in entry.keys():
+            self.raw_data = _read_nxdata(entry["raw_data"])
+
+        if "rsm" in entry.keys():
+            self.rsm = entry["rsm"]["data"]
+            self.rsm_bounds = dict([
+                (dim, tuple(float(bound) for bound in entry["rsm"].attrs[f"{dim}_bounds"]))
+                for dim in ["H", "K", "L"]
+            ])
+
+    def __enter__(self) -> object:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Closes the NeXus file."""
+
+        self._file.close()
+
+
+def write_scan(scan, path: str, rsm: bool=False, raw_data: bool=False, compression=None) -> None:
+    """
+    Writes a Scan's gridded data, and optionally its RSM and raw frames, to a NeXus file.
+
+    Volumes are written in chunks, so neither the RSM nor the raw frames
+    are loaded into memory at once, and sparse gridded volumes only write
+    the chunks that hold occupied bins. Chunk shapes are balanced across
+    dimensions, so that slicing along any axis reads a similar number of
+    chunks.
+
+    The file holds an NXentry named "entry" with Scan metadata as
+    attributes. Gridded and raw data are NXdata groups with "data" signals
+    and coordinate axes, and the RSM is an NXcollection.
+
+    PARAMETERS
+
+    scan
+        *xrdimageutil.structures.Scan* :
+        Scan to write.
+
+    path
+        *str* :
+        Path of the file to create. Existing files are overwritten.
+
+    rsm
+        *bool* :
+        Whether to write the Scan's reciprocal space map.
+
+    raw_data
+        *bool* :
+        Whether to write the Scan's raw area detector frames.
+
+    compression
+        *hdf5plugin filter* :
+        Filter to compress datasets with, e.g. ``hdf5plugin.Zstd()``.
+        Defaults to Blosc with zstd and byte shuffling. Pass False to write
+        uncompressed datasets.
+    """
+
+    if compression is None:
+        compression = hdf5plugin.Blosc(cname="zstd", clevel=5, shuffle=hdf5plugin.Blosc.SHUFFLE)
+    elif compression is False:
+        compression = {}
+
+    gridded_data = object.__getattribute__(scan, "gridded_data")
+    if gridded_data is None or gridded_data["data"] is None:
+        if not rsm and not raw_data:
+            raise ValueError("Scan has no gridded data. Use 'grid_data' first, or write its RSM or raw data.")
+        gridded_data = None
+
+    with h5py.File(path, "w") as f:
+        f.attrs["NX_class"] = "NXroot"
+        f.attrs["creator"] = "xrdimageutil"
+        f.attrs["default"] = "entry"
+
+        entry = f.create_group("entry")
+        entry.attrs["NX_class"] = "NXentry"
+        for name in ["uid", "scan_id", "sample", "proposal_id", "user"]:
+            value = getattr(scan, name)
+            if value is not None:
+                entry.attrs[name] = value
+        if scan.motors is not None:
+            entry.attrs["motors"] = [str(motor) for motor in scan.motors]
+        entry.attrs["dtype"] = utils._get_scan_dtype(scan).name
+
+        if gridded_data is not None:
+            entry.attrs["default"] = "gridded_data"
+            group = _create_nxdata(entry, "gridded_data", gridded_data["coords"])
+            _write_volume(group, gridded_data["data"], compression)
+
+        if raw_data:
+            raw_data_dict = object.__getattribute__(scan, "raw_data")
+            if raw_data_dict is None:
+                raw_data_dict = utils._get_raw_data(scan, lazy=True)
+            group = _create_nxdata(entry, "raw_data", raw_data_dict["coords"])
+            _write_volume(group, raw_data_dict["data"], compression)
+
+        if rsm:
+            _write_rsm(entry, scan, compression)
+
+
+def read_scan(path: str) -> ScanFile:
+    """
+    Returns a ScanFile for a NeXus file written by ``write_scan``.
+
+    PARAMETERS
+
+    path
+        *str* :
+        Path of the NeXus file.
+    """
+
+    return ScanFile(path)
+
+
+def _create_nxdata(parent: h5py.Group, name: str, coords: dict) -> h5py.Group:
+    """Creates an NXdata group with a "data" signal and a coordinate axis for every dimension."""
+
+    group = parent.create_group(name)
+    group.attrs["NX_class"] = "NXdata"
+    group.attrs["signal"] = "data"
+    group.attrs["axes"] = list(coords.keys())
+    for i, dim in enumerate(coords.keys()):
+        group.create_dataset(dim, data=np.asarray(coords[dim]))
+        group.attrs[f"{dim}_indices"] = i
+
+    return group
+
+
+def _read_nxdata(group: h5py.Group) -> dict:
+    """Returns the signal and coordinates of an NXdata group, without reading the signal."""
+
+    axes = [str(axis) for axis in group.attrs["axes"]]
+
+    return {
+        "data": group[_get_attr_value(group.attrs["signal"])],
+        "coords": dict([(axis, group[axis][()]) for axis in axes])
+    }
+
+
+def _write_volume(group: h5py.Group, data, compression) -> h5py.Dataset:
+    """Writes a volume to a chunked "data" dataset, one slab of chunks at a time."""
+
+    chunk_shape = _get_chunk_shape(data.shape, np.dtype(data.dtype).itemsize)
+    dataset = group.create_dataset(
+        "data", shape=data.shape, dtype=data.dtype,
+        chunks=chunk_shape, fillvalue=0, **compression
+    )
+
+    if isinstance(data, SparseVolume):
+        # Chunks without occupied bins are never written, so they are not stored
+        chunk_counts = [-(-size // n) for size, n in zip(data.shape, chunk_shape)]
+        bin_idxs = np.unravel_index(data.indices, data.shape)
+        chunk_idxs = np.ravel_multi_index([idxs // n for idxs, n in zip(bin_idxs, chunk_shape)], chunk_counts)
+
+        # Groups occupied bins by chunk, and fills one chunk at a time
+        order = np.argsort(chunk_idxs, kind="stable")
+        occupied_chunk_idxs, starts = np.unique(chunk_idxs[order], return_index=True)
+        stops = np.append(starts[1:], order.size)
+        for chunk_idx, start, stop in zip(occupied_chunk_idxs, starts, stops):
+            entries = order[start:stop]
+            chunk_origin = [i * n for i, n in zip(np.unravel_index(chunk_idx, chunk_counts), chunk_shape)]
+            chunk = tuple(np.s_[origin:min(origin + n, size)] for origin, n, size in zip(chunk_origin, chunk_shape, data.shape))
+            block = np.zeros([c.stop - c.start for c in chunk], dtype=data.dtype)
+            block[tuple(idxs[entries] - origin for idxs, origin in zip(bin_idxs, chunk_origin))] = data.values[entries]
+            dataset[chunk] = block
+    else:
+        for start in range(0, data.shape[0], chunk_shape[0]):
+            points = np.s_[start:min(start + chunk_shape[0], data.shape[0])]
+            dataset[points] = np.asarray(data[points])
+
+    return dataset
+
+
+def _write_rsm(entry: h5py.Group, scan, compression) -> h5py.Dataset:
+    """Writes a Scan's RSM to an NXcollection, computing it a slab of points at a time."""
+
+    point_count = scan.point_count()
+    dtype = utils._get_scan_dtype(scan)
+    rsm_loader = utils._get_rsm_loader(scan)
+    first_point_rsm = rsm_loader(np.s_[0:1])
+    shape = (point_count,) + first_point_rsm.shape[1:]
+
+    group = entry.create_group("rsm")
+    group.attrs["NX_class"] = "NXcollection"
+    chunk_shape = _get_chunk_shape(shape[:-1], dtype.itemsize * 3) + (3,)
+    dataset = group.create_dataset(
+        "data", shape=shape, dtype=dtype,
+        chunks=chunk_shape, **compression
+    )
+
+    # Bounds are reduced while the RSM is written
+    mins, maxs = np.full(3, np.inf), np.full(3, -np.inf)
+    for start in range(0, point_count, chunk_shape[0]):
+        points = np.s_[start:min(start + chunk_shape[0], point_count)]
+        rsm_chunk = np.asarray(rsm_loader(points))
+        dataset[points] = rsm_chunk
+        mins = np.minimum(mins, np.amin(rsm_chunk.reshape(-1, 3), axis=0))
+        maxs = np.maximum(maxs, np.amax(rsm_chunk.reshape(-1, 3), axis=0))
+
+    for dim, bounds in utils._get_bounds_dict(mins, maxs).items():
+        group.attrs[f"{dim}_bounds"] = bounds
+
+    return dataset
+
+
+def _get_chunk_shape(shape: tuple, itemsize: int, chunk_bytes: int=_CHUNK_BYTES) -> tuple:
+    """Returns a chunk shape of at most chunk_bytes, halving the longest dimension until it fits.
+
+    Chunks stay close to cubic, so slices along every axis are read from a
+    similar number of chunks.
+    """
+
+    chunk_shape = [max(int(n), 1) for n in shape]
+    while np.prod(chunk_shape) * itemsize > chunk_bytes and max(chunk_shape) > 1:
+        i = int(np.argmax(chunk_shape))
+        chunk_shape[i] = -(-chunk_shape[i] // 2)
+
+    return tuple(chunk_shape)
+
+
+def _get_attr_value(value):
+    """Returns an HDF5 attribute as a plain Python value."""
+
+    if isinstance(value, bytes):
+        return value.decode()
+    if isinstance(value, np.generic):
+        return value.item()
+
+    return value
@@ -12,8 +12,13 @@ Regions of Interest
 
 import math
 import numpy as np
+from scipy.ndimage import map_coordinates
 from skimage.draw import line_nd
 
+from xrdimageutil.cache import CachedFrames
+from xrdimageutil.gridder import SparseVolume
+
+
 class RectROI:
     """
     A rectangular region of interest that can be applied to 3D datasets.
@@ -165,7 +170,9 @@ class RectROI:
                     bound_2 = np.searchsorted(dim_coords, dim_bounds[1])
                     roi_idx.append(np.s_[bound_1:bound_2])
                     roi_coords.update({dim: dim_coords[np.s_[bound_1:bound_2]]})
-        roi_data = data[tuple(roi_idx)]
+
+        # Slices before converting so that lazy (dask) data only loads the region
+        roi_data = np.asarray(data[tuple(roi_idx)])
 
         # Run output calculation
         if output_type == "average":
@@ -232,6 +239,7 @@ class RectROI:
             raise("Invalid data type provided.")
         
         self.apply(data, coords)
+        self.output["data"] = _apply_scan_dtype(self.output["data"], scan)
     
     def get_output(self) -> dict:
         """Returns the output from the most recent apply() run."""
@@ -333,6 +341,7 @@ class LineROI:
     def apply(self, data, coords) -> None:
         """Applies the selected calculation to a dataset."""
 
+        data = _get_indexable_data(data)
         output_type = self.calculation["output"]
 
         if output_type == "values":
@@ -358,6 +367,7 @@ class LineROI:
             raise("Invalid data type provided.")
         
         self.apply(data, coords)
+        self.output["data"] = _apply_scan_dtype(self.output["data"], scan)
 
     def get_output(self) -> None:
         """Returns the output dictionary."""
@@ -623,7 +633,7 @@ class PlaneROI:
                 "normal": dict((dim, 0) for dim in dims),
             }
 
-        self.calculation = {"output_data": None, "dims": None}
+        self.calculation = {"output_data": None, "dims": None, "interpolation": None}
         self.output = {"data": None, "coords": None}
 
     def set_plane(self, point, normal) -> None:
@@ -652,18 +662,42 @@ class PlaneROI:
             self.plane["point"][dim] = dim_point
             self.plane["normal"][dim] = dim_normal
             
-    def set_calculation(self, output="values") -> None:
+    def set_calculation(self, output="values", interpolation=None, shape=None, offsets=None) -> None:
+        """Sets the output type and how data is sampled at plane positions.
+        
+        "values" samples the plane on a grid of two of the data's pixel axes.
+        "slices" samples a stack of parallel slices on a regular grid along 
+        an orthonormal in-plane basis (u, v), offset from the plane along its
+        normal by ``offsets`` in coordinate units. Slices have ``shape`` 
+        samples along u and v, defaulting to about one sample per pixel, and 
+        their in-plane coordinates are distances from the plane's point.
+
+        By default, "values" truncates plane positions to pixel indicies and 
+        "slices" uses the nearest pixels. With "linear" interpolation, data 
+        is interpolated trilinearly between the eight pixels around each 
+        position.
+        """
 
-        if output not in ["values"]:
+        if output not in ["values", "slices"]:
             raise ValueError("Invalid output type provided.")
+        if interpolation not in [None, "linear"]:
+            raise ValueError("Invalid interpolation provided.")
+        if shape is not None and (len(shape) != 2 or min(shape) < 2):
+            raise ValueError("Invalid shape provided.")
         
         self.calculation["output"] = output
+        self.calculation["interpolation"] = interpolation
+        self.calculation["shape"] = None if shape is None else tuple(int(n) for n in shape)
+        self.calculation["offsets"] = None if offsets is None else list(np.atleast_1d(offsets))
             
     def apply(self, data, coords) -> None:
+        data = _get_indexable_data(data)
         output_data, output_coords = self._get_values(data=data, coords=coords)
 
-        self.output["data"] = output_data
-        self.output["coords"] = output_coords
+        # Replaces the output, so a basis from an earlier calculation is not kept
+        self.output = {"data": output_data, "coords": output_coords}
+        if self.calculation.get("output") == "slices":
+            self.output["basis"] = self._get_basis(list(coords.keys()))
 
     def apply_to_scan(self, scan, data_type) -> None:
         """Applies the selected calculation to a scan dataset."""
@@ -678,21 +712,29 @@ class PlaneROI:
             raise("Invalid data type provided.")
         
         self.apply(data, coords)
+        self.output["data"] = _apply_scan_dtype(self.output["data"], scan)
 
     def get_output(self) -> dict:
         return self.output
     
     def _get_values(self, data, coords) -> tuple:
         """Returns output data and coordinates."""
+
+        if self.calculation.get("output") == "slices":
+            return self._get_slices(data, coords)
         
-        # Retrieves pixel indicies for plane
-        plane_pixels, dim_order = self._get_plane_pixels(data, coords)
+        # Retrieves pixel positions for plane
+        plane_positions, dim_order = self._get_plane_positions(data, coords)
 
-        if plane_pixels is None:
+        if plane_positions is None:
             return (None, None)
+        plane_pixels = plane_positions.astype(np.int64)
 
         # Retrieves output data for plane
-        output_data = self._get_data_from_plane_pixels(plane_pixels=plane_pixels, data=data)
+        if self.calculation.get("interpolation") == "linear":
+            output_data = self._get_interpolated_data_from_plane_positions(plane_positions=plane_positions, data=data)
+        else:
+            output_data = self._get_data_from_plane_pixels(plane_pixels=plane_pixels, data=data)
 
         # Retrieves output coordinates for plane
         output_coords = self._get_output_coords_from_plane_pixels(plane_pixels=plane_pixels, coords=coords, dim_order=dim_order)
@@ -702,8 +744,8 @@ class PlaneROI:
         else:
             return (output_data, output_coords)
     
-    def _get_plane_pixels(self, data, coords) -> np.ndarray:
-        """Returns pixel indicies that correspond to plane."""
+    def _get_plane_positions(self, data, coords) -> np.ndarray:
+        """Returns fractional pixel positions that correspond to plane."""
 
         coords = coords.copy()
 
@@ -803,9 +845,9 @@ class PlaneROI:
                 Z, Y = np.meshgrid(x_axis_range, y_axis_range)
                 X = -(b * Y + c * Z + d) / a
 
-        plane_pixels = np.array([X, Y, Z], dtype=np.int64).T
+        plane_positions = np.array([X, Y, Z], dtype=np.float64).T
         
-        return plane_pixels, dim_order
+        return plane_positions, dim_order
 
     def _get_data_from_plane_pixels(self, plane_pixels, data) -> np.ndarray:
         """Returns the data points that correspond to a given plane of indicies."""
@@ -813,36 +855,103 @@ class PlaneROI:
         # Flattens plane for masking purposes
         flat_plane_pixels = plane_pixels.reshape(-1, plane_pixels.shape[-1])
 
-        print(plane_pixels.shape)
-
-        # Mask to omit invalid indicies
-        flat_mask = np.any(
-            (flat_plane_pixels < 0) | (flat_plane_pixels >= data.shape),
+        # Mask to keep valid indicies
+        flat_mask = np.all(
+            (flat_plane_pixels >= 0) & (flat_plane_pixels < data.shape),
             axis=1
         )
 
-        # Pulls data from given indicies, invalid indicies yield value of 0
-        flat_data_plane = []
-        for i, m in enumerate(flat_mask):
-            if m:
-                flat_data_plane.append(0)
-            else:
-                flat_data_plane.append(data[
-                    flat_plane_pixels[i, 0], 
-                    flat_plane_pixels[i, 1], 
-                    flat_plane_pixels[i, 2]]
-                )
+        # Pulls data from valid indicies in one indexing call, invalid indicies yield value of 0
+        valid_pixels = flat_plane_pixels[flat_mask]
+        flat_data_plane = np.zeros(len(flat_plane_pixels), dtype=data.dtype)
+        flat_data_plane[flat_mask] = data[valid_pixels[:, 0], valid_pixels[:, 1], valid_pixels[:, 2]]
 
-        data_plane = np.array(flat_data_plane).reshape((
+        data_plane = flat_data_plane.reshape((
             plane_pixels.shape[0], 
             plane_pixels.shape[1]
         ))
+        data_plane = np.fliplr(data_plane)
+
+        return data_plane
+
+    def _get_interpolated_data_from_plane_positions(self, plane_positions, data) -> np.ndarray:
+        """Returns data trilinearly interpolated at a given plane of pixel positions."""
+
+        flat_plane_positions = plane_positions.reshape(-1, plane_positions.shape[-1])
+        flat_data_plane = _sample_data(data, flat_plane_positions, order=1)
 
-        print(data_plane.shape)
-        print()
+        data_plane = flat_data_plane.reshape((
+            plane_positions.shape[0], 
+            plane_positions.shape[1]
+        ))
         data_plane = np.fliplr(data_plane)
 
         return data_plane
+
+    def _get_slices(self, data, coords) -> tuple:
+        """Returns a stack of parallel slices through the plane, and their in-plane coordinates.
+        
+        Slices are regular grids along the plane's orthonormal basis, offset 
+        from the plane along its normal. Every slice covers the in-plane 
+        extent of the data across all offsets, so slices share coordinates.
+        """
+
+        dims = list(coords.keys())
+        dim_coords = [np.asarray(coords[dim], dtype=np.float64) for dim in dims]
+        origins = np.array([c[0] for c in dim_coords])
+        steps = np.array([c[1] - c[0] for c in dim_coords])
+        point = np.array([
+            self.plane["point"][dim] if self.plane["point"][dim] is not None else coords[dim][0]
+            for dim in dims
+        ], dtype=np.float64)
+        normal, u, v = _get_plane_basis([self.plane["normal"][dim] for dim in dims])
+        offsets = np.array(self.calculation.get("offsets") or [0], dtype=np.float64)
+
+        extent = _get_plane_extent(
+            lower=np.array([np.amin(c) for c in dim_coords]), 
+            upper=np.array([np.amax(c) for c in dim_coords]),
+            point=point, normal=normal, u=u, v=v, offsets=offsets
+        )
+        if extent is None:
+            return (None, None)
+        (u_min, u_max), (v_min, v_max) = extent
+
+        # Defaults to roughly one sample per pixel along the finest dimension
+        shape = self.calculation.get("shape")
+        if shape is None:
+            min_step = np.amin(np.abs(steps))
+            shape = tuple(
+                max(int(np.ceil((dim_max - dim_min) / min_step)) + 1, 2)
+                for dim_min, dim_max in [(u_min, u_max), (v_min, v_max)]
+            )
+
+        u_coords = np.linspace(u_min, u_max, shape[0])
+        v_coords = np.linspace(v_min, v_max, shape[1])
+
+        # Every slice is sampled in a single call
+        positions = (
+            point 
+            + offsets[:, np.newaxis, np.newaxis, np.newaxis] * normal 
+            + u_coords[np.newaxis, :, np.newaxis, np.newaxis] * u 
+            + v_coords[np.newaxis, np.newaxis, :, np.newaxis] * v
+        )
+        pixel_positions = (positions - origins) / steps
+        order = 1 if self.calculation.get("interpolation") == "linear" else 0
+        output_data = _sample_data(data, pixel_positions.reshape(-1, 3), order=order).reshape(positions.shape[:-1])
+
+        output_coords = {"offset": offsets, "u": u_coords, "v": v_coords}
+
+        return (output_data, output_coords)
+
+    def _get_basis(self, dims: list) -> dict:
+        """Returns the plane's unit normal and in-plane basis vectors by dimension."""
+
+        normal, u, v = _get_plane_basis([self.plane["normal"][dim] for dim in dims])
+
+        return dict(
+            (name, dict(zip(dims, vector.tolist())))
+            for name, vector in [("normal", normal), ("u", u), ("v", v)]
+        )
     
     def _get_output_coords_from_plane_pixels(self, plane_pixels, coords, dim_order) -> dict:
         
@@ -893,18 +1002,6 @@ class PlaneROI:
             dim_coords = coords[dim]
             dim_delta = dim_coords[1] - dim_coords[0]
 
-            if dim_x_px[0] < dim_x_px[-1]:
-
-                if dim_x_px[0] >= 0 and dim_x_px[-1] < len(dim_coords):
-                    x_dim_coords = [dim_coords[px] for px in dim_x_px]
-                else:
-                    print(dim, dim_x_px[0], dim_x_px[-1], len(dim_coords))  
-                    
-            elif dim_x_px[0] > dim_x_px[-1]:
-                ...
-            else:
-                pass
-
             if dim_x_px[0] != dim_x_px[-1]:
                 x_output_coords_label.append(dim)
                 x_dim_coords = [dim_delta * i for i in dim_x_px]
@@ -982,4 +1079,112 @@ class PlaneROI:
 
         unit_vector = [(component / magnitude) for component in v]
 
-        return unit_vector
\ No newline at end of file
+        return unit_vector
+
+
+def _get_indexable_data(data):
+    """Returns data as an array, leaving sparse volumes and cached frames to be indexed without loading them."""
+
+    if isinstance(data, (SparseVolume, CachedFrames)):
+        return data
+    
+    return np.asarray(data)
+
+
+def _get_plane_basis(normal) -> tuple:
+    """Returns a plane's unit normal and an orthonormal in-plane basis (u, v).
+    
+    u is the data axis least aligned with the normal, projected into the 
+    plane, so that axis-aligned normals give axis-aligned slices.
+    """
+
+    normal = np.asarray(normal, dtype=np.float64)
+    if np.linalg.norm(normal) == 0:
+        raise ValueError("Invalid normal provided.")
+    normal = normal / np.linalg.norm(normal)
+
+    axis = np.zeros(3)
+    axis[np.argmin(np.abs(normal))] = 1
+    u = axis - np.dot(axis, normal) * normal
+    u = u / np.linalg.norm(u)
+    v = np.cross(normal, u)
+
+    return (normal, u, v)
+
+
+def _get_plane_extent(lower, upper, point, normal, u, v, offsets) -> tuple:
+    """Returns the (min, max) u and v extent of parallel planes within a box, or None if no plane meets it."""
+
+    # Box corners and the 12 edges between corners that differ in one dimension
+    corners = np.array(np.meshgrid(*zip(lower, upper), indexing="ij")).reshape(3, -1).T
+    edges = np.array([
+        (i, j) for i in range(8) for j in range(i + 1, 8) 
+        if np.count_nonzero(corners[i] != corners[j]) == 1
+    ])
+
+    # Signed distances of every corner from every plane
+    distances = np.dot(corners - point, normal)[np.newaxis, :] - offsets[:, np.newaxis]
+    d_0, d_1 = distances[:, edges[:, 0]], distances[:, edges[:, 1]]
+    crossed = (d_0 * d_1 <= 0) & (d_0 != d_1)
+    t = d_0 / np.where(crossed, d_0 - d_1, 1)
+    intersections = corners[edges[:, 0]] + t[..., np.newaxis] * (corners[edges[:, 1]] - corners[edges[:, 0]])
+
+    # Corners that lie on a plane cover edges that lie in it
+    intersections = np.concatenate([
+        intersections[crossed],
+        np.broadcast_to(corners, distances.shape + (3,))[distances == 0]
+    ])
+    if len(intersections) == 0:
+        return None
+    
+    u_values = np.dot(intersections - point, u)
+    v_values = np.dot(intersections - point, v)
+
+    return ((np.amin(u_values), np.amax(u_values)), (np.amin(v_values), np.amax(v_values)))
+
+
+def _sample_data(data, positions: np.ndarray, order: int=1) -> np.ndarray:
+    """Returns data interpolated at fractional pixel positions with a given spline order.
+    
+    Positions whose nearest pixel lies outside of the data yield a value 
+    of 0. Arrays are interpolated in place, and only the bounding box of the
+    valid positions is read from lazy and sparse data.
+    """
+
+    # Mask to keep positions whose nearest pixel is valid
+    mask = np.all(
+        (positions > -0.5) & (positions < np.array(data.shape) - 0.5),
+        axis=1
+    )
+
+    values = np.zeros(len(positions), dtype=np.float64)
+    if np.any(mask):
+        valid_positions = positions[mask]
+
+        if isinstance(data, np.ndarray):
+            box_min = np.zeros(3, dtype=np.int64)
+            box_data = data
+        else:
+            box_min = np.maximum(np.floor(valid_positions.min(axis=0)).astype(np.int64), 0)
+            box_max = np.minimum(np.floor(valid_positions.max(axis=0)).astype(np.int64) + 2, data.shape)
+            box_data = np.asarray(data[tuple(np.s_[i:j] for i, j in zip(box_min, box_max))])
+
+        values[mask] = map_coordinates(
+            box_data, (valid_positions - box_min).T, 
+            output=np.float64, order=order, mode="nearest"
+        )
+
+    return values
+
+
+def _apply_scan_dtype(output_data, scan):
+    """Rounds floating point ROI output to a scan's precision policy."""
+
+    if output_data is None or not np.issubdtype(np.asarray(output_data).dtype, np.floating):
+        return output_data
+    
+    dtype = np.dtype(scan.dtype)
+    if np.ndim(output_data) == 0:
+        return dtype.type(output_data)
+    else:
+        return np.asarray(output_data).astype(dtype, copy=False)
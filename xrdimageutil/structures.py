@@ -9,11 +9,12 @@ Internal structures for xrd-image-util
 
 """
 
+import bisect
 import databroker
 import numpy as np
+import os
 from prettytable import PrettyTable
 import pyqtgraph as pg
-import xrayutilities as xu
 
 from xrdimageutil import utils
 
@@ -37,9 +38,23 @@ class Catalog:
         *object* :
         Dictionary-like intake catalog that stores raw experimental runs.
 
+    scan_index
+        *dict* :
+        Dictionary mapping run UID's to indexed start document fields
+        (scan_id, sample, proposal_id, user, motors, time, point_count).
+
+    scan_id_index
+        *dict* :
+        Dictionary mapping numerical scan ID's to lists of run UID's, ordered by time.
+
     scan_uid_dict
         *dict* :
         Dictionary mapping run UID's to their associated ``xrdimageutil.structures.Scan`` object.
+        For lazy catalogs, only Scans that have been retrieved are included.
+
+    lazy
+        *bool* :
+        Whether Scan objects are only created when they are retrieved.
 
     .. autosummary::
 
@@ -47,13 +62,22 @@ class Catalog:
        ~list_scans
        ~get_scan
        ~get_scans
+       ~grid_scans
+       ~refresh
     """
     
     local_name = None
     bluesky_catalog = None
+    scan_index = None
+    scan_id_index = None
     scan_uid_dict = None
+    lazy = None
 
-    def __init__(self, local_name) -> None:
+    _time_ordered_uids = None
+    _time_ordered_times = None
+    _columnar_index = None
+
+    def __init__(self, local_name, lazy: bool=False) -> None:
 
         self.local_name = str(local_name)
         self.bluesky_catalog = databroker.catalog[self.local_name]
@@ -61,15 +85,32 @@ class Catalog:
         # Currently only configured for beamline 6-ID-B
         utils._add_catalog_handler(catalog=self)
 
-        # Creates a Scan object for every run in the catalog
-        # Adds Scans to a dictionary
-        self.scan_uid_dict = dict([(uid, Scan(catalog=self, uid=uid)) for uid in list(self.bluesky_catalog)])
+        # Indexes start document fields for every run in one pass
+        self.scan_index = utils._get_catalog_index(self.bluesky_catalog)
+
+        # Maps scan ID's to UID's so that lookups avoid databroker queries
+        self.scan_id_index = {}
+        self._time_ordered_uids = []
+        self._time_ordered_times = []
+        for uid in self.scan_index.keys():
+            self._add_to_scan_id_index(uid)
 
-    def search(self, sample=None, proposal_id=None, user=None) -> list:
+        # Lazy catalogs only create Scan objects when they are retrieved
+        self.lazy = lazy
+        if self.lazy:
+            self.scan_uid_dict = {}
+        else:
+            self.scan_uid_dict = dict([(uid, Scan(catalog=self, uid=uid)) for uid in self.scan_index.keys()])
+
+    def search(self, sample=None, proposal_id=None, user=None, scan_id=None, time=None, motors=None, point_count=None) -> list:
         """
         Retieves a list of scan UID's from provided criteria.
 
-        This function is a limited extension of databroker's catalog search. 
+        Searches run against an in-memory, columnar copy of the catalog's 
+        index, so no databroker queries are made. Every criterion is a 
+        single vectorized comparison. Numerical criteria accept either a 
+        value or an inclusive (min, max) range, where either bound may be 
+        None.
 
         PARAMETERS
         
@@ -85,38 +126,72 @@ class Catalog:
             *str* :
             Manually provided user name/ID.
 
+        scan_id
+            *int* or *tuple* :
+            Numerical scan ID, or range of scan ID's.
+
+        time
+            *float* or *tuple* :
+            Start time, or range of start times, in seconds since the epoch.
+
+        motors
+            *str* or *list* :
+            Motor name, or list of motor names, that a scan must have scanned.
+
+        point_count
+            *int* or *tuple* :
+            Number of points, or range of point counts. Runs that are still
+            running have no point count and never match.
+
         RETURNS
         
         *list* :
-            List of scan UID's.
+            List of scan UID's, ordered by time.
         """
 
-        query = {}
-        if sample is not None:
-            query.update({"sample": sample})
-        if proposal_id is not None:
-            query.update({"proposal_id": proposal_id})
-        if user is not None:
-            query.update({"user": user})
+        if self._columnar_index is None:
+            self._columnar_index = utils._get_columnar_index(self.scan_index)
+        index = self._columnar_index
+        columns = index["columns"]
+
+        mask = np.ones(len(columns), dtype=bool)
+
+        for field, value in [("sample", sample), ("proposal_id", proposal_id), ("user", user)]:
+            if value is not None:
+                if value not in index["codes"][field]:
+                    return []
+                mask &= columns[field] == index["codes"][field][value]
 
-        search_results = self.bluesky_catalog.search(query)
+        for field, value in [("scan_id", scan_id), ("time", time), ("point_count", point_count)]:
+            if value is not None:
+                mask &= utils._get_range_mask(columns[field], value)
 
-        return search_results
+        if motors is not None:
+            if type(motors) == str:
+                motors = [motors]
+            for motor in motors:
+                if motor not in index["motor_rows"]:
+                    return []
+                motor_mask = np.zeros(len(columns), dtype=bool)
+                motor_mask[index["motor_rows"][motor]] = True
+                mask &= motor_mask
+
+        return index["uids"][mask].tolist()
 
     def list_scans(self) -> None:
         """
         Displays basic information about scans within a catalog.
         
-        Depending on the size of the catalog, this function may take 
-        an extended time to run.
+        Information is pulled from the catalog's index, so no runs
+        are opened.
         """
 
         headers = ["scan_id", "motors", "sample", "proposal_id", "user"]
         table = PrettyTable(headers)
 
-        for uid in list(self.scan_uid_dict.keys()):
-            scan = self.scan_uid_dict[uid]
-            row = [scan.scan_id, scan.motors, scan.sample, scan.proposal_id, scan.user]
+        for uid in list(self.scan_index.keys()):
+            entry = self.scan_index[uid]
+            row = [entry[header] for header in headers]
             table.add_row(row)
 
         table.sortby = "scan_id"
@@ -146,18 +221,22 @@ class Catalog:
 
         # UID
         if type(id) == str:
-            if id in self.scan_uid_dict.keys():
-                return self.scan_uid_dict[id]
+            if id in self.scan_index.keys():
+                return self._get_scan_for_uid(id)
             else:
                 raise KeyError(f"Scan with UID '{id}' not found.")
 
+        # Negative integers count back from the most recent scan
+        elif type(id) == int and id < 0:
+            if -id > len(self._time_ordered_uids):
+                raise KeyError(f"Scan with ID #{id} not found.")
+            return self._get_scan_for_uid(self._time_ordered_uids[id])
+
         # Scan ID
         elif type(id) == int:
-            try:
-                uid = self.bluesky_catalog[id].primary.metadata["start"]["uid"]
-                return self.scan_uid_dict[uid]
-            except ValueError:
+            if id not in self.scan_id_index.keys():
                 raise KeyError(f"Scan with ID #{id} not found.")
+            return self._get_scan_for_uid(self.scan_id_index[id][-1])
 
         else:
             raise TypeError(f"Scan ID must be either str or int.")
@@ -181,6 +260,247 @@ class Catalog:
 
         return scan_list
 
+    def refresh(self) -> list:
+        """
+        Indexes runs that have been added to the catalog since it was opened.
+
+        Existing index entries are updated in place (e.g. point counts
+        of runs that have since finished), and new runs are inserted 
+        into the scan ID index in time order.
+
+        RETURNS
+
+        *list* :
+            List of newly indexed scan UID's.
+        """
+
+        self.bluesky_catalog.force_reload()
+        catalog_index = utils._get_catalog_index(self.bluesky_catalog)
+
+        # The columnar index is rebuilt on the next search
+        self._columnar_index = None
+
+        new_uids = []
+        for uid, entry in catalog_index.items():
+            if uid in self.scan_index.keys():
+                self.scan_index[uid].update(entry)
+            else:
+                self.scan_index[uid] = entry
+                self._add_to_scan_id_index(uid)
+                if not self.lazy:
+                    self.scan_uid_dict[uid] = Scan(catalog=self, uid=uid)
+                new_uids.append(uid)
+
+        return new_uids
+
+    def grid_scans(self, scans: list, shape: tuple, bounds: dict=None, chunk_size: int=None, workers: int=None, monitor: str=None, sparse: bool=False, pyramid_levels: int=None) -> dict:
+        """
+        Creates one reciprocal space-mapped volume from several scans.
+
+        Every scan is gridded onto the same bin edges, and sums and hit 
+        counts are accumulated across scans, so regions covered by more 
+        than one scan are normalized by their total number of hits. Cached
+        RSMs are reused.
+
+        PARAMETERS
+
+        scans
+            *list* :
+            List of ``xrdimageutil.structures.Scan`` objects, e.g. from ``get_scans``.
+
+        shape
+            *tuple* :
+            Target shape of the merged reciprocal space volume.
+
+        bounds
+            *dict* :
+            HKL bounds for the merged volume. Defaults to the smallest 
+            bounds that contain every scan's RSM.
+
+        chunk_size
+            *int* :
+            Number of points to grid at a time, as in ``Scan.grid_data``.
+
+        workers
+            *int* :
+            Number of worker processes to grid with. If provided, each scan
+            is binned in its own process and the results are added in scan 
+            order, so the volume is identical to serial gridding. Scripts must
+            guard their entry point with ``if __name__ == "__main__":``.
+
+        monitor
+            *str* :
+            Primary stream field to normalize by, as in ``Scan.grid_data``.
+
+        sparse
+            *bool* :
+            If True, returns volumes that only store occupied bins, as in 
+            ``Scan.grid_data``.
+
+        pyramid_levels
+            *int* :
+            Number of downsampled levels to add under "pyramid", as in 
+            ``Scan.grid_data``.
+
+        RETURNS
+
+        *dict*
+            Merged 3D volume, its associated HKL coordinates, and its sum and
+            hit count volumes, in the same form as ``Scan.gridded_data``.
+        """
+
+        if type(scans) != list:
+            raise TypeError("Input needs to be a list.")
+        if len(scans) == 0:
+            raise ValueError("At least one scan is required.")
+        for scan in scans:
+            if not isinstance(scan, Scan):
+                raise TypeError("Scans must be instances of xrdimageutil.structures.Scan.")
+
+        utils._validate_grid_parameters(shape, bounds=bounds, chunk_size=chunk_size, workers=workers, pyramid_levels=pyramid_levels)
+
+        # Defaults to a bounds box that contains every scan
+        if bounds is None:
+            bounds = utils._merge_bounds([
+                utils._get_rsm_bounds(scan, chunk_size=chunk_size) for scan in scans
+            ])
+
+        gridder = utils._grid_scans(
+            scans, shape, bounds, 
+            chunk_size=chunk_size, 
+            workers=workers,
+            monitor=monitor,
+            sparse=sparse
+        )
+
+        # Uses the widest precision among the scans
+        dtype = np.result_type(*[utils._get_scan_dtype(scan) for scan in scans])
+
+        gridded_data = {
+            "data": gridder.get_data().astype(dtype, copy=False),
+            "coords": gridder.get_coords(),
+            "sum": gridder.sum,
+            "count": gridder.count
+        }
+        if pyramid_levels is not None:
+            gridded_data["pyramid"] = utils._get_gridded_pyramid(gridded_data, gridder, pyramid_levels, dtype)
+
+        return gridded_data
+
+    def process_scans(self, shape: tuple, ids: list=None, query: dict=None, bounds: dict=None, chunk_size: int=10, grid_options: dict=None, rois: list=None, output_dir: str=None, export_options: dict=None, workers: int=None, progress=None) -> dict:
+        """
+        Grids, reduces and exports many scans as a pipeline.
+
+        Every scan is loaded, gridded with ``Scan.grid_data``, reduced with 
+        each ROI's ``apply_to_scan``, and optionally written to a NeXus file
+        with ``xrdimageutil.nexus.write_scan``. With ``workers``, scans are
+        spread across a process pool, one scan per worker at a time. Worker
+        memory is bounded by ``chunk_size``, and on Python 3.11+ workers are
+        replaced every few scans. An error in one scan is recorded in its 
+        result and does not stop the other scans. Workers are spawned, so 
+        scripts must guard their entry point with ``if __name__ == "__main__":``.
+
+        PARAMETERS
+
+        shape
+            *tuple* :
+            Target shape of every gridded volume.
+
+        ids
+            *list* :
+            Scan ID's or UID's to process.
+
+        query
+            *dict* :
+            Search criteria (sample, proposal_id, user) that select scans to
+            process, as in ``search``. Used if ``ids`` is not provided.
+
+        bounds
+            *dict* :
+            HKL bounds of every gridded volume. Defaults to each scan's RSM bounds.
+
+        chunk_size
+            *int* :
+            Number of points to grid at a time, as in ``Scan.grid_data``.
+
+        grid_options
+            *dict* :
+            Other keyword arguments for ``Scan.grid_data`` (e.g. monitor, sparse).
+
+        rois
+            *list* :
+            ROI objects with calculations set, applied to every gridded volume.
+
+        output_dir
+            *str* :
+            Directory to write a NeXus file to for every scan, named 
+            "{scan_id}-{uid}.nxs". Nothing is written if not provided.
+
+        export_options
+            *dict* :
+            Other keyword arguments for ``xrdimageutil.nexus.write_scan`` (e.g. rsm, raw_data).
+
+        workers
+            *int* :
+            Number of worker processes. Scans are processed serially if not provided.
+
+        progress
+            *callable* :
+            Called as ``progress(done, total, result)`` after every scan.
+
+        RETURNS
+
+        *dict* :
+            Result of every scan, keyed by UID. Each result holds the scan's 
+            "uid", "scan_id", a list of "roi_outputs" in ROI order, the "path"
+            it was exported to, and an "error" traceback if it failed.
+        """
+
+        if ids is None and query is None:
+            raise ValueError("Either scan ID's or a search query are required.")
+        if ids is not None:
+            uids = [scan.uid for scan in self.get_scans(ids)]
+        else:
+            uids = list(self.search(**query))
+
+        utils._validate_grid_parameters(shape, bounds=bounds, chunk_size=chunk_size, workers=workers)
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+
+        options = {
+            "shape": shape,
+            "bounds": bounds,
+            "chunk_size": chunk_size,
+            "grid_options": grid_options if grid_options is not None else {},
+            "rois": rois if rois is not None else [],
+            "output_dir": output_dir,
+            "export_options": export_options if export_options is not None else {}
+        }
+
+        return utils._process_scans(self, uids, options, workers=workers, progress=progress)
+
+    def _add_to_scan_id_index(self, uid: str) -> None:
+        """Inserts an indexed run into the time-ordered scan ID index."""
+
+        entry = self.scan_index[uid]
+        time = entry["time"] if entry["time"] is not None else 0
+
+        i = bisect.bisect_right(self._time_ordered_times, time)
+        self._time_ordered_times.insert(i, time)
+        self._time_ordered_uids.insert(i, uid)
+
+        scan_id_uids = self.scan_id_index.setdefault(entry["scan_id"], [])
+        scan_id_times = [self.scan_index[scan_id_uid]["time"] or 0 for scan_id_uid in scan_id_uids]
+        scan_id_uids.insert(bisect.bisect_right(scan_id_times, time), uid)
+
+    def _get_scan_for_uid(self, uid: str) -> object:
+        """Returns the Scan for a UID, creating it if needed."""
+
+        if uid not in self.scan_uid_dict.keys():
+            self.scan_uid_dict[uid] = Scan(catalog=self, uid=uid)
+
+        return self.scan_uid_dict[uid]
+
 class Scan(object):
     """
     An interface for databroker's BlueskyRun class.
@@ -229,13 +549,51 @@ class Scan(object):
         *numpy.ndarray*
         Reciprocal space map for every point.
 
+    rsm_bounds
+        *dict*
+        HKL bounds of ``rsm``, computed while the map is generated.
+
     raw_data
         *dict*
         2D area detector data, pixel coordinates for every point.
 
+    lazy_raw_data
+        *bool*
+        Whether ``raw_data`` holds lazily loaded frames instead of loading
+        every frame into memory. Lazy frames are an 
+        ``xrdimageutil.cache.CachedFrames`` stack, so only the frames that
+        are indexed are read, and recently used frames are kept in
+        ``xrdimageutil.cache.frame_cache``. Must be set before ``raw_data`` 
+        is first accessed.
+
+    dtype
+        *str*
+        Floating point precision of ``rsm``, ``gridded_data`` and ROI outputs,
+        either "float64" (default) or "float32". Must be set before ``rsm``
+        is first accessed. With "float32", every RSM value is rounded to the
+        nearest float32 (relative error at most 2**-24, about 6e-8), so
+        pixels that lie within that distance of a bin edge may be gridded
+        into the neighboring bin. Gridded sums are still accumulated in 
+        float64 and rounded once, so gridded values also carry a relative 
+        error of at most 2**-24. Memory is halved for ``rsm`` and the stored
+        volumes. Hit counts are accumulated as 32-bit integers, but sums 
+        stay float64, so gridding accumulators use three quarters of the
+        float64 memory.
+
+    geometry_profile
+        *str* or *xrdimageutil.geometry.GeometryProfile*
+        Geometry profile, or the name of a registered profile, used to compute
+        ``rsm``. By default, the profile is selected by the run's start document
+        and falls back on "6-ID-B". Must be set before ``rsm`` is first accessed.
+
     gridded_data
         *dict*
-        3D reciprocal space-mapped volume of data and associated HKL coordinates.
+        3D reciprocal space-mapped volume of data and associated HKL coordinates,
+        along with the unnormalized sum and hit count volumes.
+
+    gridded_point_count
+        *int*
+        Number of points accumulated into ``gridded_data``.
     """
 
     catalog = None
@@ -250,13 +608,26 @@ class Scan(object):
     motors = None
     
     rsm = None
+    rsm_bounds = None
     raw_data = None
     gridded_data = None
 
+    lazy_raw_data = False
+    dtype = "float64"
+    geometry_profile = None
+    gridded_point_count = None
+
+    _primary_cache = None
+    _gridder = None
+    _grid_chunk_size = None
+    _grid_monitor = None
+    _grid_pyramid_levels = None
+
     def __init__(self, catalog: Catalog, uid: str) -> None:
 
         self.catalog = catalog
         self.uid = uid
+        self._primary_cache = []
 
     def __getattribute__(self, __name: str):
         """
@@ -269,34 +640,42 @@ class Scan(object):
             return object.__getattribute__(self, __name)
         elif __name == "scan_id":
             if object.__getattribute__(self, __name) is None:
-                object.__setattr__(self, __name, self.bluesky_run.metadata["start"]["scan_id"])
+                object.__setattr__(self, __name, self._get_start_field("scan_id"))
             return object.__getattribute__(self, __name) 
         elif __name == "sample":
             if object.__getattribute__(self, __name) is None:
-                object.__setattr__(self, __name, self.bluesky_run.metadata["start"]["sample"])
+                object.__setattr__(self, __name, self._get_start_field("sample"))
             return object.__getattribute__(self, __name) 
         elif __name == "proposal_id":
             if object.__getattribute__(self, __name) is None:
-                object.__setattr__(self, __name, self.bluesky_run.metadata["start"]["proposal_id"])
+                object.__setattr__(self, __name, self._get_start_field("proposal_id"))
             return object.__getattribute__(self, __name)
         elif __name == "user":
             if object.__getattribute__(self, __name) is None:
-                object.__setattr__(self, __name, self.bluesky_run.metadata["start"]["user"])
+                object.__setattr__(self, __name, self._get_start_field("user"))
             return object.__getattribute__(self, __name)
         elif __name == "motors":
             if object.__getattribute__(self, __name) is None:
-                object.__setattr__(self, __name, self.bluesky_run.metadata["start"]["motors"])
+                object.__setattr__(self, __name, self._get_start_field("motors"))
             return object.__getattribute__(self, __name)
         elif __name == "rsm":
             if object.__getattribute__(self, __name) is None:
-                object.__setattr__(self, __name, utils._get_rsm_for_scan(self))
+                rsm, rsm_bounds = utils._get_rsm_for_scan(self)
+                object.__setattr__(self, __name, rsm)
+                if object.__getattribute__(self, "rsm_bounds") is None:
+                    object.__setattr__(self, "rsm_bounds", rsm_bounds)
             return object.__getattribute__(self, __name)
+        elif __name == "rsm_bounds":
+            # Bounds are computed along with the RSM
             if object.__getattribute__(self, __name) is None:
-                object.__setattr__(self, __name, utils._get_rsm_bounds(self))
+                self.rsm
             return object.__getattribute__(self, __name)
         elif __name == "raw_data":
             if object.__getattribute__(self, __name) is None:
-                object.__setattr__(self, __name, utils._get_raw_data(self))
+                if self.lazy_raw_data:
+                    object.__setattr__(self, __name, utils._get_cached_raw_data(self))
+                else:
+                    object.__setattr__(self, __name, utils._get_raw_data(self))
             return object.__getattribute__(self, __name)
         elif __name == "gridded_data":
             if object.__getattribute__(self, __name) is None:
@@ -305,13 +684,16 @@ class Scan(object):
         else:
             return object.__getattribute__(self, __name)
         
-    def grid_data(self, shape: tuple, bounds: dict=None) -> None:
+    def grid_data(self, shape: tuple, bounds: dict=None, chunk_size: int=None, workers: int=None, monitor: str=None, sparse: bool=False, pyramid_levels: int=None) -> None:
         """
         Creates a reciprocal space-mapped volume of raw data.
         
         Given a target image shape (3D) and HKL bounds, the function defines
         the ``gridded_data`` attribute with a dictionary containing the newly
-        generated 3D volume and its associated HKL coordinates.
+        generated 3D volume and its associated HKL coordinates. The volume is
+        the mean value in every bin, and the unnormalized "sum" and hit 
+        "count" volumes are included so that volumes can be merged or 
+        renormalized without gridding again.
 
         PARAMETERS
 
@@ -322,76 +704,228 @@ class Scan(object):
         bounds
             *dict* :
             HKL bounds for new reciprocal space volume.
+
+        chunk_size
+            *int* :
+            Number of points to grid at a time. If provided, RSM chunks are 
+            computed on the fly and raw frames are read chunk by chunk, so 
+            neither the full RSM nor all raw data are held in memory. When
+            bounds are computed automatically, the RSM chunks computed for 
+            them are written into the on-disk RSM cache and read back for 
+            gridding, so every point is only converted once.
+
+        workers
+            *int* :
+            Number of worker processes to grid with. If provided, points are 
+            split into one shard per worker, starting on chunk boundaries. 
+            Each worker loads and bins its shard, and returns the per-bin sums
+            and hit counts of every chunk, which are added in point order 
+            exactly as in serial gridding. The volume is therefore identical 
+            to serial gridding, including monitor-normalized values. Each 
+            worker reads RSM chunks from the on-disk RSM cache or computes 
+            them, so ``chunk_size`` also bounds per-worker memory. Without a
+            ``chunk_size``, workers return every binned value of their shard,
+            since serial gridding adds them all at once. Workers are spawned, 
+            so scripts must guard their entry point with 
+            ``if __name__ == "__main__":``.
+
+        monitor
+            *str* :
+            Primary stream field (e.g. a beam flux monitor) to normalize by.
+            If provided, every frame is divided by its point's monitor value
+            before it is gridded.
+
+        sparse
+            *bool* :
+            If True, the gridded volumes are ``xrdimageutil.gridder.SparseVolume``
+            objects that only store occupied bins, so memory use scales with
+            the number of occupied bins rather than with ``shape``.
+
+        pyramid_levels
+            *int* :
+            Number of 2x downsampled levels to build. If provided, 
+            ``gridded_data["pyramid"]`` holds a list of data and coordinate 
+            dictionaries, from the full resolution volume to the coarsest 
+            level. Levels are built from the gridded sums and hit counts, so
+            every coarse bin is the mean of every value in its 2x2x2 block.
         """
 
-        # Shape validation
-        if type(shape) is not tuple:
-            raise TypeError(f"Shape must be a tuple.")
-        if len(shape) != 3:
-            raise ValueError(f"Shape must be of length 3.")
-        for i in shape:
-            if type(i) != int:
-                raise ValueError(f"Dimension shape must consist of integers.")
-            if i < 10:
-                raise ValueError(f"Minimum gridded data shape is (10, 10, 10).")
-        
-        # Bounds validation
+        utils._validate_grid_parameters(shape, bounds=bounds, chunk_size=chunk_size, workers=workers, pyramid_levels=pyramid_levels)
+
+        # Defaults to the bounds of the full RSM, which are stored with it
         if bounds is None:
-            bounds = {
-                "H": (np.amin(self.rsm[:,:,:,0]), np.amax(self.rsm[:,:,:,0])),
-                "K": (np.amin(self.rsm[:,:,:,1]), np.amax(self.rsm[:,:,:,1])),
-                "L": (np.amin(self.rsm[:,:,:,2]), np.amax(self.rsm[:,:,:,2]))
-            }
-        else:
-            if set(list(bounds.keys())) != set(["H", "K", "L"]):
-                raise ValueError(f"Expects 'H', 'K', and 'L' as keys for gridded data bounds.")
-            for i in list(bounds.keys()):
-                if type(bounds[i]) != tuple or type(bounds[i]) != list or len(bounds[i]) != 2:
-                    raise ValueError(f"Expects a tuple/list (len 2) denoting a min and max value for each dimension.")
-                if bounds[i][0] >= bounds[i][1]:
-                    raise ValueError(f"First bound must be less than second bound.")
+            bounds = utils._get_rsm_bounds(self, chunk_size=chunk_size)
                 
-        # Prepares gridder bounds/interpolation
-        gridder = xu.Gridder3D(
-            nx=shape[0], 
-            ny=shape[1], 
-            nz=shape[2]
-        )
-        gridder.KeepData(True)
-        gridder.dataRange(
-            xmin=bounds["H"][0], xmax=bounds["H"][1],
-            ymin=bounds["K"][0], ymax=bounds["K"][1],
-            zmin=bounds["L"][0], zmax=bounds["L"][1],
-            fixed=True
-        )
-
         # Grids raw data with bounds
-        gridder(
-            self.rsm[:,:,:,0], 
-            self.rsm[:,:,:,1], 
-            self.rsm[:,:,:,2], 
-            self.raw_data["data"]
-        )
-        self.gridded_data["data"] = gridder.data
-
-        # Retrieves HKL coordinates for gridded data
-        self.gridded_data["coords"] = {
-            "H": gridder.xaxis, 
-            "K": gridder.yaxis, 
-            "L": gridder.zaxis
-        }
+        point_count = self.point_count()
+        if workers is not None:
+            gridder = utils._grid_scan_parallel(
+                self, shape, bounds, 
+                chunk_size=chunk_size, 
+                workers=workers,
+                monitor=monitor,
+                sparse=sparse
+            )
+        else:
+            if chunk_size is None:
+                rsm = self.rsm
+                rsm_loader = lambda points: rsm[points]
+                raw_data = self.raw_data["data"]
+            else:
+                rsm_loader = utils._get_rsm_loader(self)
+                raw_data = utils._get_streaming_raw_data(self)
+
+            gridder = utils._create_gridder(shape, bounds, sparse=sparse, dtype=utils._get_scan_dtype(self))
+            utils._grid_points(
+                gridder, rsm_loader, raw_data, 
+                points=np.s_[0:point_count], 
+                chunk_size=chunk_size,
+                monitor_values=utils._get_monitor_values(self, monitor)
+            )
+
+        # Keeps the gridder so that points added later can be accumulated into it
+        self._gridder = gridder
+        self._grid_chunk_size = chunk_size
+        self._grid_monitor = monitor
+        self._grid_pyramid_levels = pyramid_levels
+        self.gridded_point_count = point_count
+        self._set_gridded_data()
     
+    def refresh(self) -> int:
+        """
+        Updates the Scan with points that have been added since it was last loaded.
+
+        Meant for scans that are still running. Cached primary stream reads
+        are discarded, and ``raw_data`` is reloaded the next time it is 
+        accessed. A loaded ``rsm`` is extended by computing only the new 
+        points, and its bounds are widened to include them. If data has been
+        gridded, RSMs are computed and frames are read only for the new 
+        points, and they are added into the existing volume in chunks of 
+        the original ``chunk_size``. The volume keeps its original bounds, so new
+        points that fall outside of them are not gridded; pass explicit 
+        ``bounds`` to ``grid_data`` for scans that are still running.
+
+        RETURNS
+
+        *int* :
+            Number of new points since the last refresh, or since data was
+            last gridded.
+        """
+
+        # Gridded scans count new points from the last gridded point
+        previous_point_count = self.gridded_point_count
+        if previous_point_count is None:
+            previous_point_count = self.point_count()
+
+        # Reopens the run so that new events are read
+        run = self.catalog.bluesky_catalog[self.uid]
+        object.__setattr__(self, "bluesky_run", run)
+        self._primary_cache = []
+        if self.uid in self.catalog.scan_index.keys():
+            self.catalog.scan_index[self.uid].update(utils._get_catalog_index_entry(
+                start=run.metadata["start"],
+                stop=run.metadata.get("stop")
+            ))
+            self.catalog._columnar_index = None
+
+        point_count = self.point_count()
+
+        # A loaded RSM is extended with the new points, and raw data is
+        # reloaded for every point on next access
+        if point_count != previous_point_count:
+            rsm = object.__getattribute__(self, "rsm")
+            if rsm is not None and 0 < len(rsm) < point_count:
+                rsm, rsm_bounds = utils._extend_rsm_for_scan(self, rsm, self.rsm_bounds)
+            else:
+                rsm, rsm_bounds = None, None
+            object.__setattr__(self, "rsm", rsm)
+            object.__setattr__(self, "rsm_bounds", rsm_bounds)
+            object.__setattr__(self, "raw_data", None)
+
+        if self._gridder is not None and point_count > self.gridded_point_count:
+            utils._grid_points(
+                self._gridder,
+                rsm_loader=utils._get_rsm_loader(self),
+                raw_data=utils._get_streaming_raw_data(self),
+                points=np.s_[self.gridded_point_count:point_count],
+                chunk_size=self._grid_chunk_size,
+                monitor_values=utils._get_monitor_values(self, self._grid_monitor)
+            )
+            self.gridded_point_count = point_count
+            self._set_gridded_data()
+
+        return point_count - previous_point_count
+
+    def _set_gridded_data(self) -> None:
+        """Sets ``gridded_data`` from the Scan's gridder."""
+
+        self.gridded_data["data"] = self._gridder.get_data().astype(utils._get_scan_dtype(self), copy=False)
+        self.gridded_data["coords"] = self._gridder.get_coords()
+        self.gridded_data["sum"] = self._gridder.sum
+        self.gridded_data["count"] = self._gridder.count
+        if self._grid_pyramid_levels is not None:
+            self.gridded_data["pyramid"] = utils._get_gridded_pyramid(
+                self.gridded_data, self._gridder, self._grid_pyramid_levels, utils._get_scan_dtype(self)
+            )
+        else:
+            self.gridded_data.pop("pyramid", None)
+
+    def _get_start_field(self, name: str):
+        """Returns a start document field, preferring the parent Catalog's index."""
+
+        scan_index = self.catalog.scan_index
+        if scan_index is not None and self.uid in scan_index.keys():
+            return scan_index[self.uid][name]
+        else:
+            return self.bluesky_run.metadata["start"][name]
+
+    def read_primary(self, fields: list=None, scalars_only: bool=False) -> object:
+        """
+        Returns data from the Scan's primary stream.
+
+        Reads are memoized, so each needed set of fields is only read
+        from the Bluesky run once per Scan.
+
+        PARAMETERS
+
+        fields
+            *list* :
+            Names of the fields to read. All fields are read by default.
+
+        scalars_only
+            *bool* :
+            Only reads scalar (per-point) columns, skipping area detector
+            images such as ``pilatus100k_image``.
+
+        RETURNS
+
+        *object*
+            Instance of ``xarray.Dataset``.
+        """
+
+        return utils._read_primary_stream(self, fields=fields, scalars_only=scalars_only)
+
     def point_count(self) -> int:
         """
         Returns the number of points in run.
         """
 
+        # Completed runs have a fixed point count in the catalog index
+        scan_index = self.catalog.scan_index
+        if scan_index is not None and self.uid in scan_index.keys():
+            if scan_index[self.uid]["point_count"] is not None:
+                return scan_index[self.uid]["point_count"]
+
         if "primary" not in self.bluesky_run.keys():
             return 0
-        elif "dims" not in self.bluesky_run.primary.metadata.keys():
-            return 0
-        else:
+
+        stop = self.bluesky_run.metadata["stop"]
+        if stop is not None and "primary" in stop.get("num_events", {}):
+            return stop["num_events"]["primary"]
+        elif "dims" in self.bluesky_run.primary.metadata.keys():
             return self.bluesky_run.primary.metadata["dims"]["time"]
+        else:
+            return len(self.read_primary(scalars_only=True)["time"])
 
     def view_image_data(self) -> None:
         """
@@ -406,4 +940,3 @@ class Scan(object):
         self.gui_window.show()
         self.gui_window.raise_()
         self.app.exec_()
-print('test')
\ No newline at end of file
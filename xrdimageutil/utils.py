@@ -3,18 +3,41 @@ See LICENSE file.
 """
 
 import area_detector_handlers.handlers as adh
-from dask.array import from_array
+from collections import OrderedDict
+from concurrent.futures import as_completed, ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+from dask.array import from_array, stack
+import databroker
+from dask.base import tokenize
+import h5py
+import hashlib
 import numpy as np
+import os
+import sys
+import threading
+import traceback
 import pyqtgraph as pg
 from scipy.signal import find_peaks, peak_widths
 from sklearn import preprocessing
 import xrayutilities as xu
 
+from xrdimageutil import cache, geometry
+from xrdimageutil.gridder import Gridder
+
 
 class PilatusHDF5Handler(adh.AreaDetectorHDF5SingleHandler):
     """Handler for the Pilatus detector HDF5 files. This version is
     geared specifically towards beamline 6-ID-B.
 
+    Frames are stored in one file per point. Points are returned as lazy
+    dask arrays over the HDF5 datasets, chunked like the datasets, so only
+    the chunks that are sliced are ever read. Open files are kept in a 
+    bounded, least recently used pool. If ``prefetch_count`` is set, 
+    reading a point starts reading the full frames of the points that 
+    follow it on a thread pool, so that file I/O overlaps with the caller's
+    work when points are read in order. h5py serializes reads, so the gain
+    comes from overlapping I/O with computation, not from concurrent reads.
+
     Originally from Gilberto Fabbris.
     """
 
@@ -22,8 +45,226 @@ class PilatusHDF5Handler(adh.AreaDetectorHDF5SingleHandler):
         {"AD_HDF5_Pilatus_6idb"} | adh.AreaDetectorHDF5SingleHandler.specs
     )
 
+    # Points are already lazy, so databroker does not wrap them
+    return_type = {"delayed": True}
+
+    # Maximum number of open files
+    pool_size = 32
+
+    # Number of points read ahead of a requested point. Off by default, 
+    # since sliced and random access reads only need the requested points
+    prefetch_count = 0
+
+    # Number of threads that read frames
+    workers = 4
+
+    def __init__(self, fpath, template, filename, frame_per_point=1):
+        super().__init__(
+            fpath=fpath, 
+            template=template, 
+            filename=filename, 
+            frame_per_point=frame_per_point
+        )
+        self._files = OrderedDict()
+        self._prefetched = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._layout = None
+        self._point_count = 0
+
     def __call__(self, point_number):
-        return from_array(super().__call__(point_number))
+
+        # Every file of a resource is written with the same layout
+        fnames = list(self._fnames_for_point(point_number))
+        if self._layout is None:
+            dataset = self._get_file(fnames[0])[self._key]
+            self._layout = (dataset.shape, dataset.dtype, dataset.chunks or dataset.shape)
+        shape, dtype, chunks = self._layout
+
+        frames = [
+            from_array(
+                _PilatusFrame(self, point_number, frame_number, shape, dtype),
+                chunks=chunks,
+                name="pilatus-hdf5-" + tokenize(fname, self._key),
+                meta=np.empty((0,) * len(shape), dtype=dtype),
+                fancy=False
+            )
+            for frame_number, fname in enumerate(fnames)
+        ]
+
+        return stack(frames)
+
+    def read_points(self, points: range) -> np.ndarray:
+        """Returns the frames of a range of points, stacked into a single array.
+        
+        Points are read on the handler's thread pool, directly into a
+        preallocated array with a shape of (points, frames per point, 
+        rows, columns).
+        """
+
+        points = list(points)
+        if len(points) == 0:
+            raise ValueError("At least one point is required.")
+
+        fnames = list(self._fnames_for_point(points[0]))
+        dataset = self._get_file(fnames[0])[self._key]
+        frames = np.empty((len(points), len(fnames)) + dataset.shape, dtype=dataset.dtype)
+
+        futures = [
+            self._get_executor().submit(self._read_point, point_number, frames[i])
+            for i, point_number in enumerate(points)
+        ]
+        for future in futures:
+            future.result()
+
+        return frames
+
+    def close(self):
+        super().close()
+
+        with self._lock:
+            for future in self._prefetched.values():
+                future.cancel()
+            self._prefetched.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+        with self._lock:
+            for file in self._files.values():
+                file.close()
+            self._files.clear()
+
+    def _read_point(self, point_number: int, out: np.ndarray) -> np.ndarray:
+        """Reads the frames of a point into an output array, using frames that have been read ahead."""
+
+        frames = self._get_prefetched(point_number)
+        if frames is not None:
+            out[...] = frames
+            return out
+
+        return self._load_point(point_number, out)
+
+    def _load_point(self, point_number: int, out: np.ndarray=None) -> np.ndarray:
+        """Returns the frames of a point from its files, reading them into an output array if one is given."""
+
+        fnames = list(self._fnames_for_point(point_number))
+        if out is None:
+            return np.stack([self._get_file(fname)[self._key][()] for fname in fnames])
+        
+        for j, fname in enumerate(fnames):
+            self._get_file(fname)[self._key].read_direct(out[j])
+
+        return out
+
+    def _read_chunk(self, point_number: int, frame_number: int, key: tuple) -> np.ndarray:
+        """Returns a slice of one of a point's frames, and starts reading the points that follow it."""
+
+        # Points past the last one written are not read ahead
+        stop = point_number + 1 + self.prefetch_count
+        self._prefetch(range(point_number + 1, min(stop, self._get_point_count(stop))))
+
+        frames = self._get_prefetched(point_number)
+        if frames is not None:
+            return frames[frame_number][key]
+
+        fname = list(self._fnames_for_point(point_number))[frame_number]
+
+        return self._get_file(fname)[self._key][key]
+
+    def _get_point_count(self, stop: int) -> int:
+        """Returns the number of points whose files have been written, counting no further than a stop point.
+        
+        Points are written in order, so counting stops at the first point
+        with a missing file. Running scans keep writing files, so the count
+        is extended on every call rather than fixed.
+        """
+
+        if self.prefetch_count < 1:
+            return 0
+
+        with self._lock:
+            while self._point_count < stop and all(os.path.exists(fname) for fname in self._fnames_for_point(self._point_count)):
+                self._point_count += 1
+
+            return self._point_count
+
+    def _get_prefetched(self, point_number: int) -> np.ndarray:
+        """Returns the frames of a point that has been read ahead, or None."""
+
+        with self._lock:
+            future = self._prefetched.get(point_number)
+
+        return _get_future_result(future)
+
+    def _prefetch(self, points: range) -> None:
+        """Starts reading points that have not been read ahead yet."""
+
+        if self.prefetch_count < 1:
+            return
+
+        with self._lock:
+            executor = self._get_executor()
+            for point_number in points:
+                if point_number not in self._prefetched:
+                    self._prefetched[point_number] = executor.submit(self._load_point, point_number)
+
+            # Points that are never requested are dropped, oldest first
+            while len(self._prefetched) > 2 * self.prefetch_count:
+                self._prefetched.popitem(last=False)[1].cancel()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Returns the handler's thread pool, creating it on first use."""
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        return self._executor
+
+    def _get_file(self, fname: str) -> h5py.File:
+        """Returns an open file from the pool, opening it and evicting the least recently used file if needed.
+        
+        Evicted files are closed once no read holds them.
+        """
+
+        with self._lock:
+            if fname in self._files:
+                self._files.move_to_end(fname)
+                return self._files[fname]
+
+            file = h5py.File(fname, "r")
+            self._files[fname] = file
+            while len(self._files) > self.pool_size:
+                self._files.popitem(last=False)
+
+        return file
+
+
+class _PilatusFrame:
+    """A frame of a point that reads slices through its handler, for use with dask."""
+
+    def __init__(self, handler: PilatusHDF5Handler, point_number: int, frame_number: int, shape: tuple, dtype) -> None:
+        self.handler = handler
+        self.point_number = point_number
+        self.frame_number = frame_number
+        self.shape = shape
+        self.dtype = dtype
+        self.ndim = len(shape)
+
+    def __getitem__(self, key: tuple) -> np.ndarray:
+        return self.handler._read_chunk(self.point_number, self.frame_number, key)
+
+
+def _get_future_result(future):
+    """Returns the result of a finished or running future, or None if there is no result."""
+
+    if future is None or future.cancelled():
+        return None
+    
+    try:
+        return future.result()
+    except Exception:
+        return None
 
 
 def _add_catalog_handler(catalog) -> None:
@@ -37,100 +278,1005 @@ def _add_catalog_handler(catalog) -> None:
     )
 
 
-def _get_rsm_for_scan(scan) -> np.ndarray:
-    """Returns a reciprocal space map for a given scan.
+def _get_catalog_index(bluesky_catalog) -> dict:
+    """Returns start document fields for every run in a catalog.
     
-    In its current form, this function works only for four
-    circle geometries
+    Run entries are walked in a single pass, so no run is opened.
     """
 
-    # TODO: Generalize this function
+    catalog_index = {}
+    for uid, entry in bluesky_catalog.walk(depth=1).items():
+        metadata = entry.describe()["metadata"]
+        catalog_index[uid] = _get_catalog_index_entry(
+            start=metadata["start"], 
+            stop=metadata.get("stop")
+        )
+
+    return catalog_index
+
+
+def _get_catalog_index_entry(start: dict, stop: dict=None) -> dict:
+    """Returns the indexed fields for a single run."""
+
+    if stop is not None and "primary" in stop.get("num_events", {}):
+        point_count = stop["num_events"]["primary"]
+    else:
+        point_count = None
+
+    return {
+        "scan_id": start.get("scan_id"),
+        "sample": start.get("sample"),
+        "proposal_id": start.get("proposal_id"),
+        "user": start.get("user"),
+        "motors": start.get("motors"),
+        "time": start.get("time"),
+        "point_count": point_count
+    }
+
+
+def _get_columnar_index(scan_index: dict) -> dict:
+    """Returns a columnar copy of a catalog index for vectorized searches.
+    
+    Rows are ordered by time. Numerical fields are float64 columns, with 
+    NaN for missing values, and string fields are stored as integer codes
+    with a code lookup, so every criterion is a single array comparison.
+    Motors are stored as an inverted index from motor names to rows.
+    """
+
+    uids = sorted(
+        scan_index.keys(), 
+        key=lambda uid: scan_index[uid]["time"] if scan_index[uid]["time"] is not None else 0
+    )
+    entries = [scan_index[uid] for uid in uids]
+
+    columns = np.zeros(len(uids), dtype=[
+        ("scan_id", np.float64), ("time", np.float64), ("point_count", np.float64),
+        ("sample", np.int64), ("proposal_id", np.int64), ("user", np.int64)
+    ])
+    for field in ["scan_id", "time", "point_count"]:
+        columns[field] = [entry[field] if entry[field] is not None else np.nan for entry in entries]
+
+    # Missing values are coded as -1
+    codes = {}
+    for field in ["sample", "proposal_id", "user"]:
+        codes[field] = {}
+        for entry in entries:
+            if entry[field] is not None and entry[field] not in codes[field]:
+                codes[field][entry[field]] = len(codes[field])
+        columns[field] = [codes[field].get(entry[field], -1) if entry[field] is not None else -1 for entry in entries]
+
+    motor_rows = {}
+    for row, entry in enumerate(entries):
+        for motor in entry["motors"] or []:
+            motor_rows.setdefault(motor, []).append(row)
+
+    return {
+        "uids": np.array(uids),
+        "columns": columns,
+        "codes": codes,
+        "motor_rows": dict([(motor, np.array(rows)) for motor, rows in motor_rows.items()])
+    }
+
+
+def _get_range_mask(column: np.ndarray, value) -> np.ndarray:
+    """Returns a mask of column values equal to a value, or within an inclusive (min, max) range.
+    
+    Either bound of a range may be None. Missing (NaN) values never match.
+    """
+
+    if type(value) == tuple or type(value) == list:
+        if len(value) != 2:
+            raise ValueError("Ranges must be given as (min, max).")
+        mask = ~np.isnan(column)
+        if value[0] is not None:
+            mask &= column >= value[0]
+        if value[1] is not None:
+            mask &= column <= value[1]
+        return mask
+    
+    return column == value
+
+
+def _get_primary_data_keys(scan) -> dict:
+    """Returns the data keys for a scan's primary stream."""
+
+    data_keys = {}
+    for descriptor in scan.bluesky_run.primary.metadata["descriptors"]:
+        data_keys.update(descriptor["data_keys"])
+
+    return data_keys
+
+
+def _read_primary_stream(scan, fields: list=None, scalars_only: bool=False, lazy: bool=False):
+    """Returns an xarray Dataset with the requested primary stream fields.
+    
+    Reads are memoized on the Scan. A request is served from any earlier
+    read that already holds every requested field, so the stream is only
+    read once per needed set of fields. Lazy reads return a dask-backed
+    Dataset and are never used to serve eager requests.
+    """
+
+    data_keys = _get_primary_data_keys(scan)
+
+    if fields is None:
+        fields = list(data_keys.keys())
+    else:
+        fields = list(fields)
+        for field in fields:
+            if field not in data_keys:
+                raise KeyError(f"Field '{field}' not found in primary stream.")
+
+    # Scalar columns are the ones without a per-event shape
+    if scalars_only:
+        fields = [field for field in fields if len(data_keys[field]["shape"]) == 0]
+
+    for cached_fields, cached_lazy, cached_data in scan._primary_cache:
+        if cached_fields.issuperset(fields) and (lazy or not cached_lazy):
+            return cached_data[fields]
+
+    if lazy:
+        data = scan.bluesky_run.primary(include=fields).to_dask()
+    else:
+        data = scan.bluesky_run.primary(include=fields).read()
+    scan._primary_cache.append((frozenset(fields), lazy, data))
+
+    return data
+
+
+def _get_rsm_for_scan(scan) -> tuple:
+    """Returns a reciprocal space map and its HKL bounds for a given scan.
+
+    Maps are loaded from the on-disk RSM cache when one has already been
+    computed for the scan's UID and geometry. Bounds are computed while
+    the map is generated and are cached alongside it.
+    
+    Instrument and detector geometry come from the scan's geometry profile.
+    """
 
     run = scan.bluesky_run
 
     # Checks if scan includes a "primary" category,
     # where data is traditionally stored
     if "primary" not in run.keys():
-        return None
+        return None, None
+
+    rsm_params = _get_rsm_params(scan)
+    geometry_hash = _get_geometry_hash(rsm_params)
+
+    rsm = cache.rsm_cache.get(uid=scan.uid, geometry_hash=geometry_hash)
+    if rsm is None:
+        rsm, rsm_bounds = _compute_rsm(rsm_params, return_bounds=True)
+        cache.rsm_cache.put(uid=scan.uid, geometry_hash=geometry_hash, rsm=rsm, bounds=rsm_bounds)
+    else:
+        rsm_bounds = cache.rsm_cache.get_bounds(uid=scan.uid, geometry_hash=geometry_hash)
+        if rsm_bounds is None:
+            rsm_bounds = _get_bounds_from_rsm(rsm)
+
+    return rsm, rsm_bounds
+
+
+def _extend_rsm_for_scan(scan, rsm: np.ndarray, rsm_bounds: dict) -> tuple:
+    """Returns a scan's RSM and HKL bounds, extended with points added since it was loaded.
+    
+    Only the new points are computed. The extended map replaces the loaded
+    map in the on-disk RSM cache.
+    """
+
+    rsm_params = _get_rsm_params(scan)
+    new_rsm, new_bounds = _compute_rsm(rsm_params, points=np.s_[len(rsm):], return_bounds=True)
+    if new_bounds is None:
+        return rsm, rsm_bounds
+
+    rsm = np.concatenate([rsm, new_rsm])
+    rsm_bounds = dict([
+        (dim, (min(rsm_bounds[dim][0], new_bounds[dim][0]), max(rsm_bounds[dim][1], new_bounds[dim][1])))
+        for dim in ["H", "K", "L"]
+    ])
+    cache.rsm_cache.put(uid=scan.uid, geometry_hash=_get_geometry_hash(rsm_params), rsm=rsm, bounds=rsm_bounds)
+
+    return rsm, rsm_bounds
+
+
+def _get_rsm_params(scan) -> dict:
+    """Returns the instrument and detector values that determine a scan's RSM."""
+
+    run = scan.bluesky_run
+    point_count = scan.point_count()
+    profile = _get_geometry_profile(scan)
 
     # Instrument config values
-    omega_values = run.primary.read()["fourc_omega"].values
-    chi_values = run.primary.read()["fourc_chi"].values
-    phi_values = run.primary.read()["fourc_phi"].values
-    tth_values = run.primary.read()["fourc_tth"].values
-    sample_circle_values = [omega_values, chi_values, phi_values]
-    instrument_circle_values = [tth_values]
-    circle_values = sample_circle_values + instrument_circle_values
-    energy_values = run.primary.config["fourc"].read()["fourc_energy"].values * 1000
-    ub_matrix = run.primary.config["fourc"].read()["fourc_UB"].values[0]
-    sample_circle_directions = ["z-", "y+", "z-"]
-    detector_circle_directions = ["z-"]
-    primary_beam_direction = [0, 1, 0]
-    inplane_reference_direction = [0, 1, 0]
-    sample_normal_direction = [0, 0, 1]
+    circle_fields = profile.sample_circles + profile.detector_circles
+    circle_data = _read_primary_stream(scan, fields=circle_fields)
+    circle_values = [circle_data[field].values[:point_count] for field in circle_fields]
+    config_data = run.primary.config[profile.config_device].read()
+    energy_values = config_data[profile.energy_field].values[:point_count] * profile.energy_scale
+    ub_matrix = config_data[profile.ub_field].values[0]
 
     # Detector config values
-    pixel_directions = ["z-", "x-"]
-    center_channel_pixels = [252, 107]
-    pixel_count = [
-        run.primary.metadata["dims"]["dim_2"], 
-        run.primary.metadata["dims"]["dim_1"]
-    ]
-    detector_size = [83.764, 33.54]
+    image_shape = _get_primary_data_keys(scan)[profile.image_field]["shape"]
+    # Shapes may or may not include a leading frame dimension
+    pixel_count = [image_shape[-1], image_shape[-2]]
     pixel_size = [
-        detector_size[0] / pixel_count[0],
-        detector_size[1] / pixel_count[1]
+        profile.detector_size[0] / pixel_count[0],
+        profile.detector_size[1] / pixel_count[1]
     ]
-    detector_distance = 900.644 # mm
     roi = [0, pixel_count[0], 0, pixel_count[1]]
 
-    q_conversion = xu.experiment.QConversion(
-        sampleAxis=sample_circle_directions,
-        detectorAxis=detector_circle_directions,
-        r_i=primary_beam_direction
+    # Precision of the map, which is also part of its cache key
+    dtype = _get_scan_dtype(scan).str
+
+    return {
+        "circle_values": circle_values,
+        "energy_values": energy_values,
+        "ub_matrix": ub_matrix,
+        "sample_circle_directions": profile.sample_circle_directions,
+        "detector_circle_directions": profile.detector_circle_directions,
+        "primary_beam_direction": profile.primary_beam_direction,
+        "pixel_directions": profile.pixel_directions,
+        "center_channel_pixels": profile.center_channel_pixels,
+        "pixel_count": pixel_count,
+        "pixel_size": pixel_size,
+        "detector_distance": profile.detector_distance,
+        "roi": roi,
+        "dtype": dtype
+    }
+
+
+def _get_geometry_profile(scan) -> geometry.GeometryProfile:
+    """Returns the geometry profile for a scan.
+    
+    A profile set on the Scan takes priority over one selected by
+    the run's start document.
+    """
+
+    profile = scan.geometry_profile
+    if isinstance(profile, geometry.GeometryProfile):
+        return profile
+    elif profile is not None:
+        return geometry.get_profile(profile)
+    else:
+        return geometry._get_profile_for_run(scan.bluesky_run.metadata["start"])
+
+
+def _get_scan_dtype(scan) -> np.dtype:
+    """Returns the floating point dtype of a scan's precision policy."""
+
+    dtype = np.dtype(scan.dtype)
+    if dtype not in [np.dtype(np.float32), np.dtype(np.float64)]:
+        raise ValueError(f"Scan dtype must be either 'float32' or 'float64'.")
+
+    return dtype
+
+
+def _get_geometry_hash(rsm_params: dict) -> str:
+    """Returns a hash of every value that determines an RSM."""
+
+    # Versions the conversion itself, so that maps cached by an earlier
+    # conversion are not reused
+    geometry_hash = hashlib.sha256(f"rsm-v{_RSM_VERSION}".encode())
+    for key in sorted(rsm_params.keys()):
+        value = np.asarray(rsm_params[key])
+        geometry_hash.update(key.encode())
+        geometry_hash.update(str((value.dtype.str, value.shape)).encode())
+        geometry_hash.update(value.tobytes())
+
+    return geometry_hash.hexdigest()[:32]
+
+
+def _compute_rsm(rsm_params: dict, points: slice=None, return_bounds: bool=False):
+    """Returns a reciprocal space map computed from RSM parameters.
+    
+    If a slice of points is given, the map is only computed for those points.
+    If return_bounds is True, the map's HKL bounds are also returned. They are
+    reduced from each batch of converted points as it is computed, which 
+    avoids extra passes over the full map.
+    """
+
+    if points is None:
+        points = np.s_[:]
+
+    circle_values = [circle[points] for circle in rsm_params["circle_values"]]
+    energy_values = rsm_params["energy_values"][points]
+    pixel_count = rsm_params["pixel_count"]
+
+    point_count = len(energy_values)
+    dtype = np.dtype(rsm_params["dtype"])
+    rsm = np.empty((point_count, pixel_count[0], pixel_count[1], 3), dtype=dtype)
+    mins, maxs = np.full(3, np.inf), np.full(3, -np.inf)
+    if point_count == 0:
+        return (rsm, None) if return_bounds else rsm
+
+    # Unit vectors from the sample to every pixel at zero detector angles
+    pixel_directions = _get_pixel_directions(rsm_params)
+    primary_beam_direction = np.asarray(rsm_params["primary_beam_direction"], dtype=np.float64)
+    primary_beam_direction = primary_beam_direction / np.linalg.norm(primary_beam_direction)
+
+    # Per point, Q = k * (R_d @ u - r_i) in the lab frame, which is then
+    # rotated into the sample frame and converted to HKL with (R_s @ UB)^-1.
+    # Both steps are folded into one 3x3 matrix and one offset per point.
+    sample_circle_count = len(rsm_params["sample_circle_directions"])
+    sample_matrices = _get_rotation_matrices(
+        rsm_params["sample_circle_directions"], 
+        circle_values[:sample_circle_count]
     )
+    detector_matrices = _get_rotation_matrices(
+        rsm_params["detector_circle_directions"], 
+        circle_values[sample_circle_count:]
+    )
+    hkl_matrices = np.linalg.inv(sample_matrices @ rsm_params["ub_matrix"])
+    wavevectors = 2 * np.pi / xu.utilities.en2lam(np.asarray(energy_values, dtype=np.float64))
+    point_matrices = wavevectors[:, None, None] * (hkl_matrices @ detector_matrices)
+    point_offsets = wavevectors[:, None] * (hkl_matrices @ primary_beam_direction)
 
-    point_rsm_list = []
-    for i in range(scan.point_count()):
-        
-        hxrd = xu.HXRD(
-            idir=inplane_reference_direction,
-            ndir=sample_normal_direction,
-            en=energy_values[i],
-            qconv=q_conversion
+    # Converts points in batches to bound temporary memory
+    for start in range(0, point_count, _RSM_BATCH_SIZE):
+        batch = np.s_[start:min(start + _RSM_BATCH_SIZE, point_count)]
+        q = point_matrices[batch] @ pixel_directions
+        q -= point_offsets[batch, :, None]
+        rsm[batch] = np.swapaxes(q, 1, 2).reshape(-1, pixel_count[0], pixel_count[1], 3)
+
+        # Rounding is monotonic, so bounds of the rounded map are the rounded bounds
+        if return_bounds:
+            mins = np.minimum(mins, np.amin(q, axis=(0, 2)).astype(dtype))
+            maxs = np.maximum(maxs, np.amax(q, axis=(0, 2)).astype(dtype))
+
+    if return_bounds:
+        return rsm, _get_bounds_dict(mins, maxs)
+    else:
+        return rsm
+
+
+def _get_pixel_directions(rsm_params: dict) -> np.ndarray:
+    """Returns unit vectors from the sample to every detector pixel at zero detector angles.
+    
+    Vectors are returned as a (3, pixel count) array, with the first pixel
+    direction varying slowest. Detector geometry is fixed for a geometry 
+    profile and image shape, so tables are computed once and reused for 
+    every point and every scan with the same geometry.
+    """
+
+    geometry_keys = [
+        "primary_beam_direction", "pixel_directions", "center_channel_pixels", 
+        "pixel_count", "pixel_size", "detector_distance", "roi"
+    ]
+    geometry_hash = _get_geometry_hash(dict([(key, rsm_params[key]) for key in geometry_keys]))
+
+    if geometry_hash not in _pixel_direction_tables.keys():
+        primary_beam_direction = np.asarray(rsm_params["primary_beam_direction"], dtype=np.float64)
+        primary_beam_direction = primary_beam_direction / np.linalg.norm(primary_beam_direction)
+        center_channel_pixels = rsm_params["center_channel_pixels"]
+        pixel_size = rsm_params["pixel_size"]
+        roi = rsm_params["roi"]
+
+        # Offsets between neighboring pixels along each pixel direction
+        pixel_offsets = [
+            _get_axis_vector(pixel_direction) * size 
+            for pixel_direction, size in zip(rsm_params["pixel_directions"], pixel_size)
+        ]
+
+        # The center channel lies along the primary beam at the detector distance
+        pixel_idxs_1, pixel_idxs_2 = np.meshgrid(
+            np.arange(roi[0], roi[1]) - center_channel_pixels[0],
+            np.arange(roi[2], roi[3]) - center_channel_pixels[1],
+            indexing="ij"
+        )
+        pixel_positions = (
+            np.multiply.outer(pixel_offsets[0], pixel_idxs_1.ravel()) +
+            np.multiply.outer(pixel_offsets[1], pixel_idxs_2.ravel()) +
+            (primary_beam_direction * rsm_params["detector_distance"])[:, None]
+        )
+
+        _pixel_direction_tables[geometry_hash] = pixel_positions / np.linalg.norm(pixel_positions, axis=0)
+
+    return _pixel_direction_tables[geometry_hash]
+
+
+def _get_axis_vector(direction: str) -> np.ndarray:
+    """Returns the unit vector for a direction string such as "z-"."""
+
+    if type(direction) != str or len(direction) != 2 or direction[0] not in "xyz" or direction[1] not in "+-":
+        raise ValueError(f"Invalid direction '{direction}'. Expects an axis and a sense, e.g. 'z-'.")
+
+    axis_vector = np.zeros(3)
+    axis_vector["xyz".index(direction[0])] = 1 if direction[1] == "+" else -1
+
+    return axis_vector
+
+
+def _get_rotation_matrices(directions: list, angles: list) -> np.ndarray:
+    """Returns the combined rotation matrix of a stack of circles for every point.
+    
+    Circles are given outermost first, and angles are in degrees.
+    """
+
+    point_count = len(angles[0]) if len(angles) > 0 else 0
+    rotation_matrices = np.broadcast_to(np.identity(3), (point_count, 3, 3))
+
+    for direction, circle_angles in zip(directions, angles):
+        sense = _get_axis_vector(direction).sum()
+        axis = "xyz".index(direction[0])
+        radians = sense * np.radians(np.asarray(circle_angles, dtype=np.float64))
+        cos, sin = np.cos(radians), np.sin(radians)
+
+        # Right-handed rotation about the circle's axis
+        i, j = [(1, 2), (2, 0), (0, 1)][axis]
+        circle_matrices = np.zeros((point_count, 3, 3))
+        circle_matrices[:, axis, axis] = 1
+        circle_matrices[:, i, i] = cos
+        circle_matrices[:, j, j] = cos
+        circle_matrices[:, i, j] = -sin
+        circle_matrices[:, j, i] = sin
+
+        rotation_matrices = rotation_matrices @ circle_matrices
+
+    return rotation_matrices
+
+
+_pixel_direction_tables = {}
+_RSM_BATCH_SIZE = 16
+_RSM_VERSION = 2
+
+
+def _get_rsm_loader(scan):
+    """Returns a function that loads a scan's RSM for a slice of points.
+    
+    Chunks are sliced from an already loaded RSM or the on-disk RSM cache
+    when available, and are otherwise computed on the fly, so the full
+    RSM is never loaded.
+    """
+
+    # Avoids triggering the Scan's lazy loader
+    rsm = object.__getattribute__(scan, "rsm")
+    if rsm is None:
+        rsm_params = _get_rsm_params(scan)
+        rsm = cache.rsm_cache.get(uid=scan.uid, geometry_hash=_get_geometry_hash(rsm_params))
+
+    if rsm is not None:
+        return lambda points: rsm[points]
+    else:
+        return lambda points: _compute_rsm(rsm_params, points=points)
+
+
+def _get_rsm_bounds(scan, chunk_size: int=None) -> dict:
+    """Returns the HKL bounds of a scan's RSM.
+    
+    Bounds stored with a loaded or cached RSM are reused. Otherwise, if a 
+    chunk size is given, the RSM is computed in chunks of points rather 
+    than being loaded in full, and bounds are reduced from each chunk. 
+    Chunks are written into the on-disk RSM cache as they are computed, so
+    gridding reads them back instead of computing them a second time.
+    """
+
+    # Avoids triggering the Scan's lazy loaders
+    rsm_bounds = object.__getattribute__(scan, "rsm_bounds")
+    if rsm_bounds is not None:
+        return rsm_bounds
+
+    if chunk_size is None:
+        return scan.rsm_bounds
+
+    if "primary" not in scan.bluesky_run.keys():
+        return None
+
+    rsm_params = _get_rsm_params(scan)
+    rsm_bounds = cache.rsm_cache.get_bounds(uid=scan.uid, geometry_hash=_get_geometry_hash(rsm_params))
+    if rsm_bounds is not None:
+        return rsm_bounds
+
+    rsm = object.__getattribute__(scan, "rsm")
+    if rsm is not None:
+        return _get_bounds_from_rsm(rsm)
+
+    point_count = scan.point_count()
+    rsm_map = cache.rsm_cache.create(
+        (point_count, rsm_params["pixel_count"][0], rsm_params["pixel_count"][1], 3), 
+        rsm_params["dtype"]
+    )
+
+    mins, maxs = np.full(3, np.inf), np.full(3, -np.inf)
+    try:
+        for start in range(0, point_count, chunk_size):
+            points = np.s_[start:min(start + chunk_size, point_count)]
+            rsm_chunk, chunk_bounds = _compute_rsm(rsm_params, points=points, return_bounds=True)
+            if rsm_map is not None:
+                rsm_map[points] = rsm_chunk
+            for dim, hkl in enumerate(["H", "K", "L"]):
+                mins[dim] = min(mins[dim], chunk_bounds[hkl][0])
+                maxs[dim] = max(maxs[dim], chunk_bounds[hkl][1])
+    except BaseException:
+        if rsm_map is not None:
+            cache.rsm_cache.discard(rsm_map)
+        raise
+
+    rsm_bounds = _get_bounds_dict(mins, maxs)
+    if rsm_map is not None:
+        cache.rsm_cache.commit(uid=scan.uid, geometry_hash=_get_geometry_hash(rsm_params), rsm=rsm_map, bounds=rsm_bounds)
+
+    return rsm_bounds
+
+
+def _get_bounds_from_rsm(rsm: np.ndarray) -> dict:
+    """Returns the HKL bounds of an existing RSM in a single pass over its points."""
+
+    mins, maxs = np.full(3, np.inf), np.full(3, -np.inf)
+    for point_rsm in rsm:
+        flat_point_rsm = point_rsm.reshape(-1, 3)
+        mins = np.minimum(mins, np.amin(flat_point_rsm, axis=0))
+        maxs = np.maximum(maxs, np.amax(flat_point_rsm, axis=0))
+
+    return _get_bounds_dict(mins, maxs)
+
+
+def _get_bounds_dict(mins: np.ndarray, maxs: np.ndarray) -> dict:
+    """Returns HKL bounds from arrays of minimum and maximum values."""
+
+    return {
+        "H": (mins[0], maxs[0]),
+        "K": (mins[1], maxs[1]),
+        "L": (mins[2], maxs[2])
+    }
+
+
+def _get_cached_raw_data(scan) -> dict:
+    """Returns raw detector data whose frames are loaded through the frame cache."""
+
+    raw_data = _get_raw_data(scan, lazy=True)
+    if raw_data is not None:
+        raw_data["data"] = cache.CachedFrames(raw_data["data"], key=scan.uid)
+
+    return raw_data
+
+
+def _get_streaming_raw_data(scan) -> np.ndarray:
+    """Returns a scan's raw data array, lazily if it is not already loaded."""
+
+    # Avoids triggering the Scan's lazy loader
+    raw_data = object.__getattribute__(scan, "raw_data")
+    if raw_data is None:
+        raw_data = _get_raw_data(scan, lazy=True)
+
+    return raw_data["data"]
+
+
+def _create_gridder(shape: tuple, bounds: dict, sparse: bool=False, dtype: np.dtype=np.float64) -> Gridder:
+    """Returns an empty gridder with fixed HKL bounds.
+    
+    Under the float32 precision policy, hit counts are 32-bit integers, 
+    which count up to 2**31 - 1 hits per bin. Sums are always float64, so 
+    that gridded values are only rounded once.
+    """
+
+    count_dtype = np.int32 if np.dtype(dtype) == np.float32 else np.int64
+
+    return Gridder(shape, bounds, sparse=sparse, count_dtype=count_dtype)
+
+
+def _grid_points(gridder: Gridder, rsm_loader, raw_data, points: slice, chunk_size: int=None, monitor_values: np.ndarray=None) -> None:
+    """Accumulates a range of scan points into a gridder, one chunk at a time.
+    
+    If monitor values are given, every frame is divided by its point's
+    monitor value before it is gridded.
+    """
+
+    for rsm_chunk, values in _get_point_chunks(rsm_loader, raw_data, points, chunk_size=chunk_size, monitor_values=monitor_values):
+        gridder.add(
+            rsm_chunk[:,:,:,0], 
+            rsm_chunk[:,:,:,1], 
+            rsm_chunk[:,:,:,2], 
+            values
         )
 
-        hxrd.Ang2Q.init_area(
-            pixel_directions[0], pixel_directions[1],
-            cch1=center_channel_pixels[0], cch2=center_channel_pixels[1],
-            Nch1=pixel_count[0], Nch2=pixel_count[1],
-            pwidth1=pixel_size[0], pwidth2=pixel_size[1],
-            distance=detector_distance, roi=roi
+
+def _get_point_chunks(rsm_loader, raw_data, points: slice, chunk_size: int=None, monitor_values: np.ndarray=None):
+    """Yields the RSM and values of a range of scan points, one chunk at a time.
+    
+    Without a chunk size, every point is yielded as a single chunk.
+    """
+
+    if chunk_size is None:
+        chunk_size = max(points.stop - points.start, 1)
+
+    for start in range(points.start, points.stop, chunk_size):
+        chunk_points = np.s_[start:min(start + chunk_size, points.stop)]
+        rsm_chunk = rsm_loader(chunk_points)
+        values = np.asarray(raw_data[chunk_points])
+        if monitor_values is not None:
+            values = values / monitor_values[chunk_points, np.newaxis, np.newaxis]
+
+        yield rsm_chunk, values
+
+
+def _get_monitor_values(scan, monitor: str=None) -> np.ndarray:
+    """Returns a scan's monitor value for every point, or None if no monitor is given."""
+
+    if monitor is None:
+        return None
+
+    monitor_values = _read_primary_stream(scan, fields=[monitor])[monitor].values
+    monitor_values = np.asarray(monitor_values[:scan.point_count()], dtype=np.float64)
+    if monitor_values.ndim != 1:
+        raise ValueError(f"Monitor '{monitor}' must hold one value per point.")
+
+    return monitor_values
+
+
+def _grid_scan_parallel(scan, shape: tuple, bounds: dict, chunk_size: int=None, workers: int=1, monitor: str=None, sparse: bool=False) -> Gridder:
+    """Grids a scan's points across a process pool and reduces the shards.
+    
+    Points are split into one contiguous shard per worker. Shards start on
+    chunk boundaries, so every chunk is gridded by a single worker.
+    """
+
+    point_count = scan.point_count()
+    step = chunk_size if chunk_size is not None else 1
+    chunk_count = -(-point_count // step)
+    shard_edges = np.minimum(np.linspace(0, chunk_count, workers + 1).astype(int) * step, point_count)
+    shards = [
+        _get_shard(scan, np.s_[start:stop], monitor=monitor) 
+        for start, stop in zip(shard_edges[:-1], shard_edges[1:]) if stop > start
+    ]
+
+    return _grid_shards_parallel(shards, shape, bounds, chunk_size=chunk_size, workers=workers, sparse=sparse)
+
+
+def _grid_scans(scans: list, shape: tuple, bounds: dict, chunk_size: int=None, workers: int=None, monitor: str=None, sparse: bool=False) -> Gridder:
+    """Grids several scans into one gridder with shared bin edges.
+    
+    Sums and hit counts from every scan are accumulated together, so
+    regions covered by more than one scan are normalized by their total
+    number of hits. With workers, each scan is gridded in its own process.
+    """
+
+    if workers is not None:
+        shards = [_get_shard(scan, np.s_[0:scan.point_count()], monitor=monitor) for scan in scans]
+        return _grid_shards_parallel(shards, shape, bounds, chunk_size=chunk_size, workers=workers, sparse=sparse)
+
+    dtype = np.result_type(*[_get_scan_dtype(scan) for scan in scans])
+    gridder = _create_gridder(shape, bounds, sparse=sparse, dtype=dtype)
+    for scan in scans:
+        _grid_points(
+            gridder, 
+            rsm_loader=_get_rsm_loader(scan), 
+            raw_data=_get_streaming_raw_data(scan), 
+            points=np.s_[0:scan.point_count()], 
+            chunk_size=chunk_size,
+            monitor_values=_get_monitor_values(scan, monitor)
         )
 
-        point_circle_values = [circle[i] for circle in circle_values]
-        qx, qy, qz = hxrd.Ang2Q.area(*point_circle_values, UB=ub_matrix)
+    return gridder
 
-        point_rsm = np.array([qx, qy, qz])
-        point_rsm_list.append(point_rsm)
+
+def _get_shard(scan, points: slice, monitor: str=None) -> dict:
+    """Returns everything a worker process needs to grid some of a scan's points.
     
-    # Converts to ndarray and reorders dimensions
-    rsm = np.array(point_rsm_list)
-    rsm = rsm.swapaxes(1, 3)
-    rsm = rsm.swapaxes(1, 2)
+    Profiles are passed as objects, since profiles registered in this 
+    process are not registered in spawned workers.
+    """
 
-    return rsm
+    return {
+        "local_name": scan.catalog.local_name,
+        "uid": scan.uid,
+        "points": points,
+        "dtype": scan.dtype,
+        "geometry_profile": _get_geometry_profile(scan),
+        "monitor": monitor
+    }
+
+
+def _grid_shards_parallel(shards: list, shape: tuple, bounds: dict, chunk_size: int=None, workers: int=1, sparse: bool=False) -> Gridder:
+    """Bins shards of scan points across a process pool and adds them in point order.
+    
+    Workers return the per-bin sums and hit counts of every chunk of points,
+    which are added in the same order and with the same arithmetic as in
+    serial gridding, so the volume is identical to serial gridding, even for
+    values that are not integers, such as monitor-normalized counts. Without
+    a chunk size, serial gridding adds all of a scan's points at once, so the
+    binned values of every shard of a scan are added together.
+    """
+
+    dtype = np.result_type(*[shard["dtype"] for shard in shards])
+    gridder = _create_gridder(shape, bounds, sparse=sparse, dtype=dtype)
+
+    # Workers are spawned rather than forked, as forking a process that has
+    # already started reader threads can deadlock
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        shard_parts = executor.map(
+            _grid_scan_shard,
+            shards,
+            [shape] * len(shards),
+            [bounds] * len(shards),
+            [chunk_size] * len(shards)
+        )
+
+        scan_parts = []
+        for shard, parts in zip(shards, shard_parts):
+            if chunk_size is not None:
+                for flat_idxs, sums, counts in parts:
+                    gridder._add_bin_sums(flat_idxs, sums, counts)
+                continue
+
+            # The first shard of a scan starts at its first point
+            if shard["points"].start == 0:
+                _add_scan_parts(gridder, scan_parts)
+                scan_parts = []
+            scan_parts.extend(parts)
+        _add_scan_parts(gridder, scan_parts)
+
+    return gridder
+
+
+def _add_scan_parts(gridder: Gridder, parts: list) -> None:
+    """Adds the binned values of every shard of a scan to a gridder at once."""
+
+    if len(parts) > 0:
+        gridder._add_bins(
+            np.concatenate([flat_idxs for flat_idxs, values, counts in parts]),
+            np.concatenate([values for flat_idxs, values, counts in parts])
+        )
+
+
+def _grid_scan_shard(shard: dict, shape: tuple, bounds: dict, chunk_size: int=None) -> list:
+    """Bins a shard of a scan's points in a worker process.
+    
+    Returns a (flat bin indices, sums, hit counts) part for every chunk of 
+    points, with the unique bins the chunk hits. Without a chunk size, the
+    shard is part of a chunk shared with other shards, so its binned values
+    are returned as they are, without counts. The run is opened by UID, so
+    the catalog is not indexed for every shard.
+    """
+
+    from xrdimageutil.structures import Scan
+
+    scan = Scan(catalog=_get_run_catalog(shard["local_name"]), uid=shard["uid"])
+    scan.dtype = shard["dtype"]
+    scan.geometry_profile = shard["geometry_profile"]
+
+    # Only bins values, so no volume is allocated
+    binner = Gridder(shape, bounds, sparse=True)
+
+    parts = []
+    point_chunks = _get_point_chunks(
+        rsm_loader=_get_rsm_loader(scan), 
+        raw_data=_get_streaming_raw_data(scan), 
+        points=shard["points"], 
+        chunk_size=chunk_size,
+        monitor_values=_get_monitor_values(scan, shard["monitor"])
+    )
+    for rsm_chunk, values in point_chunks:
+        flat_idxs, values = binner._get_bins(rsm_chunk[:,:,:,0], rsm_chunk[:,:,:,1], rsm_chunk[:,:,:,2], values)
+        if chunk_size is None:
+            parts.append((flat_idxs, values, None))
+        else:
+            bin_idxs, inverse = np.unique(flat_idxs, return_inverse=True)
+            parts.append((
+                bin_idxs, 
+                np.bincount(inverse, weights=values, minlength=bin_idxs.size), 
+                np.bincount(inverse, minlength=bin_idxs.size)
+            ))
+
+    return parts
+
+
+class _RunCatalog:
+    """Stands in for a Catalog in worker processes, and only opens runs by UID.
+    
+    Building a Catalog indexes every run in it, which workers do not need.
+    """
+
+    scan_index = None
+
+    def __init__(self, local_name: str) -> None:
+
+        self.local_name = str(local_name)
+        self.bluesky_catalog = databroker.catalog[self.local_name]
+        _add_catalog_handler(catalog=self)
+
+
+_run_catalogs = {}
+
+
+def _get_run_catalog(local_name: str) -> _RunCatalog:
+    """Returns a catalog that opens runs by UID, created once per process."""
+
+    if local_name not in _run_catalogs:
+        _run_catalogs[local_name] = _RunCatalog(local_name)
+
+    return _run_catalogs[local_name]
+
+
+# Worker processes are replaced after this many scans (Python 3.11+), which
+# releases memory that accumulates across scans, such as reader caches
+_PIPELINE_SCANS_PER_WORKER = 8
+
+
+def _process_scans(catalog, uids: list, options: dict, workers: int=None, progress=None) -> dict:
+    """Runs the scan pipeline for every UID, serially or across a process pool.
+    
+    Results are returned in UID order. Failures are recorded in each 
+    scan's result rather than raised, so one failing scan does not stop
+    the others.
+    """
+
+    results = {}
+
+    def _report(uid: str, result: dict) -> None:
+        results[uid] = result
+        if progress is not None:
+            progress(len(results), len(uids), result)
+
+    if workers is None:
+        for uid in uids:
+            _report(uid, _process_scan(catalog, uid, options))
+    else:
+        pool_kwargs = {}
+        if sys.version_info >= (3, 11):
+            pool_kwargs["max_tasks_per_child"] = _PIPELINE_SCANS_PER_WORKER
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"), **pool_kwargs) as executor:
+            futures = dict([(executor.submit(_process_run, catalog.local_name, uid, options), uid) for uid in uids])
+            for future in as_completed(futures):
+                uid = futures[future]
+                try:
+                    result = future.result()
+                except Exception:
+                    # Raised if the worker process itself failed
+                    result = _get_scan_result(uid, error=traceback.format_exc())
+                _report(uid, result)
+
+    return dict([(uid, results[uid]) for uid in uids])
+
+
+def _process_run(local_name: str, uid: str, options: dict) -> dict:
+    """Runs the scan pipeline for a single run in a worker process."""
+
+    return _process_scan(_get_run_catalog(local_name), uid, options)
+
+
+def _process_scan(catalog, uid: str, options: dict) -> dict:
+    """Loads, grids, reduces and exports a single scan.
+    
+    Every scan is loaded as a new Scan that its catalog does not keep, so 
+    nothing from earlier scans is kept alive in the process, and the 
+    catalog's own Scans are left unchanged.
+    """
+
+    from xrdimageutil import nexus
+    from xrdimageutil.structures import Scan
+
+    result = _get_scan_result(uid)
+    try:
+        scan = Scan(catalog=catalog, uid=uid)
+        result["scan_id"] = scan.scan_id
+
+        scan.grid_data(
+            options["shape"], 
+            bounds=options["bounds"], 
+            chunk_size=options["chunk_size"], 
+            **options["grid_options"]
+        )
 
+        roi_outputs = []
+        for roi in options["rois"]:
+            roi.apply_to_scan(scan, "gridded")
+            output = roi.get_output()
+            roi_outputs.append({"data": output["data"], "coords": output["coords"]})
+        result["roi_outputs"] = roi_outputs
 
-def _get_raw_data(scan) -> np.ndarray:
-    """Returns raw detector data and coordinates for a Scan."""
+        if options["output_dir"] is not None:
+            path = os.path.join(options["output_dir"], f"{scan.scan_id}-{uid}.nxs")
+            nexus.write_scan(scan, path, **options["export_options"])
+            result["path"] = path
+    except Exception:
+        result["error"] = traceback.format_exc()
+
+    return result
+
+
+def _get_scan_result(uid: str, error: str=None) -> dict:
+    """Returns an empty pipeline result for a scan."""
+
+    return {
+        "uid": uid,
+        "scan_id": None,
+        "roi_outputs": None,
+        "path": None,
+        "error": error
+    }
+
+
+def _get_gridded_pyramid(gridded_data: dict, gridder: Gridder, levels: int, dtype: np.dtype) -> list:
+    """Returns the data and coordinates of every level of a gridder's pyramid.
+    
+    The full resolution level shares its arrays with the given gridded data.
+    """
+
+    pyramid = [{"data": gridded_data["data"], "coords": gridded_data["coords"]}]
+    for level in gridder.get_pyramid(levels)[1:]:
+        pyramid.append({"data": level.get_data().astype(dtype, copy=False), "coords": level.get_coords()})
+
+    return pyramid
+
+
+def _merge_bounds(bounds_list: list) -> dict:
+    """Returns the smallest HKL bounds that contain every given set of bounds."""
+
+    return {
+        dim: (
+            min(bounds[dim][0] for bounds in bounds_list), 
+            max(bounds[dim][1] for bounds in bounds_list)
+        ) 
+        for dim in ["H", "K", "L"]
+    }
+
+
+def _validate_grid_parameters(shape: tuple, bounds: dict=None, chunk_size: int=None, workers: int=None, pyramid_levels: int=None) -> None:
+    """Raises an error if gridding parameters are invalid."""
+
+    # Shape validation
+    if type(shape) is not tuple:
+        raise TypeError(f"Shape must be a tuple.")
+    if len(shape) != 3:
+        raise ValueError(f"Shape must be of length 3.")
+    for i in shape:
+        if type(i) != int:
+            raise ValueError(f"Dimension shape must consist of integers.")
+        if i < 10:
+            raise ValueError(f"Minimum gridded data shape is (10, 10, 10).")
+
+    # Chunk size validation
+    if chunk_size is not None:
+        if type(chunk_size) != int:
+            raise TypeError(f"Chunk size must be an integer.")
+        if chunk_size < 1:
+            raise ValueError(f"Chunk size must be positive.")
+
+    # Worker count validation
+    if workers is not None:
+        if type(workers) != int:
+            raise TypeError(f"Worker count must be an integer.")
+        if workers < 1:
+            raise ValueError(f"Worker count must be positive.")
+
+    # Pyramid level validation
+    if pyramid_levels is not None:
+        if type(pyramid_levels) != int:
+            raise TypeError(f"Pyramid level count must be an integer.")
+        if pyramid_levels < 0:
+            raise ValueError(f"Pyramid level count must not be negative.")
+        coarsest_shape = list(shape)
+        for _ in range(pyramid_levels):
+            coarsest_shape = [(n + 1) // 2 for n in coarsest_shape]
+        if min(coarsest_shape) < 2:
+            raise ValueError(f"Too many pyramid levels for shape {shape}.")
+
+    # Bounds validation
+    if bounds is not None:
+        if set(list(bounds.keys())) != set(["H", "K", "L"]):
+            raise ValueError(f"Expects 'H', 'K', and 'L' as keys for gridded data bounds.")
+        for i in list(bounds.keys()):
+            if (type(bounds[i]) != tuple and type(bounds[i]) != list) or len(bounds[i]) != 2:
+                raise ValueError(f"Expects a tuple/list (len 2) denoting a min and max value for each dimension.")
+            if bounds[i][0] >= bounds[i][1]:
+                raise ValueError(f"First bound must be less than second bound.")
+
+
+def _get_raw_data(scan, lazy: bool=False) -> np.ndarray:
+    """Returns raw detector data and coordinates for a Scan.
+    
+    Lazy raw data is a dask array chunked by frame, so slicing it only
+    loads the frames that are needed.
+    """
 
     run = scan.bluesky_run
 
     if "primary" not in run.keys():
         return None
     
-    raw_data_unordered = run.primary.read()["pilatus100k_image"].values
+    image_field = _get_geometry_profile(scan).image_field
+    raw_data_unordered = _read_primary_stream(
+        scan, 
+        fields=[image_field], 
+        lazy=lazy
+    )[image_field].data
     raw_data_unordered = np.squeeze(raw_data_unordered)
     raw_data = np.swapaxes(raw_data_unordered, 1, 2)
     raw_data_coords = {
@@ -155,9 +1301,11 @@ def _get_hkl_centers(scan) -> tuple:
     if "primary" not in run.keys():
         return (None, None, None)
     
-    h = run.primary.read()["fourc_h"].values
-    k = run.primary.read()["fourc_k"].values
-    l = run.primary.read()["fourc_l"].values
+    # HKL pseudo-axes are named after the diffractometer device
+    config_device = _get_geometry_profile(scan).config_device
+    hkl_fields = [f"{config_device}_{axis}" for axis in "hkl"]
+    hkl_data = _read_primary_stream(scan, fields=hkl_fields)
+    h, k, l = (hkl_data[field].values for field in hkl_fields)
 
     return (h, k, l)
 
@@ -168,11 +1316,12 @@ def _get_bluesky_1d_variables(scan) -> list:
     if "primary" not in run.keys():
         return []
     
-    vars = list(run.primary.read().keys())
+    scalar_data = _read_primary_stream(scan, scalars_only=True)
+    vars = list(scalar_data.keys())
     vars_1d = []
 
     for v in vars:
-        if run.primary.read()[v].ndim == 1:
+        if scalar_data[v].ndim == 1:
             vars_1d.append(v)
 
     return vars_1d